@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+import serial
+
+from frame_protocol import FrameDecoder
+from frame_source import Frame, FrameStats
+
+
+class AsyncSerialFrameSource:
+    def __init__(self, comport, baudrate = 115200, frame_length = None, frame_format = 'auto', queue_size = 8, max_age_ms = None):
+        """
+        Read frames on the asyncio event loop; iterate with `async for frame in source`.
+        :param comport: Serial port the Teensy is connected to.
+        :param baudrate: Serial baud rate.
+        :param frame_length: Number of values in one complete frame, or None to detect it from the stream.
+        :param frame_format: 'text', 'binary', or 'auto' to detect what the firmware sends.
+        :param queue_size: Number of complete frames kept; older ones are dropped.
+        :param max_age_ms: Discard frames older than this instead of processing them late.
+        """
+        self.comport = comport
+        self.baudrate = baudrate
+        self.decoder = FrameDecoder(frame_length, frame_format)
+        self.frames = asyncio.Queue(maxsize = queue_size)
+        self.serial_port = None
+        self.loop = None
+        self.max_age_ns = None if max_age_ms is None else int(max_age_ms * 1e6)
+        self.stats = FrameStats()
+        self.host_sequence = 0  # Counts text frames, which carry no sequence number
+        self.error = None
+
+    async def open(self):
+        """Open the port and register its file descriptor with the running event loop."""
+        self.loop = asyncio.get_running_loop()
+        # timeout=0 makes every read non-blocking; the loop tells us when data is waiting
+        self.serial_port = serial.Serial(self.comport, self.baudrate, timeout = 0)
+        self.loop.add_reader(self.serial_port.fileno(), self._on_readable)
+        return self
+
+    def close(self):
+        """Unregister the port from the event loop and close it."""
+        if self.serial_port is not None:
+            self.loop.remove_reader(self.serial_port.fileno())
+            self.serial_port.close()
+            self.serial_port = None
+
+    def _on_readable(self):
+        """Called by the event loop whenever the port has bytes waiting."""
+        try:
+            frames = self.decoder.read_from(self.serial_port)
+        except serial.SerialException as error:
+            print(f"\nSerial read failed: {error}")
+            self.error = error
+            self.close()
+            # Wake up the consumer so iteration ends
+            self._put(None)
+            return
+
+        # Stamp the whole batch with the time it arrived
+        timestamp_ns = time.monotonic_ns()
+        sequences = self.decoder.last_sequences
+        if sequences is None:
+            sequences = range(self.host_sequence, self.host_sequence + len(frames))
+            self.host_sequence += len(frames)
+        else:
+            # Firmware sequence numbers are uint32
+            self.stats.sequence_modulus = 2 ** 32
+            sequences = sequences.tolist()
+
+        for values, sequence in zip(frames, sequences):
+            self.stats.record_arrival(sequence)
+            self._put(Frame(values, timestamp_ns, sequence))
+
+    def _put(self, frame):
+        """Queue a frame, dropping the oldest one if the consumer has fallen behind."""
+        if self.frames.full():
+            self.frames.get_nowait()
+            self.stats.skipped_frames += 1
+        self.frames.put_nowait(frame)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            frame = await self.frames.get()
+            # Latest frame wins: skip anything that has been superseded already
+            while not self.frames.empty() and frame is not None:
+                frame = self.frames.get_nowait()
+                self.stats.skipped_frames += 1
+            if frame is None:
+                raise StopAsyncIteration
+            if self.max_age_ns is not None and time.monotonic_ns() - frame.timestamp_ns > self.max_age_ns:
+                self.stats.stale_frames += 1
+                continue
+            self.stats.record_processed(frame)
+            return frame
+
+
+async def detect_stage(pipeline, sensor_data):
+    """Blob detection runs in a worker thread; OpenCV releases the GIL so other I/O keeps going."""
+    return await asyncio.get_running_loop().run_in_executor(None, pipeline.detect, sensor_data)
+
+
+async def track_stage(pipeline, keypoints):
+    """Assign persistent blob IDs on the event loop."""
+    return pipeline.track(keypoints)
+
+
+async def midi_stage(pipeline, blob_positions):
+    """Send the MIDI messages for the tracked blobs on the event loop."""
+    pipeline.play(blob_positions)
+
+
+async def run_pipeline(frames, pipeline):
+    """
+    Drive the detect -> track -> MIDI path from an async iterator of frames.
+    :param frames: Async iterator of Frame records, e.g. AsyncSerialFrameSource.
+    :param pipeline: TouchPipeline that holds the detector, tracker and MIDI converter.
+    """
+    try:
+        async for frame in frames:
+            keypoints = await detect_stage(pipeline, frame.values)
+            blob_positions = await track_stage(pipeline, keypoints)
+            await midi_stage(pipeline, blob_positions)
+    finally:
+        pipeline.stop_all_notes()
+
+
+async def main(comport, baudrate, midi_port_name):
+    from midi_note_grid_complex import MIDINoteGrid
+    from touch_pipeline import TouchPipeline
+
+    pipeline = TouchPipeline(MIDINoteGrid(), midi_port_name)
+    async with AsyncSerialFrameSource(comport, baudrate, max_age_ms = 50) as source:
+        print(f"Connected to {comport}")
+        # Other coroutines (OSC, MIDI input, telemetry) can be gathered alongside this one
+        await run_pipeline(source, pipeline)
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main('/dev/cu.usbmodem126032001', 115200, "IAC Driver TacTile"))
+    except KeyboardInterrupt:
+        pass
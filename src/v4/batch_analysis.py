@@ -0,0 +1,80 @@
+import sys
+import time
+
+import numpy as np
+
+from replay_source import iter_batches, open_recording
+from sensor_geometry import DEFAULT_GEOMETRY
+from touch_labeling import COMPONENT_DTYPE, label_touches, touch_components, touch_mask, touch_pressure
+
+
+# Per-frame summary returned by analyze_frames
+# touch_count: separate touches in the frame
+# touched_cells: cells at or below the threshold
+# pressure: summed pressure of the touched cells
+FRAME_STATS_DTYPE = np.dtype([('touch_count', '<u2'), ('touched_cells', '<u2'), ('pressure', '<f4')])
+
+
+def analyze_frames(frames, threshold_min = 10, min_cells = 1, idle_value = DEFAULT_GEOMETRY.idle_value):
+    """
+    Normalize, threshold and label a whole stack of frames with vectorized NumPy calls.
+    :param frames: (T, rows, cols) array of sensor values.
+    :param threshold_min: Same as the "Thresh Min" trackbar.
+    :param min_cells: Smallest touch, in cells, that is kept.
+    :param idle_value: Value of an untouched cell; pressure is how far below it a cell reads.
+    :return: (frame_stats, touches); frame_stats is a FRAME_STATS_DTYPE array with one entry per frame,
+        touches a touch_labeling.COMPONENT_DTYPE array ordered by frame.
+    """
+    frames = np.asarray(frames)
+    mask = touch_mask(frames, threshold_min)
+    pressure = touch_pressure(frames, mask, idle_value)
+    touches = touch_components(label_touches(mask), pressure)
+    if min_cells > 1:
+        touches = touches[touches['area'] >= min_cells]
+
+    frame_stats = np.zeros(len(frames), dtype = FRAME_STATS_DTYPE)
+    frame_stats['touch_count'] = np.bincount(touches['frame'], minlength = len(frames))
+    frame_stats['touched_cells'] = mask.sum(axis = (1, 2))
+    frame_stats['pressure'] = pressure.sum(axis = (1, 2))
+    return frame_stats, touches
+
+
+def analyze_recording(path, threshold_min = 10, min_cells = 1, batch_frames = 8192, rate_hz = None):
+    """
+    Run analyze_frames over a whole recording, batch by batch.
+    :return: (frame_stats, touches, timestamps); touch frames are numbered from the start of the recording.
+    """
+    recording = open_recording(path, rate_hz)
+    geometry = recording.geometry
+    all_stats, all_touches, all_timestamps = [], [], []
+    frame_offset = 0
+
+    for values, timestamps, _ in iter_batches(recording, batch_frames):
+        values = values.reshape(-1, *geometry.shape)
+        frame_stats, touches = analyze_frames(values, threshold_min, min_cells, geometry.idle_value)
+        touches['frame'] += frame_offset
+        all_stats.append(frame_stats)
+        all_touches.append(touches)
+        all_timestamps.append(timestamps)
+        frame_offset += len(values)
+
+    if not all_stats:
+        return np.zeros(0, FRAME_STATS_DTYPE), np.zeros(0, COMPONENT_DTYPE), np.zeros(0, np.int64)
+    return np.concatenate(all_stats), np.concatenate(all_touches), np.concatenate(all_timestamps)
+
+
+if __name__ == '__main__':
+    # python batch_analysis.py RECORDING... [--threshold=10]
+    paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+
+    for path in paths:
+        started = time.perf_counter()
+        frame_stats, touches, timestamps = analyze_recording(path, int(options.get('threshold', 10)))
+        seconds = time.perf_counter() - started
+        print(f"{path}: {len(frame_stats)} frames, {len(touches)} touches in {seconds:.2f} s "
+              f"({len(frame_stats) / max(seconds, 1e-9):.0f} frames/s)")
+        if len(frame_stats):
+            print(f"  Most simultaneous touches: {frame_stats['touch_count'].max()}, "
+                  f"frames touched: {np.count_nonzero(frame_stats['touch_count'])}, "
+                  f"largest touch: {touches['area'].max() if len(touches) else 0} cells")
@@ -0,0 +1,210 @@
+import math
+
+import cv2
+import numpy as np
+
+from frame_preprocessor import FramePreprocessor
+from native_detector import NativeTouchDetector
+from sensor_geometry import DEFAULT_GEOMETRY
+from touch_labeling import dark_spot, label_touches, touch_mask
+
+
+def create_blob_detector(min_threshold = 10, max_threshold = 255, min_area = 120, max_area = 12000):
+
+    # Initialize blob detector with parameters
+    params = cv2.SimpleBlobDetector_Params()
+
+    '''Thresholding'''
+
+    params.minThreshold = min_threshold
+    params.maxThreshold = max_threshold
+
+    '''------------------------------------------------------------------------'''
+
+    '''Filter by Area'''
+
+    params.filterByArea = True
+
+    params.minArea = min_area
+    params.maxArea = max_area
+
+    '''------------------------------------------------------------------------'''
+
+    '''Filter by Circularity'''
+
+    params.filterByCircularity = False
+
+    params.minCircularity = 0.4  # Adjust this value as needed
+
+    # params.minCircularity = cv2.getTrackbarPos("Circ Min", "Sensor Matrix")
+    # params.maxCircularity = cv2.getTrackbarPos("Circ Max", "Sensor Matrix")
+
+    '''------------------------------------------------------------------------'''
+
+    '''Other Control Toggles'''
+
+    params.filterByConvexity = False
+    params.filterByInertia = False
+
+    return cv2.SimpleBlobDetector_create(params)
+
+
+def equivalent_diameter(pixel_area):
+    """Diameter of a circle with the given area, the size SimpleBlobDetector gives a round blob."""
+    return 2 * math.sqrt(pixel_area / math.pi)
+
+
+# Every backend takes (threshold_min, threshold_max, min_area, max_area, geometry), has detect(frame) returning
+# cv2.KeyPoint objects in display coordinates, and says what detect wants in uses_image:
+# True for the thresholded image from FramePreprocessor.process, False for the raw sensor values.
+# Every backend keeps a blob when min_area <= area < max_area, the test SimpleBlobDetector makes
+
+class SimpleBlobBackend:
+    uses_image = True
+
+    def __init__(self, threshold_min = 10, threshold_max = 255, min_area = 120, max_area = 12000, geometry = DEFAULT_GEOMETRY):
+        """cv2.SimpleBlobDetector, the detector the instrument has always used."""
+        self.detector = create_blob_detector(threshold_min, threshold_max, min_area, max_area)
+
+    def detect(self, thresholded_img):
+        return self.detector.detect(thresholded_img)
+
+
+class ConnectedComponentsBackend:
+    uses_image = True
+
+    def __init__(self, threshold_min = 10, threshold_max = 255, min_area = 120, max_area = 12000, geometry = DEFAULT_GEOMETRY):
+        """
+        One labelling pass of cv2.connectedComponentsWithStats over the thresholded image.
+        The image is already black and white, so SimpleBlobDetector's sweep over several thresholds finds nothing more.
+        """
+        self.min_area = min_area
+        self.max_area = max_area
+
+    def detect(self, thresholded_img):
+        # Touches are the black regions
+        blobs = cv2.compare(thresholded_img, 0, cv2.CMP_EQ)
+        # Grana's block-based labelling is about three times faster here than OpenCV's default choice
+        count, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(blobs, 8, cv2.CV_32S, cv2.CCL_GRANA)
+        keypoints = []
+        for label in range(1, count):
+            area = stats[label, cv2.CC_STAT_AREA]
+            if self.min_area <= area < self.max_area:
+                x, y = centroids[label]
+                keypoints.append(cv2.KeyPoint(float(x), float(y), equivalent_diameter(area)))
+        return keypoints
+
+
+class NumpyLabelBackend:
+    uses_image = False
+
+    def __init__(self, threshold_min = 10, threshold_max = 255, min_area = 120, max_area = 12000, geometry = DEFAULT_GEOMETRY):
+        """
+        Label the touched cells of the raw grid with touch_labeling, in NumPy only.
+        Each touch is a whole 8-connected region. Its position, size and area are those of the black spot
+        the region leaves in the thresholded image (see touch_labeling.dark_spot), so they are within a pixel
+        or two of SimpleBlobDetector's.
+        """
+        self.threshold_min = threshold_min
+        self.min_area = min_area
+        self.max_area = max_area
+        self.geometry = geometry
+        self.preprocessor = FramePreprocessor(geometry)
+
+    def detect(self, sensor_data):
+        values = np.asarray(sensor_data).reshape(self.geometry.shape)
+        mask = touch_mask(values, self.threshold_min)
+        if not mask.any():
+            return []
+        labels = label_touches(mask)
+        grey = self.preprocessor.normalize(values)
+
+        offset = self.geometry.padding_offset
+        keypoints = []
+        for label in np.unique(labels[mask]):
+            area, y, x = dark_spot(self.preprocessor.upsampler, grey, labels == label, self.threshold_min)
+            if self.min_area <= area < self.max_area:
+                keypoints.append(cv2.KeyPoint(float(x + offset), float(y + offset), equivalent_diameter(area)))
+        return keypoints
+
+
+# Backends by the name used on the command line and cycled with 'g'; the first is the default
+DETECTOR_BACKENDS = {
+    'simple-blob': SimpleBlobBackend,
+    'components': ConnectedComponentsBackend,
+    'numpy': NumpyLabelBackend,
+    'native': NativeTouchDetector,
+}
+DEFAULT_DETECTOR = 'simple-blob'
+# How far, in pixels, a backend's median touch size may be from the default detector's; size sets velocity
+SIZE_TOLERANCE = 2.0
+
+
+def create_detector(name = DEFAULT_DETECTOR, threshold_min = 10, threshold_max = 255, min_area = 120, max_area = 12000, geometry = DEFAULT_GEOMETRY):
+    """Build the named detector backend with the trackbar settings."""
+    if name not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector {name!r}, choose from {', '.join(DETECTOR_BACKENDS)}")
+    return DETECTOR_BACKENDS[name](threshold_min, threshold_max, min_area, max_area, geometry)
+
+
+def match_keypoints(results, reference):
+    """
+    Pair every reference keypoint with the nearest keypoint another detector found in the same frame.
+    :param results: Keypoints of the detector being checked, one list per frame.
+    :param reference: Keypoints of the reference detector for the same frames.
+    :return: (offsets, size_errors) lists in pixels; a size error is the nearest keypoint's size minus the reference's.
+    """
+    offsets, size_errors = [], []
+    for result, expected in zip(results, reference):
+        for keypoint in expected if result else []:
+            nearest = min(result, key = lambda other: math.dist(keypoint.pt, other.pt))
+            offsets.append(math.dist(keypoint.pt, nearest.pt))
+            size_errors.append(nearest.size - keypoint.size)
+    return offsets, size_errors
+
+
+def next_detector(name):
+    """The backend after `name` in DETECTOR_BACKENDS, wrapping around."""
+    names = list(DETECTOR_BACKENDS)
+    return names[(names.index(name) + 1) % len(names)]
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from replay_source import open_recording
+    from touch_pipeline import TouchPipeline
+
+    # python blob_detectors.py RECORDING: time every backend and compare its touches with SimpleBlobDetector's;
+    # offset and size error are measured from every reference touch to the backend's nearest one.
+    # Exits with 1 when a backend's median size error is more than SIZE_TOLERANCE
+    recording = open_recording(sys.argv[1])
+    frames = [recording[frame_number].values for frame_number in range(len(recording))]
+    pipeline = TouchPipeline(None, None, geometry = recording.geometry)
+    images = [pipeline.preprocess(values).copy() for values in frames]
+
+    reference = None
+    sizes_within = True
+    for name in DETECTOR_BACKENDS:
+        detector = create_detector(name, geometry = recording.geometry)
+        inputs = images if detector.uses_image else frames
+        started = time.perf_counter()
+        results = [detector.detect(frame) for frame in inputs]
+        seconds = time.perf_counter() - started
+
+        summary = f"{name:12} {seconds / max(len(frames), 1) * 1e3:7.3f} ms/frame, {sum(map(len, results))} touches"
+        if reference is None:
+            reference = results
+        else:
+            same_count = sum(len(result) == len(expected) for result, expected in zip(results, reference))
+            offsets, size_errors = match_keypoints(results, reference)
+            summary += f", same touch count in {same_count}/{len(frames)} frames"
+            if offsets:
+                median_size_error = np.median(size_errors)
+                summary += f", median offset {np.median(offsets):.1f} px, median size error {median_size_error:+.1f} px"
+                if abs(median_size_error) > SIZE_TOLERANCE:
+                    summary += f" (more than {SIZE_TOLERANCE} px)"
+                    sizes_within = False
+        print(summary)
+    sys.exit(0 if sizes_within else 1)
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+DEFAULT_CALIBRATION_PATH = 'calibration.npz'
+
+# A cell reading this far below its baseline would get an absurd gain; it is most likely dead or shorted
+MAX_GAIN = 4.0
+
+# Quantisation alone gives readings about this much spread, even on a cell that captured as perfectly steady
+MIN_NOISE = 2.0
+
+
+class CellCalibration:
+    def __init__(self, baseline, noise, geometry = DEFAULT_GEOMETRY, drift_rate = 0.001, drift_margin = 4.0):
+        """
+        Per-cell baseline and gain so every cell reads the same for the same pressure.
+        A calibrated cell reads value * gain, with gain = idle_value / baseline: its resting reading
+        lands on idle_value and full pressure on 0, so one "Thresh Min" fits every cell.
+        :param baseline: (rows, cols) resting reading of every cell.
+        :param noise: (rows, cols) standard deviation of the resting readings.
+        :param geometry: SensorGeometry of the frames.
+        :param drift_rate: Weight of each frame in the moving average that follows the baselines as they drift; 0 keeps them fixed.
+        :param drift_margin: Cells more than this many noise deviations below their baseline count as touched and do not drift.
+        """
+        self.geometry = geometry
+        self.baseline = np.array(baseline, dtype = np.float64).reshape(geometry.shape)
+        self.noise = np.array(noise, dtype = np.float64).reshape(geometry.shape)
+        self.drift_rate = drift_rate
+        self.drift_margin = drift_margin * np.maximum(self.noise, MIN_NOISE)
+
+        # Reused for every frame
+        self.gain = np.empty(geometry.shape)
+        self.scaled = np.empty(geometry.shape)
+        self.difference = np.empty(geometry.shape)
+        self.untouched = np.empty(geometry.shape, dtype = bool)
+        self.calibrated = np.empty(geometry.shape, dtype = np.uint16)
+        self._update_gain()
+
+    @classmethod
+    def from_frames(cls, frames, geometry = DEFAULT_GEOMETRY, **options):
+        """
+        Calibrate from frames of the surface at rest.
+        :param frames: (frame_count, cells) array; nothing may touch the surface while they are captured.
+        :param options: drift_rate and drift_margin.
+        """
+        frames = np.asarray(frames, dtype = np.float64).reshape(-1, *geometry.shape)
+        return cls(np.median(frames, axis = 0), frames.std(axis = 0), geometry, **options)
+
+    def _update_gain(self):
+        np.maximum(self.baseline, 1, out = self.gain)
+        np.divide(self.geometry.idle_value, self.gain, out = self.gain)
+        np.minimum(self.gain, MAX_GAIN, out = self.gain)
+
+    def track_drift(self, values):
+        """Move the baseline of every untouched cell a drift_rate step towards its current reading."""
+        np.subtract(self.baseline, values, out = self.difference)
+        np.less_equal(self.difference, self.drift_margin, out = self.untouched)
+        self.difference *= -self.drift_rate
+        np.add(self.baseline, self.difference, out = self.baseline, where = self.untouched)
+        self._update_gain()
+
+    def apply(self, sensor_data):
+        """
+        Calibrate one frame, following baseline drift first unless drift_rate is 0.
+        :return: (rows, cols) uint16 array, overwritten by the next frame.
+        """
+        values = np.reshape(sensor_data, self.geometry.shape)
+        if self.drift_rate:
+            self.track_drift(values)
+        np.multiply(values, self.gain, out = self.scaled)
+        self.scaled += 0.5
+        np.clip(self.scaled, 0, self.geometry.idle_value, out = self.scaled)
+        np.copyto(self.calibrated, self.scaled, casting = 'unsafe')
+        return self.calibrated
+
+    def save(self, path = DEFAULT_CALIBRATION_PATH):
+        np.savez_compressed(
+            path, baseline = self.baseline, noise = self.noise, geometry_shape = np.array(self.geometry.shape),
+            idle_value = self.geometry.idle_value, created = time.time())
+
+    @classmethod
+    def load(cls, path = DEFAULT_CALIBRATION_PATH, geometry = DEFAULT_GEOMETRY, **options):
+        with np.load(path) as calibration:
+            if tuple(calibration['geometry_shape']) != geometry.shape:
+                raise ValueError(f"{path} calibrates a {tuple(calibration['geometry_shape'])} matrix, not {geometry.shape}")
+            return cls(calibration['baseline'], calibration['noise'], geometry, **options)
+
+
+class CalibrationCapture:
+    def __init__(self, geometry = DEFAULT_GEOMETRY, frame_count = 200):
+        """
+        Collects frames of the surface at rest for CellCalibration.from_frames.
+        :param frame_count: Frames to collect before the calibration is ready.
+        """
+        self.geometry = geometry
+        self.frames = np.empty((frame_count, geometry.cells), dtype = np.float64)
+        self.frame_count = 0
+
+    @property
+    def done(self):
+        return self.frame_count == len(self.frames)
+
+    def add(self, sensor_data):
+        """Keep one frame; return True once enough frames are in."""
+        if not self.done:
+            self.frames[self.frame_count] = np.ravel(sensor_data)
+            self.frame_count += 1
+        return self.done
+
+    def result(self, **options):
+        return CellCalibration.from_frames(self.frames[:self.frame_count], self.geometry, **options)
+
+
+def load_calibration(path = DEFAULT_CALIBRATION_PATH, geometry = DEFAULT_GEOMETRY, **options):
+    """The saved calibration for this geometry, or None when there is none to use."""
+    if not os.path.exists(path):
+        return None
+    try:
+        calibration = CellCalibration.load(path, geometry, **options)
+    except ValueError as error:
+        print(f"Ignoring calibration: {error}")
+        return None
+    print(f"Loaded calibration from {path}")
+    return calibration
+
+
+if __name__ == '__main__':
+    # python calibration.py RECORDING [--out=calibration.npz]
+    # Calibrate from a recording of the surface at rest instead of pressing 'k' in sensor_display.py
+    from replay_source import open_recording
+
+    paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+
+    recording = open_recording(paths[0])
+    frames = np.concatenate([values for values, _, _ in recording.iter_chunks()])
+    calibration = CellCalibration.from_frames(frames, recording.geometry)
+    calibration.save(options.get('out', DEFAULT_CALIBRATION_PATH))
+    print(f"Calibrated {recording.geometry} from {len(frames)} frames: baseline {calibration.baseline.min():.0f}-{calibration.baseline.max():.0f}, "
+          f"gain {calibration.gain.min():.2f}-{calibration.gain.max():.2f}, noise up to {calibration.noise.max():.1f}")
@@ -0,0 +1,318 @@
+import json
+import lzma
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from frame_source import Frame
+from sensor_geometry import SensorGeometry
+from sparse_frames import decode_sparse_chunk, encode_sparse_chunk
+
+
+# Chunked recording layout:
+#
+#   magic       8 bytes
+#   metadata    METADATA_SIZE bytes of space-padded JSON: geometry, rate, firmware, codec, ...
+#   chunks      each compressed on its own, so any chunk decodes without the ones before it
+#   index       one INDEX_ENTRY per chunk
+#   footer      index offset, chunk count, end magic
+#
+# Inside a chunk the frames are delta-encoded against the previous frame (uint16 arithmetic,
+# so the deltas wrap instead of overflowing) and split into low and high byte planes. Untouched
+# cells barely change between frames, so both planes are mostly zeros and compress well.
+# With encoding 'sparse' a chunk instead holds its first frame plus, for every later frame, only
+# the cells that differ from it by more than the tolerance (see sparse_frames.py).
+MAGIC = b'TTCHUNK1'
+END_MAGIC = b'TTINDEX1'
+METADATA_SIZE = 1024
+INDEX_ENTRY = struct.Struct('<QIIq')  # file offset, compressed size, frame count, first timestamp_ns
+FOOTER = struct.Struct('<QQ8s')
+CHUNKED_EXTENSION = '.ttz'
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset = level), lzma.decompress),
+    'none': (lambda data, level: data, lambda data: data),
+}
+
+
+def encode_chunk(values, timestamps, sequences, encoding = 'delta', tolerance = 0):
+    """Encode one chunk of frames into uncompressed bytes."""
+    timestamp_deltas = np.diff(timestamps, prepend = 0)
+    header = timestamp_deltas.astype('<i8').tobytes() + sequences.astype('<i8').tobytes()
+    if encoding == 'sparse':
+        return header + encode_sparse_chunk(values, tolerance)
+
+    deltas = np.empty_like(values)
+    deltas[0] = values[0]
+    np.subtract(values[1:], values[:-1], out = deltas[1:])
+    byte_planes = deltas.view(np.uint8).reshape(-1, 2).T
+    return header + byte_planes.tobytes()
+
+
+def decode_chunk(data, frame_count, cells, encoding = 'delta'):
+    """Inverse of encode_chunk: return (values, timestamps, sequences)."""
+    timestamps = np.cumsum(np.frombuffer(data, dtype = '<i8', count = frame_count))
+    sequences = np.frombuffer(data, dtype = '<i8', count = frame_count, offset = 8 * frame_count).copy()
+    if encoding == 'sparse':
+        return decode_sparse_chunk(data[16 * frame_count:], frame_count, cells), timestamps, sequences
+
+    byte_planes = np.frombuffer(data, dtype = np.uint8, offset = 16 * frame_count).reshape(2, -1)
+    deltas = byte_planes.T.copy().view('<u2').reshape(frame_count, cells)
+    # uint16 cumsum wraps exactly like the subtraction did
+    values = np.cumsum(deltas, axis = 0, dtype = np.uint16)
+    return values, timestamps, sequences
+
+
+class ChunkedRecordingWriter:
+    def __init__(self, path, geometry, rate_hz = None, firmware = None, codec = 'zlib', level = 6, chunk_frames = 256,
+                 encoding = 'delta', tolerance = 0):
+        """
+        Write frames to a compressed, seekable recording.
+        :param path: File to write; it is overwritten.
+        :param geometry: SensorGeometry of the frames.
+        :param rate_hz: Frame rate to store; None measures it from the timestamps.
+        :param firmware: Firmware description to store, e.g. the version the board reported.
+        :param codec: 'zlib', 'lzma' or 'none'.
+        :param level: Compression level (zlib level or lzma preset).
+        :param chunk_frames: Frames per chunk; larger chunks compress better, smaller ones seek faster.
+        :param encoding: 'delta' (lossless) or 'sparse' (cells within the tolerance of the chunk's first frame are not stored).
+        :param tolerance: Largest deviation the sparse encoding drops; 0 keeps it lossless.
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}, expected one of {', '.join(CODECS)}")
+        self.path = path
+        self.geometry = geometry
+        self.metadata = {
+            'rows': geometry.rows, 'cols': geometry.cols, 'rate_hz': rate_hz, 'firmware': firmware,
+            'codec': codec, 'chunk_frames': chunk_frames, 'encoding': encoding, 'tolerance': tolerance,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.compress = CODECS[codec][0]
+        self.level = level
+        self.chunk_frames = chunk_frames
+        self.encoding = encoding
+        self.tolerance = tolerance
+
+        # The chunk being filled
+        self.values = np.empty((chunk_frames, geometry.cells), dtype = np.uint16)
+        self.timestamps = np.empty(chunk_frames, dtype = np.int64)
+        self.sequences = np.empty(chunk_frames, dtype = np.int64)
+        self.pending = 0
+
+        self.index = []
+        self.frame_count = 0
+        self.first_timestamp_ns = None
+        self.last_timestamp_ns = None
+
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self._write_metadata()
+
+    def _write_metadata(self):
+        metadata = json.dumps(self.metadata).encode()
+        if len(metadata) > METADATA_SIZE:
+            raise ValueError("Recording metadata is too large")
+        self.file.seek(len(MAGIC))
+        self.file.write(metadata.ljust(METADATA_SIZE, b' '))
+
+    def append(self, values, timestamp_ns, sequence):
+        """Add one frame."""
+        self.append_frames(np.asarray(values)[np.newaxis], timestamp_ns, [sequence])
+
+    def append_frames(self, values, timestamp_ns, sequences):
+        """Add a batch of frames; same signature as FrameSource.add_frame_listener."""
+        values = np.asarray(values)
+        timestamps = np.broadcast_to(np.asarray(timestamp_ns, dtype = np.int64), len(values))
+        sequences = np.asarray(sequences, dtype = np.int64)
+        start = 0
+        while start < len(values):
+            count = min(len(values) - start, self.chunk_frames - self.pending)
+            self.values[self.pending:self.pending + count] = values[start:start + count]
+            self.timestamps[self.pending:self.pending + count] = timestamps[start:start + count]
+            self.sequences[self.pending:self.pending + count] = sequences[start:start + count]
+            self.pending += count
+            start += count
+            if self.pending == self.chunk_frames:
+                self._write_chunk()
+
+    def _write_chunk(self):
+        count = self.pending
+        if count == 0:
+            return
+        encoded = encode_chunk(self.values[:count], self.timestamps[:count], self.sequences[:count], self.encoding, self.tolerance)
+        data = self.compress(encoded, self.level)
+        self.index.append((self.file.tell(), len(data), count, int(self.timestamps[0])))
+        self.file.write(data)
+
+        if self.first_timestamp_ns is None:
+            self.first_timestamp_ns = int(self.timestamps[0])
+        self.last_timestamp_ns = int(self.timestamps[count - 1])
+        self.frame_count += count
+        self.pending = 0
+
+    def close(self):
+        """Write the last chunk, the index and the footer, and fill in the measured rate."""
+        self._write_chunk()
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), END_MAGIC))
+
+        self.metadata['frame_count'] = self.frame_count
+        if self.metadata['rate_hz'] is None and self.frame_count > 1 and self.last_timestamp_ns > self.first_timestamp_ns:
+            self.metadata['rate_hz'] = round((self.frame_count - 1) * 1e9 / (self.last_timestamp_ns - self.first_timestamp_ns), 2)
+        self._write_metadata()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ChunkedRecording:
+    def __init__(self, path):
+        """
+        Read a chunked recording; any frame is one index lookup and one chunk decode away.
+        :param path: File written by ChunkedRecordingWriter.
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a chunked TacTile recording")
+        self.metadata = json.loads(self.file.read(METADATA_SIZE))
+        self.geometry = SensorGeometry(self.metadata['rows'], self.metadata['cols'])
+        self.decompress = CODECS[self.metadata['codec']][1]
+        self.chunk_frames = self.metadata['chunk_frames']
+        self.encoding = self.metadata.get('encoding', 'delta')
+
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, chunk_count, end_magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if end_magic != END_MAGIC:
+            raise ValueError(f"{path} has no chunk index; it was not closed properly")
+        self.file.seek(index_offset)
+        index = np.frombuffer(self.file.read(chunk_count * INDEX_ENTRY.size), dtype = np.dtype(
+            [('offset', '<u8'), ('size', '<u4'), ('frame_count', '<u4'), ('first_timestamp_ns', '<i8')]))
+        self.index = index
+        # First frame number of every chunk; every chunk but the last is full
+        self.chunk_starts = np.arange(chunk_count) * self.chunk_frames
+        self.frame_count = int(index['frame_count'].sum())
+
+        self.cached_chunk = None
+        self.cached_data = None
+
+    @property
+    def rate_hz(self):
+        return self.metadata.get('rate_hz')
+
+    def __len__(self):
+        return self.frame_count
+
+    def read_chunk(self, chunk):
+        """Decode one chunk into (values, timestamps, sequences); the last decoded chunk is cached."""
+        if chunk != self.cached_chunk:
+            entry = self.index[chunk]
+            self.file.seek(int(entry['offset']))
+            data = self.decompress(self.file.read(int(entry['size'])))
+            self.cached_data = decode_chunk(data, int(entry['frame_count']), self.geometry.cells, self.encoding)
+            self.cached_chunk = chunk
+        return self.cached_data
+
+    def __getitem__(self, frame_number):
+        """Return one Frame."""
+        if frame_number < 0:
+            frame_number += self.frame_count
+        if not 0 <= frame_number < self.frame_count:
+            raise IndexError(f"Frame {frame_number} out of range for {self.frame_count} frames")
+        chunk, row = divmod(frame_number, self.chunk_frames)
+        values, timestamps, sequences = self.read_chunk(chunk)
+        return Frame(values[row], int(timestamps[row]), int(sequences[row]))
+
+    def frame_at_time(self, timestamp_ns):
+        """Frame number of the last frame at or before the given timestamp."""
+        chunk = max(0, int(np.searchsorted(self.index['first_timestamp_ns'], timestamp_ns, side = 'right')) - 1)
+        _, timestamps, _ = self.read_chunk(chunk)
+        row = max(0, int(np.searchsorted(timestamps, timestamp_ns, side = 'right')) - 1)
+        return int(self.chunk_starts[chunk]) + row
+
+    def iter_chunks(self, start = 0):
+        """Yield (values, timestamps, sequences) batches from frame `start` to the end."""
+        chunk, row = divmod(start, self.chunk_frames)
+        for chunk in range(chunk, len(self.index)):
+            values, timestamps, sequences = self.read_chunk(chunk)
+            yield values[row:], timestamps[row:], sequences[row:]
+            row = 0
+
+    def read_all(self):
+        """Decode the whole recording into (values, timestamps, sequences) arrays."""
+        batches = list(self.iter_chunks())
+        if not batches:
+            return np.empty((0, self.geometry.cells), dtype = np.uint16), np.empty(0, dtype = np.int64), np.empty(0, dtype = np.int64)
+        return tuple(np.concatenate(arrays) for arrays in zip(*batches))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def convert_recording(input_path, output_path = None, rate_hz = None, geometry = None, **writer_options):
+    """
+    Convert a legacy .npy capture or a .ttrec recording into a chunked recording.
+    Legacy captures have no timestamps, so they are synthesized from rate_hz (100 Hz if not given).
+    :param geometry: SensorGeometry of a legacy capture; None infers it from the frame length.
+    :return: Path of the new recording.
+    """
+    output_path = output_path or os.path.splitext(input_path)[0] + CHUNKED_EXTENSION
+
+    if input_path.endswith('.npy'):
+        frames = np.load(input_path, mmap_mode = 'r')
+        if frames.ndim != 2:
+            raise ValueError(f"{input_path} holds {frames.shape} data, not one frame per row")
+        if frames.size and (frames.min() < 0 or frames.max() > np.iinfo(np.uint16).max):
+            raise ValueError(f"{input_path} has values outside the uint16 range")
+        geometry = geometry or SensorGeometry.from_frame_length(frames.shape[1])
+        rate_hz = rate_hz or 100.0
+        values = np.asarray(frames, dtype = np.uint16)
+        timestamps = (np.arange(len(values)) * (1e9 / rate_hz)).astype(np.int64)
+        sequences = np.arange(len(values))
+        writer_options.setdefault('firmware', 'legacy capture, timestamps synthesized')
+    else:
+        from frame_recorder import load_recording
+        records, geometry = load_recording(input_path)
+        values, timestamps, sequences = records['values'], records['timestamp_ns'], records['sequence']
+
+    with ChunkedRecordingWriter(output_path, geometry, rate_hz = rate_hz, **writer_options) as writer:
+        for start in range(0, len(values), writer.chunk_frames):
+            stop = start + writer.chunk_frames
+            writer.append_frames(values[start:stop], timestamps[start:stop], sequences[start:stop])
+    return output_path
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python chunked_recording.py convert archive/*.npy [--codec=lzma] [--rate=100] [--encoding=sparse --tolerance=8]
+    # python chunked_recording.py info recording.ttz
+    command, *paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+
+    for path in paths:
+        if command == 'convert':
+            rate_hz = float(options['rate']) if 'rate' in options else None
+            output_path = convert_recording(path, rate_hz = rate_hz, codec = options.get('codec', 'zlib'),
+                                            encoding = options.get('encoding', 'delta'), tolerance = int(options.get('tolerance', 0)))
+            print(f"{path} ({os.path.getsize(path)} bytes) -> {output_path} ({os.path.getsize(output_path)} bytes)")
+        else:
+            with ChunkedRecording(path) as recording:
+                print(f"{path}: {len(recording)} frames, {recording.geometry}, {len(recording.index)} chunks")
+                print(json.dumps(recording.metadata, indent = 2))
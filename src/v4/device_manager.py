@@ -0,0 +1,186 @@
+import os
+import threading
+
+import serial
+import serial.tools.list_ports
+
+from frame_source import FrameSource, SerialFrameSource
+
+
+# USB IDs of a Teensy running the USB Serial firmware
+TEENSY_VID = 0x16C0
+TEENSY_PID = 0x0483
+
+
+def find_tactile_port(vid = TEENSY_VID, pid = TEENSY_PID, serial_number = None, comport = None, strict = False, exclude = ()):
+    """
+    Find the serial port of a TacTile board.
+    :param vid: USB vendor ID to match, or None to match any.
+    :param pid: USB product ID to match, or None to match any.
+    :param serial_number: USB serial number to match, to pick one board out of several.
+    :param comport: Port name that is used as-is whenever it exists (also works for virtual ports).
+    :param strict: Only accept the configured comport or serial_number; never fall back to the first board
+        with matching USB IDs, which may be somebody else's (another tile of the same surface).
+    :param exclude: Ports that must not be returned, e.g. those other tiles already read.
+    :return: Device path of the matching port, or None if no board is plugged in.
+    """
+    ports = [port for port in serial.tools.list_ports.comports() if port.device not in exclude]
+
+    # An explicitly configured port wins; list_ports does not know about ptys
+    if comport is not None and comport not in exclude and (os.path.exists(comport) or comport in [port.device for port in ports]):
+        return comport
+
+    for port in ports:
+        if strict and serial_number is None:
+            break
+        if serial_number is not None:
+            if port.serial_number == serial_number:
+                return port.device
+        elif port.vid is not None and vid in (None, port.vid) and pid in (None, port.pid):
+            return port.device
+    return None
+
+
+# Guards the claimed_ports sets DeviceManagers share, so two managers never pick the same port at once
+CLAIM_LOCK = threading.Lock()
+
+
+class DeviceManager(FrameSource):
+    def __init__(self, vid = TEENSY_VID, pid = TEENSY_PID, serial_number = None, comport = None, baudrate = 115200,
+                 frame_length = None, frame_format = 'auto', max_age_ms = None, backoff_min = 0.05, backoff_max = 2.0,
+                 strict = False, claimed_ports = None):
+        """
+        Keep a SerialFrameSource connected to the TacTile board, reconnecting after it is unplugged.
+        :param vid: USB vendor ID of the board.
+        :param pid: USB product ID of the board.
+        :param serial_number: USB serial number of the board, to pick one out of several.
+        :param comport: Port name that is used whenever it exists, ahead of USB ID matching.
+        :param baudrate: Serial baud rate.
+        :param frame_length: Number of values in one complete frame, or None to detect it from the stream.
+        :param frame_format: 'text', 'binary', or 'auto' to detect what the firmware sends.
+        :param max_age_ms: Discard frames older than this instead of processing them late.
+        :param backoff_min: First delay in seconds between reconnect attempts.
+        :param backoff_max: Longest delay in seconds between reconnect attempts.
+        :param strict: Only connect to the configured comport or serial_number (see find_tactile_port).
+        :param claimed_ports: Set of ports in use, shared by managers that must not read the same board;
+            this manager adds its port while connected.
+        """
+        self.vid = vid
+        self.pid = pid
+        self.serial_number = serial_number
+        self.comport = comport
+        self.baudrate = baudrate
+        self.frame_length = frame_length
+        self.frame_format = frame_format
+        self.max_age_ms = max_age_ms
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.strict = strict
+        self.claimed_ports = claimed_ports
+
+        self.source = None
+        self.connected_port = None
+        self.ever_connected = False
+        self.reconnects = 0
+        self.running = False
+        self.wake = threading.Event()
+        self.monitor_thread = None
+
+    def start(self):
+        """Try to connect right away, then keep watching the connection in the background."""
+        if self.running:
+            return self
+        self.running = True
+        self._connect()
+        self.monitor_thread = threading.Thread(target = self._monitor_loop, name = "DeviceManager", daemon = True)
+        self.monitor_thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching the connection and close the port."""
+        self.running = False
+        self.wake.set()
+        if self.monitor_thread is not None:
+            self.monitor_thread.join(timeout = 1.0)
+            self.monitor_thread = None
+        self._disconnect()
+
+    @property
+    def connected(self):
+        """True while a board is connected and being read."""
+        source = self.source
+        return source is not None and source.running
+
+    @property
+    def stats(self):
+        """Frame counters of the current connection, or None while disconnected."""
+        source = self.source
+        return source.stats if source is not None else None
+
+    def get_next_frame(self, timeout = 0):
+        """Return the newest Frame from the board, or None while disconnected or with no new frame."""
+        source = self.source
+        if source is None:
+            return None
+        return source.get_next_frame(timeout)
+
+    def _connect(self):
+        """Look for the board and open it; return True on success."""
+        if self.claimed_ports is None:
+            port = find_tactile_port(self.vid, self.pid, self.serial_number, self.comport, self.strict)
+        else:
+            with CLAIM_LOCK:
+                port = find_tactile_port(self.vid, self.pid, self.serial_number, self.comport, self.strict, self.claimed_ports)
+                if port is not None:
+                    self.claimed_ports.add(port)
+        if port is None:
+            return False
+
+        source = SerialFrameSource(port, self.baudrate, self.frame_length, frame_format = self.frame_format, max_age_ms = self.max_age_ms)
+        # Listeners stay attached to the manager across reconnects
+        source.add_frame_listener(self._notify_listeners)
+        try:
+            source.start()
+        except (serial.SerialException, OSError) as error:
+            print(f"\nCould not open {port}: {error}")
+            self._release(port)
+            return False
+
+        if self.ever_connected:
+            self.reconnects += 1
+            print(f"\nReconnected to {port}")
+        else:
+            print(f"Connected to {port}")
+        self.source = source
+        self.connected_port = port
+        self.ever_connected = True
+        return True
+
+    def _disconnect(self):
+        source, self.source = self.source, None
+        if source is not None:
+            source.stop()
+            self._release(self.connected_port)
+
+    def _release(self, port):
+        """Let other managers sharing claimed_ports use the port again."""
+        if self.claimed_ports is not None:
+            with CLAIM_LOCK:
+                self.claimed_ports.discard(port)
+
+    def _monitor_loop(self):
+        """Notice a lost connection and reconnect with exponential backoff."""
+        backoff = self.backoff_min
+        while self.running:
+            if self.connected:
+                backoff = self.backoff_min
+                self.wake.wait(0.05)
+                continue
+
+            if self.source is not None:
+                print(f"\nLost connection to {self.connected_port}, reconnecting...")
+                self._disconnect()
+
+            if not self._connect():
+                self.wake.wait(backoff)
+                backoff = min(backoff * 2, self.backoff_max)
@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from replay_source import iter_batches, open_recording
+from touch_labeling import label_touches, touch_components, touch_mask, touch_pressure
+
+
+EVENT_INDEX_SUFFIX = '.events.npz'
+TOUCH_DOWN, TOUCH_UP = 1, -1
+
+# One touch-down or touch-up
+# frame: frame the finger landed on, or the first frame after it lifted
+# kind: TOUCH_DOWN or TOUCH_UP
+# row, col: pressure-weighted centroid in cells (for a touch-up, where the finger was last)
+# area: touched cells
+# pressure: summed pressure of the touch
+EVENT_DTYPE = np.dtype([('frame', '<i4'), ('kind', 'i1'), ('row', '<f4'), ('col', '<f4'), ('area', '<i2'), ('pressure', '<f4')])
+
+
+def _events(components, kind, frame_offset):
+    """Turn the components that start (or end) a touch into event records."""
+    events = np.zeros(len(components), dtype = EVENT_DTYPE)
+    events['frame'] = components['frame'] + frame_offset
+    events['kind'] = kind
+    for field in ['row', 'col', 'area', 'pressure']:
+        events[field] = components[field]
+    return events
+
+
+class EventIndex:
+    def __init__(self, touch_counts, pressures, timestamps, events, geometry_shape, threshold_min):
+        """
+        Per-frame touch statistics and touch events of one recording; build it with build_event_index.
+        :param touch_counts: Number of separate touches in every frame.
+        :param pressures: Total pressure in every frame.
+        :param timestamps: Timestamp of every frame in ns.
+        :param events: EVENT_DTYPE array ordered by frame.
+        """
+        self.touch_counts = touch_counts
+        self.pressures = pressures
+        self.timestamps = timestamps
+        self.events = events
+        self.geometry_shape = tuple(geometry_shape)
+        self.threshold_min = threshold_min
+
+    def __len__(self):
+        return len(self.touch_counts)
+
+    def frames_with_touches(self, min_count = 1, max_count = None):
+        """Frame numbers with at least min_count (and at most max_count) simultaneous touches."""
+        selected = self.touch_counts >= min_count
+        if max_count is not None:
+            selected &= self.touch_counts <= max_count
+        return np.flatnonzero(selected)
+
+    def find_events(self, kind = None, row = None, col = None, start_frame = None, stop_frame = None):
+        """
+        Events matching every given filter.
+        :param kind: TOUCH_DOWN or TOUCH_UP.
+        :param row: Cell row the touch was centred on.
+        :param col: Cell column the touch was centred on.
+        :param start_frame: First frame to include.
+        :param stop_frame: Frame to stop before.
+        """
+        events = self.events
+        if start_frame is not None or stop_frame is not None:
+            # Events are ordered by frame, so a range is two binary searches
+            start = np.searchsorted(events['frame'], start_frame or 0)
+            stop = len(events) if stop_frame is None else np.searchsorted(events['frame'], stop_frame)
+            events = events[start:stop]
+        selected = np.ones(len(events), dtype = bool)
+        if kind is not None:
+            selected &= events['kind'] == kind
+        if row is not None:
+            selected &= np.rint(events['row']) == row
+        if col is not None:
+            selected &= np.rint(events['col']) == col
+        return events[selected]
+
+    def touch_downs(self, **filters):
+        return self.find_events(TOUCH_DOWN, **filters)
+
+    def touch_ups(self, **filters):
+        return self.find_events(TOUCH_UP, **filters)
+
+    def save(self, path):
+        np.savez_compressed(
+            path, touch_counts = self.touch_counts, pressures = self.pressures, timestamps = self.timestamps,
+            events = self.events, geometry_shape = np.array(self.geometry_shape), threshold_min = self.threshold_min)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as index:
+            return cls(index['touch_counts'], index['pressures'], index['timestamps'], index['events'],
+                       index['geometry_shape'], int(index['threshold_min']))
+
+
+def build_event_index(path, threshold_min = 10, batch_frames = 4096, rate_hz = None):
+    """
+    Scan a recording once and index every frame's touches.
+    Touches are found with the same test as FramePreprocessor.process (see touch_labeling.touch_mask),
+    so the index agrees with what the live pipeline detects.
+    :param path: Recording (.npy, .ttrec or .ttz).
+    :param threshold_min: Same as the "Thresh Min" trackbar.
+    :param batch_frames: Frames labelled together; bounds the memory used.
+    :param rate_hz: Frame rate of a legacy .npy capture, which has no timestamps.
+    """
+    recording = open_recording(path, rate_hz)
+    geometry = recording.geometry
+    touch_counts, pressures, timestamps, events = [], [], [], []
+
+    # The last frame of the previous batch, so touches that continue across batches are not new;
+    # the recording starts from an untouched surface
+    previous_values = geometry.idle_frame.reshape(1, *geometry.shape)
+    frame_offset = 0
+
+    for batch_values, batch_timestamps, _ in iter_batches(recording, batch_frames):
+        values = np.concatenate([previous_values, batch_values.reshape(-1, *geometry.shape)])
+        mask = touch_mask(values, threshold_min)
+        labels = label_touches(mask)
+        pressure = touch_pressure(values, mask, geometry.idle_value)
+        components = touch_components(labels, pressure)
+
+        # Frame 0 is the carried-over frame: it only provides continuity
+        frame_count = len(values) - 1
+        touch_counts.append(np.bincount(components['frame'], minlength = frame_count + 1)[1:].astype(np.uint16))
+        pressures.append(pressure[1:].sum(axis = (1, 2)).astype(np.float32))
+        timestamps.append(batch_timestamps)
+
+        # A touch goes down when none of its cells were touched in the frame before,
+        # and goes up when none of its cells are touched in the frame after
+        still_touched = mask[:-1] & mask[1:]
+        continuing = np.unique(labels[1:][still_touched])
+        persisting = np.unique(labels[:-1][still_touched])
+        downs = components[(components['frame'] >= 1) & ~np.isin(components['label'], continuing)]
+        ups = components[(components['frame'] < frame_count) & ~np.isin(components['label'], persisting)]
+        ups['frame'] += 1
+        batch_events = np.concatenate([_events(downs, TOUCH_DOWN, frame_offset - 1),
+                                       _events(ups, TOUCH_UP, frame_offset - 1)])
+        events.append(batch_events[np.argsort(batch_events['frame'], kind = 'stable')])
+
+        previous_values = values[-1:]
+        frame_offset += frame_count
+
+    if not touch_counts:
+        return EventIndex(np.zeros(0, np.uint16), np.zeros(0, np.float32), np.zeros(0, np.int64),
+                          np.zeros(0, EVENT_DTYPE), geometry.shape, threshold_min)
+    return EventIndex(np.concatenate(touch_counts), np.concatenate(pressures), np.concatenate(timestamps),
+                      np.concatenate(events), geometry.shape, threshold_min)
+
+
+def load_or_build_event_index(path, threshold_min = 10, **options):
+    """Use the side index next to the recording if it is current, otherwise build and save it."""
+    index_path = path + EVENT_INDEX_SUFFIX
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        index = EventIndex.load(index_path)
+        if index.threshold_min == threshold_min:
+            return index
+    index = build_event_index(path, threshold_min, **options)
+    index.save(index_path)
+    return index
+
+
+if __name__ == '__main__':
+    # python event_index.py RECORDING [--threshold=10] [--min-touches=3] [--downs-row=2] [--ups-row=2]
+    paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+
+    for path in paths:
+        started = time.perf_counter()
+        index = load_or_build_event_index(path, int(options.get('threshold', 10)))
+        print(f"{path}: {len(index)} frames, {len(index.events)} events ({time.perf_counter() - started:.2f} s)")
+
+        started = time.perf_counter()
+        if 'min-touches' in options:
+            frames = index.frames_with_touches(int(options['min-touches']))
+            print(f"Frames with >= {options['min-touches']} touches: {len(frames)} {frames[:20].tolist()}")
+        if 'downs-row' in options:
+            downs = index.touch_downs(row = int(options['downs-row']))
+            print(f"Touch-downs in row {options['downs-row']}: {len(downs)} at frames {downs['frame'][:20].tolist()}")
+        if 'ups-row' in options:
+            ups = index.touch_ups(row = int(options['ups-row']))
+            print(f"Touch-ups in row {options['ups-row']}: {len(ups)} at frames {ups['frame'][:20].tolist()}")
+        print(f"Queries took {(time.perf_counter() - started) * 1e3:.2f} ms")
@@ -0,0 +1,86 @@
+import numpy as np
+
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+# ASCII codes used when scanning the raw text stream
+NEWLINE = ord('\n')
+WHITESPACE = np.array([ord(' '), ord('\t'), ord('\r'), NEWLINE], dtype = np.uint8)
+
+
+class TextFrameParser:
+    def __init__(self, frame_length = DEFAULT_GEOMETRY.cells):
+        """
+        Parse the whitespace-separated text frames sent by the Teensy, many lines at a time.
+        :param frame_length: Number of values in one complete frame.
+        """
+        self.frame_length = frame_length
+        self.buffer = bytearray()  # Holds a partial line between reads
+        self.frame_count = 0
+        self.malformed_lines = 0
+
+    def read_from(self, serial_port):
+        """
+        Drain everything waiting on the serial port in one read and parse it.
+        :param serial_port: An open serial.Serial instance.
+        :return: (n_frames, frame_length) uint16 array.
+        """
+        # Block for at least one byte (up to the port timeout) so an idle port does not spin
+        data = serial_port.read(serial_port.in_waiting or 1)
+        return self.feed(data)
+
+    def feed(self, data):
+        """
+        Add raw bytes to the accumulator and parse every complete line.
+        :param data: Bytes received from the port.
+        :return: (n_frames, frame_length) uint16 array of the complete, valid frames.
+        """
+        self.buffer += data
+        last_newline = self.buffer.rfind(b'\n')
+        if last_newline < 0:
+            return np.empty((0, self.frame_length), dtype = np.uint16)
+
+        # Split off the complete lines; the partial tail stays in the accumulator
+        chunk = bytes(self.buffer[:last_newline + 1])
+        del self.buffer[:last_newline + 1]
+
+        return self.parse_lines(chunk)
+
+    def parse_lines(self, chunk):
+        """Convert a block of complete newline-terminated lines into a frame array."""
+        raw = np.frombuffer(chunk, dtype = np.uint8)
+
+        is_newline = raw == NEWLINE
+        is_space = np.isin(raw, WHITESPACE)
+        is_digit = (raw >= ord('0')) & (raw <= ord('9'))
+
+        # Line number of every byte; the newline belongs to the line it ends
+        line_ids = np.cumsum(is_newline) - is_newline
+        line_count = int(is_newline.sum())
+
+        # A token starts wherever a non-space byte follows a space (or the start of the chunk)
+        token_starts = ~is_space
+        token_starts[1:] &= is_space[:-1]
+        tokens_per_line = np.bincount(line_ids[token_starts], minlength = line_count)
+
+        # Anything that is neither a digit nor whitespace spoils its line
+        bad_lines = np.bincount(line_ids[~(is_space | is_digit)], minlength = line_count) > 0
+
+        valid_lines = (tokens_per_line == self.frame_length) & ~bad_lines
+        # Blank lines are not frames, so they are not counted as malformed either
+        self.malformed_lines += int(np.count_nonzero(~valid_lines & (tokens_per_line > 0)))
+
+        if not valid_lines.any():
+            return np.empty((0, self.frame_length), dtype = np.uint16)
+
+        # Convert every valid line in a single call
+        text = raw[valid_lines[line_ids]].tobytes()
+        values = np.fromstring(text, dtype = np.int64, sep = ' ').reshape(-1, self.frame_length)
+
+        # Values that do not fit a uint16 mean the line was garbled
+        in_range = values.max(axis = 1) <= np.iinfo(np.uint16).max
+        self.malformed_lines += int(np.count_nonzero(~in_range))
+
+        frames = values[in_range].astype(np.uint16)
+        self.frame_count += len(frames)
+        return frames
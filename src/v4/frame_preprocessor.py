@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+from sensor_geometry import DEFAULT_GEOMETRY
+from upsampler import DEFAULT_KERNEL, SeparableUpsampler
+
+
+# View modes of render_view, the same numbering as show_threshold in sensor_display.py
+WHITE_VIEW, THRESHOLD_VIEW, RAW_VIEW = 0, 1, 2
+
+
+class FramePreprocessor:
+    def __init__(self, geometry = DEFAULT_GEOMETRY, kernel = DEFAULT_KERNEL):
+        """
+        Turns sensor frames into the upsampled, padded and thresholded images blobs are detected in,
+        with every image preallocated for one geometry, so a frame allocates nothing once it is running.
+        The images returned are overwritten by the next frame; copy any that must be kept.
+        :param geometry: SensorGeometry of the frames.
+        :param kernel: Upsampling kernel (see upsampler.UPSAMPLE_KERNELS); lanczos4 matches cv2.INTER_LANCZOS4 exactly.
+        """
+        self.geometry = geometry
+        self.upsampler = SeparableUpsampler(geometry, kernel)
+        width, height = geometry.image_size
+        offset = geometry.padding_offset
+
+        self.clipped = np.empty(geometry.shape, dtype = np.int32)
+        self.grey = np.empty(geometry.shape, dtype = np.uint8)
+        # The white border never changes, so it is drawn once and the image is resized straight into the middle
+        self.padded_img = np.full((height + 2 * offset, width + 2 * offset), 255, dtype = np.uint8)
+        self.original_img = self.padded_img[offset:offset + height, offset:offset + width]
+        self.thresholded_img = np.empty_like(self.padded_img)
+        self.display_img = np.empty(self.padded_img.shape + (3,), dtype = np.uint8)
+        self.overlay_img = np.empty_like(self.display_img)
+
+    def normalize(self, sensor_data):
+        """
+        Map 10-bit sensor values to 8-bit grey levels (value / 4, rounded down).
+        Glitched readings above idle_value are clipped first so they stay white instead of wrapping around to dark grey levels.
+        """
+        np.minimum(np.reshape(sensor_data, self.geometry.shape), self.geometry.idle_value, out = self.clipped, casting = 'unsafe')
+        np.right_shift(self.clipped, 2, out = self.grey, casting = 'unsafe')
+        return self.grey
+
+    def upsample(self, grey):
+        """Resize the grey levels into the middle of the padded image."""
+        return self.upsampler.upsample(grey, dst = self.original_img)
+
+    def process(self, sensor_data, threshold_min = 10, threshold_max = 255):
+        """
+        Turn one frame of sensor values into images: grey levels resized like cv2.INTER_LANCZOS4 (with the default
+        kernel) inside a white border, and thresholded so everything above threshold_min turns white.
+        :return: (original_img, padded_img, thresholded_img)
+        """
+        self.upsample(self.normalize(sensor_data))
+        cv2.threshold(self.padded_img, threshold_min, threshold_max, cv2.THRESH_BINARY, dst = self.thresholded_img)
+        return self.original_img, self.padded_img, self.thresholded_img
+
+    def render_view(self, mode):
+        """
+        Fill the colour display image for one of the views 't' cycles through.
+        :param mode: WHITE_VIEW, THRESHOLD_VIEW or RAW_VIEW.
+        """
+        if mode == THRESHOLD_VIEW:
+            cv2.cvtColor(self.thresholded_img, cv2.COLOR_GRAY2BGR, dst = self.display_img)
+        elif mode == RAW_VIEW:
+            cv2.cvtColor(self.padded_img, cv2.COLOR_GRAY2BGR, dst = self.display_img)
+        else:
+            self.display_img.fill(255)
+        return self.display_img
@@ -0,0 +1,226 @@
+import binascii
+import struct
+
+import numpy as np
+
+from frame_parser import TextFrameParser
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+# Binary frame layout (all fields little-endian):
+#
+#   sync      2 bytes   0xA5 0x5A
+#   sequence  uint32    frame counter, wraps at 2**32
+#   count     uint16    number of values that follow (rows * cols, 200 for one 10x20 board)
+#   values    count * uint16
+#   crc       uint16    CRC-16/CCITT-FALSE over sequence, count and values
+#
+# 10-bit readings take 2 bytes per cell instead of ~5 in the text format, and
+# need no int parsing on the host.
+SYNC = b'\xA5\x5A'
+HEADER = struct.Struct('<2sIH')
+CRC = struct.Struct('<H')
+CRC_INIT = 0xFFFF
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE, the same checksum the firmware appends to each frame."""
+    return binascii.crc_hqx(data, CRC_INIT)
+
+
+def binary_frame_size(frame_length = DEFAULT_GEOMETRY.cells):
+    """Total size in bytes of one binary frame."""
+    return HEADER.size + 2 * frame_length + CRC.size
+
+
+def encode_binary_frame(values, sequence):
+    """
+    Reference encoder for the binary frame format.
+    :param values: Sequence of sensor values (0-65535).
+    :param sequence: Frame counter; only the low 32 bits are sent.
+    :return: Encoded frame as bytes.
+    """
+    payload = np.asarray(values, dtype = '<u2').tobytes()
+    body = HEADER.pack(SYNC, sequence & 0xFFFFFFFF, len(payload) // 2)[len(SYNC):] + payload
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def encode_text_frame(values):
+    """Reference encoder for the legacy whitespace-separated text format."""
+    return (" ".join(str(int(value)) for value in values) + "\r\n").encode()
+
+
+class BinaryFrameDecoder:
+    def __init__(self, frame_length = DEFAULT_GEOMETRY.cells):
+        """
+        Decode binary frames, resynchronising on the sync header after corruption.
+        :param frame_length: Number of values in one complete frame.
+        """
+        self.frame_length = frame_length
+        self.frame_size = binary_frame_size(frame_length)
+        self.buffer = bytearray()
+        self.frame_count = 0
+        self.crc_errors = 0
+        self.resyncs = 0
+        self.discarded_bytes = 0
+        self.last_sequences = np.empty(0, dtype = np.uint32)
+
+    def read_from(self, serial_port):
+        """Drain everything waiting on the serial port in one read and decode it."""
+        data = serial_port.read(serial_port.in_waiting or 1)
+        return self.feed(data)
+
+    def feed(self, data):
+        """
+        Add raw bytes to the receive buffer and decode every complete frame.
+        :param data: Bytes received from the port.
+        :return: (n_frames, frame_length) uint16 array; their sequence numbers are in last_sequences.
+        """
+        self.buffer += data
+        offsets, sequences = [], []
+        position = 0
+
+        with memoryview(self.buffer) as view:
+            while True:
+                start = self.buffer.find(SYNC, position)
+                if start < 0:
+                    # Keep a trailing byte in case it is the first half of the next sync
+                    tail = max(position, len(self.buffer) - 1)
+                    self.discarded_bytes += tail - position
+                    position = tail
+                    break
+                if start > position:
+                    self.resyncs += 1
+                    self.discarded_bytes += start - position
+                position = start
+
+                if len(self.buffer) - start < HEADER.size:
+                    break
+                _, sequence, count = HEADER.unpack_from(view, start)
+                if count != self.frame_length:
+                    # Not a real header, look for the next sync
+                    position = start + 1
+                    continue
+                if len(self.buffer) - start < self.frame_size:
+                    break
+
+                crc_offset = start + self.frame_size - CRC.size
+                (received_crc,) = CRC.unpack_from(view, crc_offset)
+                if crc16(view[start + len(SYNC):crc_offset]) != received_crc:
+                    self.crc_errors += 1
+                    position = start + 1
+                    continue
+
+                offsets.append(start + HEADER.size)
+                sequences.append(sequence)
+                position = start + self.frame_size
+
+            # Decode straight from the receive buffer
+            frames = np.empty((len(offsets), self.frame_length), dtype = np.uint16)
+            for index, offset in enumerate(offsets):
+                frames[index] = np.frombuffer(view, dtype = '<u2', count = self.frame_length, offset = offset)
+
+        del self.buffer[:position]
+        self.frame_count += len(frames)
+        self.last_sequences = np.array(sequences, dtype = np.uint32)
+        return frames
+
+
+def detect_format(data, frame_length = None, frame_format = 'auto'):
+    """
+    Guess the frame format, and the frame length if it is not known, from the first bytes a device sends.
+    :param frame_length: Number of values in one frame, or None to detect it as well.
+    :param frame_format: 'auto', or the known format when only the length needs detecting.
+    :return: (frame_format, frame_length), or (None, None) if there is not enough data yet.
+    """
+    if frame_format in ('auto', 'binary'):
+        if frame_length is None:
+            # The count field after each sync header says how long the frame is
+            candidates = set()
+            start = data.find(SYNC)
+            while 0 <= start and start + HEADER.size <= len(data) and len(candidates) < 4:
+                candidates.add(HEADER.unpack_from(data, start)[2])
+                start = data.find(SYNC, start + 1)
+        else:
+            candidates = [frame_length]
+        for candidate in candidates:
+            if candidate and len(BinaryFrameDecoder(candidate).feed(data)):
+                return 'binary', candidate
+
+    if frame_format in ('auto', 'text'):
+        # Ignore the first line; the port may have been opened mid-line
+        first_newline = data.find(b'\n')
+        lines = data[first_newline + 1:]
+        candidate = frame_length
+        if candidate is None:
+            counts = [len(line.split()) for line in lines.split(b'\n')[:-1] if line.strip()]
+            candidate = counts[0] if counts else None
+        if first_newline >= 0 and candidate and len(TextFrameParser(candidate).feed(lines)):
+            return 'text', candidate
+
+    return None, None
+
+
+class FrameDecoder:
+    def __init__(self, frame_length = None, frame_format = 'auto', detect_limit = 4):
+        """
+        Decode either frame format, detecting which one the device sends.
+        :param frame_length: Number of values in one complete frame, or None to detect it from the stream.
+        :param frame_format: 'binary', 'text', or 'auto' to detect from the stream.
+        :param detect_limit: Frames' worth of bytes to inspect before giving up on a guess.
+        """
+        self.frame_length = frame_length
+        self.frame_format = None
+        self.requested_format = frame_format
+        self.decoder = None
+        self.pending = bytearray()
+        self.detect_limit = detect_limit * binary_frame_size(frame_length or 1024)
+        if frame_format != 'auto' and frame_length is not None:
+            self._use_format(frame_format)
+
+    def _use_format(self, frame_format):
+        if frame_format == 'binary':
+            self.decoder = BinaryFrameDecoder(self.frame_length)
+        elif frame_format == 'text':
+            self.decoder = TextFrameParser(self.frame_length)
+        else:
+            raise ValueError(f"Unknown frame format: {frame_format}")
+        self.frame_format = frame_format
+
+    def read_from(self, serial_port):
+        """Drain everything waiting on the serial port in one read and decode it."""
+        data = serial_port.read(serial_port.in_waiting or 1)
+        return self.feed(data)
+
+    def feed(self, data):
+        """
+        Decode raw bytes; while the format or length is unknown they are held back until it is detected.
+        :return: (n_frames, frame_length) uint16 array.
+        """
+        if self.decoder is None:
+            self.pending += data
+            frame_format, frame_length = detect_format(bytes(self.pending), self.frame_length, self.requested_format)
+            if frame_format is None:
+                # Keep only a bounded window of undetectable data
+                del self.pending[:-self.detect_limit]
+                return np.empty((0, self.frame_length or 0), dtype = np.uint16)
+            print(f"\nDetected {frame_format} frame format, {frame_length} values per frame")
+            self.frame_length = frame_length
+            self._use_format(frame_format)
+            data = bytes(self.pending)
+            self.pending.clear()
+        return self.decoder.feed(data)
+
+    @property
+    def last_sequences(self):
+        """Sequence numbers of the frames from the last feed, or None for the text format."""
+        return getattr(self.decoder, 'last_sequences', None)
+
+    @property
+    def malformed_frames(self):
+        """Malformed text lines or corrupt binary frames seen so far."""
+        if self.frame_format == 'binary':
+            return self.decoder.crc_errors
+        if self.frame_format == 'text':
+            return self.decoder.malformed_lines
+        return 0
@@ -0,0 +1,283 @@
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from chunked_recording import CHUNKED_EXTENSION, ChunkedRecordingWriter
+from sensor_geometry import SensorGeometry
+
+
+# Recording file layout:
+#
+#   header    64 bytes  magic, version, rows, cols, frame count (updated on every flush)
+#   records   one per frame: timestamp_ns int64, sequence int64, rows * cols uint16 values
+#
+# The file is preallocated and grown by doubling; the frame count in the header says how many
+# records are valid, so a crash loses at most the frames since the last flush.
+MAGIC = b'TTREC\x00\x00\x01'
+HEADER = struct.Struct('<8sIIIxxxxQ')
+HEADER_SIZE = 64
+RECORDING_EXTENSION = '.ttrec'
+
+
+def record_dtype(cells):
+    """NumPy dtype of one frame record."""
+    return np.dtype([('timestamp_ns', '<i8'), ('sequence', '<i8'), ('values', '<u2', (cells,))])
+
+
+class MemmapFrameRecorder:
+    def __init__(self, path, geometry, initial_capacity = 4096, flush_every = 256):
+        """
+        Append frames to a preallocated, growable memory-mapped file.
+        :param path: File to record to; it is overwritten.
+        :param geometry: SensorGeometry of the frames.
+        :param initial_capacity: Frames the file holds before it is grown for the first time.
+        :param flush_every: Frames between flushes to disk.
+        """
+        self.path = path
+        self.geometry = geometry
+        self.dtype = record_dtype(geometry.cells)
+        self.flush_every = flush_every
+        self.frame_count = 0
+        self.unflushed = 0
+
+        with open(path, 'wb') as recording_file:
+            recording_file.write(self._header().ljust(HEADER_SIZE, b'\x00'))
+        self._map(initial_capacity)
+
+    def _header(self):
+        return HEADER.pack(MAGIC, 1, self.geometry.rows, self.geometry.cols, self.frame_count)
+
+    def _map(self, capacity):
+        """(Re)map the file with room for `capacity` records."""
+        with open(self.path, 'r+b') as recording_file:
+            recording_file.truncate(HEADER_SIZE + capacity * self.dtype.itemsize)
+        self.capacity = capacity
+        self.records = np.memmap(self.path, dtype = self.dtype, mode = 'r+', offset = HEADER_SIZE, shape = (capacity,))
+
+    def append(self, values, timestamp_ns, sequence):
+        """Write one frame."""
+        self.append_frames(np.asarray(values)[np.newaxis], timestamp_ns, [sequence])
+
+    def append_frames(self, values, timestamp_ns, sequences):
+        """
+        Write a batch of frames; the file grows by doubling when it is full.
+        :param values: (n_frames, cells) array.
+        :param timestamp_ns: Arrival time of the batch, or one per frame.
+        :param sequences: Sequence number of each frame.
+        """
+        count = len(values)
+        if self.frame_count + count > self.capacity:
+            self.records.flush()
+            capacity = self.capacity
+            while self.frame_count + count > capacity:
+                capacity *= 2
+            self._map(capacity)
+
+        records = self.records[self.frame_count:self.frame_count + count]
+        records['timestamp_ns'] = timestamp_ns
+        records['sequence'] = np.asarray(sequences)
+        records['values'] = values
+        self.frame_count += count
+
+        self.unflushed += count
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Push the written frames to disk, then publish the new frame count."""
+        self.records.flush()
+        with open(self.path, 'r+b') as recording_file:
+            recording_file.write(self._header())
+        self.unflushed = 0
+
+    def close(self):
+        """Flush and trim the preallocated space that was never used."""
+        self.flush()
+        self.records = None
+        with open(self.path, 'r+b') as recording_file:
+            recording_file.truncate(HEADER_SIZE + self.frame_count * self.dtype.itemsize)
+
+
+class BackgroundRecorder:
+    def __init__(self, path, geometry, queue_size = 4096, **recorder_options):
+        """
+        Record from the live loop: frames are queued and written to disk on a separate thread.
+        :param path: File to record to.
+        :param geometry: SensorGeometry of the frames.
+        :param queue_size: Batches of frames that can wait for the writer before new ones are dropped.
+        """
+        self.recorder = MemmapFrameRecorder(path, geometry, **recorder_options)
+        self.frames = queue.Queue(maxsize = queue_size)
+        self.dropped_frames = 0
+        self.rejected_frames = 0  # Frames of another size than the geometry, never queued
+        self.error = None  # What stopped the writer thread, raised again by close()
+        self.writer_thread = threading.Thread(target = self._write_loop, name = "BackgroundRecorder", daemon = True)
+        self.writer_thread.start()
+
+    @property
+    def path(self):
+        return self.recorder.path
+
+    @property
+    def frame_count(self):
+        return self.recorder.frame_count
+
+    def record(self, values, timestamp_ns = None, sequence = -1):
+        """Queue one frame without waiting for the disk."""
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        self.record_frames(np.asarray(values)[np.newaxis], timestamp_ns, [sequence])
+
+    def record_frames(self, values, timestamp_ns, sequences):
+        """
+        Queue a batch of frames; the signature matches FrameSource.add_frame_listener.
+        Values are copied so the caller can reuse its buffer; a full queue drops the batch.
+        Frames of the wrong size are refused here, on the caller's thread, so they never reach the writer.
+        """
+        if len(values) == 0 or len(values[0]) != self.recorder.geometry.cells:
+            self.rejected_frames += len(values)
+            return
+        batch = (np.array(values, dtype = np.uint16), timestamp_ns, list(sequences))
+        try:
+            self.frames.put_nowait(batch)
+        except queue.Full:
+            self.dropped_frames += len(batch[0])
+
+    def _write_loop(self):
+        try:
+            while True:
+                batch = self.frames.get()
+                if batch is None:
+                    break
+                self.recorder.append_frames(*batch)
+        except Exception as error:
+            # Keep it for close(); the frames queued after it are lost
+            self.error = error
+
+    def close(self):
+        """Write the remaining queued frames and close the file; raise whatever stopped the writer."""
+        # A writer that died no longer empties the queue, so never wait on a full one
+        while self.writer_thread.is_alive():
+            try:
+                self.frames.put(None, timeout = 0.1)
+                break
+            except queue.Full:
+                continue
+        self.writer_thread.join()
+        self.recorder.close()
+        if self.error is not None:
+            raise self.error
+
+
+def load_recording(path):
+    """
+    Open a recording without reading it into memory.
+    :return: (records, geometry); records is a read-only memmap with fields timestamp_ns, sequence and values.
+    """
+    with open(path, 'rb') as recording_file:
+        magic, version, rows, cols, frame_count = HEADER.unpack(recording_file.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a TacTile recording")
+
+    geometry = SensorGeometry(rows, cols)
+    dtype = record_dtype(geometry.cells)
+    # The header count only covers flushed frames; anything after it may be half written
+    frame_count = min(frame_count, (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize)
+    if frame_count == 0:
+        return np.zeros(0, dtype = dtype), geometry
+    records = np.memmap(path, dtype = dtype, mode = 'r', offset = HEADER_SIZE, shape = (frame_count,))
+    return records, geometry
+
+
+def new_recording_path(directory = "recordings", prefix = "session", extension = RECORDING_EXTENSION):
+    """Timestamped file name for a new recording."""
+    os.makedirs(directory, exist_ok = True)
+    return os.path.join(directory, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}{extension}")
+
+
+class PreRollBuffer:
+    def __init__(self, geometry, seconds = 10.0, max_rate_hz = 1000):
+        """
+        Always keep the last few seconds of frames, so a take can be saved after something went wrong.
+        Everything is preallocated; recording a frame only copies it into the next slot.
+        :param geometry: SensorGeometry of the frames.
+        :param seconds: How much history to keep.
+        :param max_rate_hz: Highest frame rate expected; sizes the ring.
+        """
+        self.geometry = geometry
+        self.seconds = seconds
+        self.capacity = int(seconds * max_rate_hz)
+        self.values = np.zeros((self.capacity, geometry.cells), dtype = np.uint16)
+        self.timestamps = np.zeros(self.capacity, dtype = np.int64)
+        self.sequences = np.zeros(self.capacity, dtype = np.int64)
+        self.write_count = 0
+        self.lock = threading.Lock()
+
+    def record(self, values, timestamp_ns = None, sequence = -1):
+        """Copy one frame into the ring."""
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        with self.lock:
+            slot = self.write_count % self.capacity
+            self.values[slot] = values
+            self.timestamps[slot] = timestamp_ns
+            self.sequences[slot] = sequence
+            self.write_count += 1
+
+    def record_frames(self, values, timestamp_ns, sequences):
+        """Copy a batch of frames into the ring; the signature matches FrameSource.add_frame_listener."""
+        if len(values) == 0 or len(values[0]) != self.geometry.cells:
+            return
+        count = len(values)
+        skipped = 0
+        if count > self.capacity:
+            # Only the newest frames fit; the older ones still count as written
+            values, sequences = values[-self.capacity:], sequences[-self.capacity:]
+            skipped = count - self.capacity
+            count = self.capacity
+        with self.lock:
+            self.write_count += skipped
+            # At most two slice copies: up to the end of the ring, then from its start
+            start = self.write_count % self.capacity
+            first = min(count, self.capacity - start)
+            self.values[start:start + first] = values[:first]
+            self.timestamps[start:start + first] = timestamp_ns
+            self.sequences[start:start + first] = sequences[:first]
+            if first < count:
+                self.values[:count - first] = values[first:]
+                self.timestamps[:count - first] = timestamp_ns
+                self.sequences[:count - first] = sequences[first:]
+            self.write_count += count
+
+    def snapshot(self):
+        """Copy out the frames of the last `seconds`, oldest first, as (values, timestamps, sequences)."""
+        with self.lock:
+            count = min(self.write_count, self.capacity)
+            # Oldest first: the slots after the write position, then the ones before it
+            order = np.arange(self.write_count - count, self.write_count) % self.capacity
+            values, timestamps, sequences = self.values[order], self.timestamps[order], self.sequences[order]
+        if count:
+            keep = timestamps >= timestamps[-1] - int(self.seconds * 1e9)
+            values, timestamps, sequences = values[keep], timestamps[keep], sequences[keep]
+        return values, timestamps, sequences
+
+    def dump(self, path = None):
+        """
+        Save the buffered frames as a chunked recording on a background thread.
+        :return: (path, thread) so the caller can wait for the file if it needs to.
+        """
+        path = path or new_recording_path(prefix = "preroll", extension = CHUNKED_EXTENSION)
+        values, timestamps, sequences = self.snapshot()
+
+        def write():
+            with ChunkedRecordingWriter(path, self.geometry) as writer:
+                writer.append_frames(values, timestamps, sequences)
+            print(f"Saved the last {len(values)} frames to {path}")
+
+        thread = threading.Thread(target = write, name = "PreRollDump", daemon = True)
+        thread.start()
+        return path, thread
@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+import serial
+
+from frame_protocol import FrameDecoder
+
+
+# One sensor frame as handed to the processing loop
+# values: uint16 array of sensor readings
+# timestamp_ns: time.monotonic_ns() when the bytes arrived on the host
+# sequence: frame counter (from the firmware for binary frames, counted on the host for text)
+Frame = namedtuple('Frame', ['values', 'timestamp_ns', 'sequence'])
+
+
+class FrameStats:
+    def __init__(self, sequence_modulus = None):
+        """
+        Counters that make the ingest latency and losses observable.
+        :param sequence_modulus: Value the sequence numbers wrap at, or None if they never wrap.
+        """
+        self.sequence_modulus = sequence_modulus
+        self.received_frames = 0
+        self.processed_frames = 0
+        self.skipped_frames = 0  # Superseded by a newer frame before the loop got to them
+        self.stale_frames = 0  # Newest frame, but already older than the allowed age
+        self.dropped_frames = 0  # Gaps in the sequence numbers, lost before reaching the host
+        self.overwritten_frames = 0  # Overwritten in a ring buffer before frame listeners were handed them
+        self.last_sequence = None
+        self.last_latency_ns = 0
+        self.max_latency_ns = 0
+
+    def record_arrival(self, sequence):
+        """Count a received frame and any sequence numbers missing before it."""
+        self.received_frames += 1
+        if self.last_sequence is not None:
+            gap = sequence - self.last_sequence - 1
+            if self.sequence_modulus:
+                gap %= self.sequence_modulus
+                # A huge forward gap is really the counter restarting, not lost frames
+                if gap >= self.sequence_modulus // 2:
+                    gap = 0
+            self.dropped_frames += max(0, gap)
+        self.last_sequence = sequence
+
+    def record_processed(self, frame):
+        """Count a frame handed to the processing loop and how old it was."""
+        self.processed_frames += 1
+        self.last_latency_ns = time.monotonic_ns() - frame.timestamp_ns
+        self.max_latency_ns = max(self.max_latency_ns, self.last_latency_ns)
+
+    def __str__(self):
+        overwritten = f"Overwritten: {self.overwritten_frames}\t" if self.overwritten_frames else ""
+        return (f"Received: {self.received_frames}\tProcessed: {self.processed_frames}\t"
+                f"Skipped: {self.skipped_frames}\tStale: {self.stale_frames}\tDropped: {self.dropped_frames}\t{overwritten}"
+                f"Latency: {self.last_latency_ns / 1e6:.1f} ms (max {self.max_latency_ns / 1e6:.1f} ms)")
+
+
+class LatestFrameBuffer:
+    def __init__(self, capacity = 8, max_age_ms = None, sequence_modulus = None):
+        """
+        Bounded, thread-safe frame buffer with a latest-frame-wins policy.
+        :param capacity: Number of frames kept; the oldest are dropped when full.
+        :param max_age_ms: A newest frame older than this is discarded; None processes it however old.
+        :param sequence_modulus: Value the sequence numbers wrap at, or None if they never wrap.
+        """
+        self.frames = deque(maxlen = capacity)
+        self.max_age_ns = None if max_age_ms is None else int(max_age_ms * 1e6)
+        self.stats = FrameStats(sequence_modulus)
+        self.frame_ready = threading.Condition()
+
+    def put(self, values, timestamp_ns, sequences):
+        """
+        Add a batch of frames that arrived together.
+        :param values: (n_frames, frame_length) array.
+        :param timestamp_ns: Arrival time shared by the whole batch.
+        :param sequences: Sequence number of each frame.
+        """
+        with self.frame_ready:
+            for frame_values, sequence in zip(values, sequences):
+                self.stats.record_arrival(sequence)
+                if len(self.frames) == self.frames.maxlen:
+                    self.stats.skipped_frames += 1
+                self.frames.append(Frame(frame_values, timestamp_ns, sequence))
+            self.frame_ready.notify()
+
+    def get_latest(self, timeout = 0):
+        """Return the newest frame, discarding older ones and a stale newest one; None if there is none."""
+        with self.frame_ready:
+            if not self.frames and timeout:
+                self.frame_ready.wait(timeout)
+            if not self.frames:
+                return None
+            frame = self.frames.pop()
+            self.stats.skipped_frames += len(self.frames)
+            self.frames.clear()
+
+        if self.max_age_ns is not None and time.monotonic_ns() - frame.timestamp_ns > self.max_age_ns:
+            self.stats.stale_frames += 1
+            return None
+        self.stats.record_processed(frame)
+        return frame
+
+
+class FrameSource:
+    """Base class for anything that hands sensor frames to the display/MIDI loop."""
+
+    # Called with (values, timestamp_ns, sequences) for every batch of frames as it arrives,
+    # including frames the loop later skips; replaced rather than mutated so readers never see it change
+    frame_listeners = ()
+
+    def add_frame_listener(self, listener):
+        """Receive every frame, e.g. to record it, without waiting for the processing loop."""
+        self.frame_listeners = tuple(self.frame_listeners) + (listener,)
+
+    def remove_frame_listener(self, listener):
+        self.frame_listeners = tuple(other for other in self.frame_listeners if other != listener)
+
+    def _notify_listeners(self, values, timestamp_ns, sequences):
+        for listener in self.frame_listeners:
+            listener(values, timestamp_ns, sequences)
+
+    def start(self):
+        """Start producing frames."""
+        return self
+
+    def stop(self):
+        """Stop producing frames and release any resources."""
+        pass
+
+    def get_next_frame(self, timeout = 0):
+        """
+        Return the newest Frame that has not been returned yet, or None.
+        :param timeout: Seconds to wait for a new frame; 0 never blocks.
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class SerialFrameSource(FrameSource):
+    def __init__(self, comport, baudrate = 115200, frame_length = None, buffer_size = 8, frame_format = 'auto', max_age_ms = None):
+        """
+        Read frames from the Teensy on a dedicated thread.
+        :param comport: Serial port the Teensy is connected to.
+        :param baudrate: Serial baud rate.
+        :param frame_length: Number of values in one complete frame, or None to detect it from the stream.
+        :param buffer_size: Number of complete frames kept; older ones are dropped.
+        :param frame_format: 'text', 'binary', or 'auto' to detect what the firmware sends.
+        :param max_age_ms: Discard frames older than this instead of processing them late.
+        """
+        self.comport = comport
+        self.baudrate = baudrate
+        self.buffer = LatestFrameBuffer(buffer_size, max_age_ms)
+        self.parser = FrameDecoder(frame_length, frame_format)
+        self.host_sequence = 0  # Counts text frames, which carry no sequence number
+        self.serial_port = None
+        self.reader_thread = None
+        self.running = False
+
+    def start(self):
+        """Open the port once and start the reader thread."""
+        if self.running:
+            return self
+        self.serial_port = serial.Serial(self.comport, self.baudrate, timeout = 0.1)
+        self.running = True
+        self.reader_thread = threading.Thread(target = self._read_loop, name = "SerialFrameSource", daemon = True)
+        self.reader_thread.start()
+        return self
+
+    def stop(self):
+        """Stop the reader thread and close the port."""
+        self.running = False
+        if self.reader_thread is not None:
+            self.reader_thread.join(timeout = 1.0)
+            self.reader_thread = None
+        if self.serial_port is not None:
+            self.serial_port.close()
+            self.serial_port = None
+
+    def get_next_frame(self, timeout = 0):
+        """Return the newest complete frame not yet handed out, or None if there is none."""
+        return self.buffer.get_latest(timeout)
+
+    def _read_loop(self):
+        """Continuously drain the port in bulk and keep the complete frames."""
+        while self.running:
+            try:
+                frames = self.parser.read_from(self.serial_port)
+            except serial.SerialException as error:
+                print(f"\nSerial read failed: {error}")
+                self.running = False
+                break
+
+            if len(frames):
+                # Stamp the whole batch with the time it arrived
+                timestamp_ns = time.monotonic_ns()
+                sequences = self._sequences(len(frames))
+                self.buffer.put(frames, timestamp_ns, sequences)
+                self._notify_listeners(frames, timestamp_ns, sequences)
+
+    def _sequences(self, count):
+        """Sequence numbers for the frames just decoded."""
+        sequences = self.parser.last_sequences
+        if sequences is not None:
+            # Firmware sequence numbers are uint32
+            self.buffer.stats.sequence_modulus = 2 ** 32
+            return sequences.tolist()
+        start = self.host_sequence
+        self.host_sequence += count
+        return range(start, self.host_sequence)
+
+    @property
+    def frame_length(self):
+        """Number of values per frame, once configured or detected."""
+        return self.parser.frame_length
+
+    @property
+    def stats(self):
+        """Received, skipped, stale and dropped frame counters."""
+        return self.buffer.stats
+
+    @property
+    def malformed_frames(self):
+        """Number of malformed text lines or corrupt binary frames received."""
+        return self.parser.malformed_frames
@@ -12,8 +12,11 @@ class MIDINote:
         self.output_port = None
 
     def open_midi_port(self, port_name = "Python MIDI Out"):
-        """Opens the MIDI output port to send messages."""
-        self.output_port = mido.open_output(port_name)
+        """Opens the MIDI output port to send messages; an already open port (anything with send) is used as-is."""
+        if hasattr(port_name, 'send'):
+            self.output_port = port_name
+        else:
+            self.output_port = mido.open_output(port_name)
 
     def send_note_on(self):
         """Sends a Note On message."""
@@ -0,0 +1,123 @@
+import math
+
+import cv2
+import numpy as np
+
+from frame_preprocessor import FramePreprocessor
+from sensor_geometry import DEFAULT_GEOMETRY
+from touch_labeling import dark_spot, touch_mask
+
+
+# The 8 neighbours of a cell; the first four come before it in raster order
+NEIGHBOUR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+class NativeTouchDetector:
+    uses_image = False
+
+    def __init__(self, threshold_min = 10, threshold_max = 255, min_area = 120, max_area = 12000, geometry = DEFAULT_GEOMETRY):
+        """
+        Find touches directly on the rows x cols sensor grid instead of on the upscaled image.
+        A touch is a touched cell that reads lower than its 8 neighbours, together with the touched cells around it.
+        Its position, size and area are those of the black spot those cells leave in the thresholded image,
+        measured by upsampling only the cells around the touch (see touch_labeling.dark_spot), so they are
+        within a pixel or two of SimpleBlobDetector's and the area trackbars mean the same.
+        :param threshold_min: Same as the "Thresh Min" trackbar: a cell is touched when value / 4 is not above it.
+        :param threshold_max: Unused; taken so every detector backend is built the same way (see blob_detectors).
+        :param min_area: Same as the "Area Min" trackbar, in display pixels.
+        :param max_area: Same as the "Area Max" trackbar, in display pixels.
+        :param geometry: SensorGeometry of the frames; keypoints come out in its display coordinates.
+        """
+        self.threshold_min = threshold_min
+        self.min_area = min_area
+        self.max_area = max_area
+        self.geometry = geometry
+        self.preprocessor = FramePreprocessor(geometry)
+
+    def find_touches(self, sensor_data):
+        """
+        Locate the touches of one frame on the grid.
+        :return: (ys, xs, areas) arrays; the centroid of each touch's black spot in pixels of the upsampled image,
+            and the spot's area in pixels.
+        """
+        values = np.asarray(sensor_data, dtype = np.int32).reshape(self.geometry.shape)
+        rows, cols = values.shape
+        touched = touch_mask(values, self.threshold_min)
+        if not touched.any():
+            empty = np.zeros(0)
+            return empty, empty, empty
+
+        # Neighbourhood test: touched and darker than every neighbour. Ties go to the first cell in
+        # raster order, so a flat-bottomed touch still gives one peak
+        padded = np.pad(values, 1, constant_values = np.iinfo(np.int32).max)
+        peaks = touched.copy()
+        for index, (row_offset, col_offset) in enumerate(NEIGHBOUR_OFFSETS):
+            neighbour = padded[1 + row_offset:1 + row_offset + rows, 1 + col_offset:1 + col_offset + cols]
+            peaks &= (values < neighbour) if index < 4 else (values <= neighbour)
+
+        grey = self.preprocessor.normalize(values)
+        spots = []
+        for peak_row, peak_col in zip(*np.nonzero(peaks)):
+            # The touched cells of the 3x3 window around the peak
+            cells = np.zeros_like(touched)
+            window = np.s_[max(peak_row - 1, 0):peak_row + 2, max(peak_col - 1, 0):peak_col + 2]
+            cells[window] = touched[window]
+            spots.append(dark_spot(self.preprocessor.upsampler, grey, cells, self.threshold_min))
+        areas, ys, xs = (np.array(column, dtype = np.float64) for column in zip(*spots))
+        return ys, xs, areas
+
+    def detect(self, sensor_data):
+        """
+        Detect touches in one frame of sensor values.
+        :return: List of cv2.KeyPoint in the padded display image's coordinates, like SimpleBlobDetector's,
+            so PersistentBlobTracker and BlobToMIDIConverter use them unchanged.
+        """
+        ys, xs, areas = self.find_touches(sensor_data)
+        offset = self.geometry.padding_offset
+
+        keypoints = []
+        for y, x, area in zip(ys, xs, areas):
+            if not self.min_area <= area < self.max_area:
+                continue
+            # Diameter of a circle as large as the black spot
+            size = 2 * math.sqrt(area / math.pi)
+            keypoints.append(cv2.KeyPoint(float(x + offset), float(y + offset), size))
+        return keypoints
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from replay_source import open_recording
+    from touch_pipeline import TouchPipeline
+
+    # Compare with the SimpleBlobDetector path on a recording: positions and time per frame
+    recording = open_recording(sys.argv[1])
+    native_detector = NativeTouchDetector(geometry = recording.geometry)
+    pipeline = TouchPipeline(None, None, geometry = recording.geometry)
+
+    native_seconds = blob_seconds = 0.0
+    offsets, size_errors = [], []
+    for frame_number in range(len(recording)):
+        values = recording[frame_number].values
+        started = time.perf_counter()
+        native_keypoints = native_detector.detect(values)
+        native_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        blob_keypoints = pipeline.detect(values)
+        blob_seconds += time.perf_counter() - started
+
+        for blob_keypoint in blob_keypoints:
+            if native_keypoints:
+                nearest = min(native_keypoints, key = lambda native_keypoint: math.dist(blob_keypoint.pt, native_keypoint.pt))
+                offsets.append(math.dist(blob_keypoint.pt, nearest.pt))
+                size_errors.append(nearest.size - blob_keypoint.size)
+
+    frame_count = max(len(recording), 1)
+    print(f"{len(recording)} frames")
+    print(f"SimpleBlobDetector path: {blob_seconds / frame_count * 1e3:.3f} ms/frame")
+    print(f"Native detector:         {native_seconds / frame_count * 1e3:.3f} ms/frame")
+    if offsets:
+        print(f"Distance to the nearest native touch: median {np.median(offsets):.1f} px, max {np.max(offsets):.1f} px")
+        print(f"Its size minus the blob's: median {np.median(size_errors):+.1f} px, largest {max(size_errors, key = abs):+.1f} px")
@@ -0,0 +1,181 @@
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import mido
+
+from chunked_recording import CHUNKED_EXTENSION
+from frame_recorder import RECORDING_EXTENSION
+from midi_note_grid_complex import MIDINoteGrid
+from replay_source import open_recording
+from touch_pipeline import TouchPipeline
+from upsampler import DEFAULT_KERNEL
+
+
+RECORDING_EXTENSIONS = ('.npy', RECORDING_EXTENSION, CHUNKED_EXTENSION)
+# MIDINoteGrid's tuning setters by the name used on the command line
+TUNINGS = {
+    'standard': MIDINoteGrid.set_standard_tuning,
+    'drop-d': MIDINoteGrid.set_drop_d_tuning,
+    'fourths': MIDINoteGrid.set_perfect_fourths_tuning,
+}
+
+# Finds the same touches as the live default, one blob per black region of the same thresholded image, at
+# ~2.5 ms/frame instead of simple-blob's ~14, so a 100 Hz recording renders about four times faster than real time.
+# The notes are the same; velocities can differ by a step or two and simultaneous touches may swap channels
+OFFLINE_DETECTOR = 'components'
+
+
+class MidiFilePort:
+    def __init__(self, ticks_per_beat = 480, tempo = 500000):
+        """
+        Stand-in for a MIDI output port that collects messages for a Standard MIDI File.
+        Messages are placed at the recorded time of the frame being processed, set in `now_ns`.
+        """
+        self.name = "MIDI file"
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo = tempo
+        self.now_ns = 0
+        self.start_ns = None
+        self.messages = []  # (time in ns since the first frame, message)
+
+    def send(self, message):
+        self.messages.append((self.now_ns - self.start_ns, message))
+
+    def to_midi_file(self):
+        """One-track MidiFile with the collected messages at their recorded times."""
+        midi_file = mido.MidiFile(ticks_per_beat = self.ticks_per_beat)
+        track = mido.MidiTrack()
+        midi_file.tracks.append(track)
+        track.append(mido.MetaMessage('set_tempo', tempo = self.tempo))
+
+        last_tick = 0
+        for time_ns, message in self.messages:
+            tick = round(mido.second2tick(time_ns / 1e9, self.ticks_per_beat, self.tempo))
+            track.append(message.copy(time = tick - last_tick))
+            last_tick = tick
+        return midi_file
+
+
+def make_note_grid(tuning = 'standard', octave = 0, semitone = 0, scale = None):
+    """
+    MIDINoteGrid set up like the sensor_display.py hotkeys would leave it, through the same setters.
+    :param tuning: 'standard', 'drop-d' or 'fourths'.
+    :param octave: Octaves to transpose by.
+    :param semitone: Semitones to transpose by.
+    :param scale: One of MIDINoteGrid.scale_modes, or None for no scale.
+    """
+    note_grid = MIDINoteGrid()
+    TUNINGS[tuning](note_grid)
+    for _ in range(abs(octave)):
+        note_grid.transpose_octave('up' if octave > 0 else 'down')
+    for _ in range(abs(semitone)):
+        note_grid.transpose_semitone('up' if semitone > 0 else 'down')
+    if scale is not None:
+        scale_index = note_grid.scale_modes.index(scale)
+        while note_grid.current_scale_index != scale_index:
+            note_grid.cycle_scale_mode()
+    return note_grid
+
+
+def render_recording(path, output_path = None, rate_hz = None, verbose = False, detector = OFFLINE_DETECTOR, upsample_kernel = DEFAULT_KERNEL, **mapping):
+    """
+    Run a recording through the sensor_display.py pipeline and write the MIDI it plays to a .mid file.
+    :param path: Recording (.npy, .ttrec or .ttz).
+    :param output_path: .mid file to write; defaults to the recording's name with .mid.
+    :param rate_hz: Frame rate of a legacy .npy capture, which has no timestamps.
+    :param verbose: Keep the per-note messages the converter prints.
+    :param detector: Detector backend in blob_detectors.DETECTOR_BACKENDS; the live default, simple-blob, renders slower than real time.
+    :param upsample_kernel: Upsampling kernel in upsampler.UPSAMPLE_KERNELS; unused by the native and numpy detectors.
+    :param mapping: make_note_grid options.
+    :return: (output_path, frames, messages, seconds taken)
+    """
+    output_path = output_path or os.path.splitext(path)[0] + '.mid'
+    started = time.perf_counter()
+    recording = open_recording(path, rate_hz)
+    port = MidiFilePort()
+    pipeline = TouchPipeline(make_note_grid(**mapping), port, geometry = recording.geometry, detector = detector, upsample_kernel = upsample_kernel)
+
+    # The converter reports every note on stdout; keep a batch run quiet unless asked
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        for frame_number in range(len(recording)):
+            frame = recording[frame_number]
+            if port.start_ns is None:
+                port.start_ns = frame.timestamp_ns
+            port.now_ns = frame.timestamp_ns
+            pipeline.process(frame.values)
+        # Release whatever is still held when the recording ends
+        if port.start_ns is not None:
+            pipeline.stop_all_notes()
+
+    port.to_midi_file().save(output_path)
+    return output_path, len(recording), len(port.messages), time.perf_counter() - started
+
+
+def find_recordings(paths):
+    """Expand directories into the recordings they contain."""
+    recordings = []
+    for path in paths:
+        if os.path.isdir(path):
+            recordings += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(RECORDING_EXTENSIONS))
+        else:
+            recordings.append(path)
+    return recordings
+
+
+def render_all(paths, output_dir = None, jobs = None, **options):
+    """
+    Render many recordings in parallel, one process per core.
+    :param output_dir: Directory for the .mid files; None writes them next to the recordings.
+    :param jobs: Number of worker processes; None uses every core.
+    :param options: render_recording options.
+    """
+    recordings = find_recordings(paths)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok = True)
+
+    # One OpenCV thread per worker; the pool already keeps every core busy
+    with ProcessPoolExecutor(max_workers = jobs, initializer = cv2.setNumThreads, initargs = (1,)) as executor:
+        futures = {}
+        for path in recordings:
+            output_path = None
+            if output_dir:
+                output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.mid')
+            futures[executor.submit(render_recording, path, output_path, **options)] = path
+
+        for future in as_completed(futures):
+            try:
+                output_path, frames, messages, seconds = future.result()
+                print(f"{futures[future]} -> {output_path}: {frames} frames, {messages} MIDI messages in {seconds:.2f} s")
+            except Exception as error:
+                print(f"{futures[future]} failed: {error}")
+
+
+if __name__ == '__main__':
+    # python offline_render.py recordings/ archive/recorded_frames.npy [--out=DIR] [--jobs=N]
+    #     [--tuning=standard|drop-d|fourths] [--octave=N] [--semitone=N] [--scale="Minor Pentatonic"] [--rate=HZ] [--verbose]
+    #     [--detector=components|simple-blob|numpy|native] [--upsample=lanczos4|bicubic|bilinear]
+    # Whole-pipeline throughput per detector on one core (600-frame synthetic take, lanczos4):
+    #     simple-blob ~14 ms/frame, components ~2.5 ms/frame, numpy ~0.5 ms/frame, native ~0.7 ms/frame.
+    # A 100 Hz recording has 10 ms per frame, so the default, components, renders faster than real time
+    # and --detector=simple-blob does not (it is only worth it to reproduce the live instrument bit for bit)
+    paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+
+    render_all(
+        paths,
+        output_dir = options.get('out'),
+        jobs = int(options['jobs']) if 'jobs' in options else None,
+        rate_hz = float(options['rate']) if 'rate' in options else None,
+        verbose = 'verbose' in options,
+        detector = options.get('detector', OFFLINE_DETECTOR),
+        upsample_kernel = options.get('upsample', DEFAULT_KERNEL),
+        tuning = options.get('tuning', 'standard'),
+        octave = int(options.get('octave', 0)),
+        semitone = int(options.get('semitone', 0)),
+        scale = options.get('scale'))
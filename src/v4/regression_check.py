@@ -0,0 +1,209 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from blob_detectors import DEFAULT_DETECTOR, DETECTOR_BACKENDS, SIZE_TOLERANCE, create_detector, match_keypoints
+from offline_render import make_note_grid
+from replay_source import open_recording
+from sensor_geometry import DEFAULT_GEOMETRY
+from tactile_emulator import touch_frame
+from touch_pipeline import TouchPipeline
+
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'archive')
+GOLDEN_DIR = os.path.join(ARCHIVE_DIR, 'golden')
+ARCHIVED_RECORDINGS = ['recorded_frames.npy', 'recorded_frames.txt.npy']
+STAGES = ['preprocess', 'detect', 'track', 'midi']
+
+
+class MockMIDIPort:
+    def __init__(self):
+        """Collects the messages the converter sends, tagged with the frame they were sent for."""
+        self.name = "Mock MIDI"
+        self.frame_number = 0
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append((self.frame_number, str(message)))
+
+
+def synthetic_frames(frame_count = 600, seed = 0):
+    """
+    Deterministic multi-touch take: a finger sliding along one string while another taps,
+    so note changes, pitch bends and ID reuse are all exercised.
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = DEFAULT_GEOMETRY.rows, DEFAULT_GEOMETRY.cols
+    frames = []
+    for frame_number in range(frame_count):
+        touches = []
+        if (frame_number // 150) % 2 == 0:
+            touches.append((4 / (rows - 1), (3 + frame_number % 150 // 15) / (cols - 1), 1.0))
+        if frame_number % 100 < 40:
+            touches.append((7 / (rows - 1), 15 / (cols - 1), 1.0))
+        frames.append(touch_frame(touches, rows, cols, rng = rng))
+    return np.array(frames)
+
+
+def run_case(frames, geometry, detector = DEFAULT_DETECTOR):
+    """
+    Run frames through the pipeline one stage at a time.
+    :param detector: Detector backend to run; the goldens are written with the default one.
+    :return: (events, seconds spent per stage)
+    """
+    port = MockMIDIPort()
+    pipeline = TouchPipeline(make_note_grid(), port, geometry = geometry, detector = detector)
+    timings = dict.fromkeys(STAGES, 0.0)
+    events = []
+
+    for frame_number, values in enumerate(frames):
+        port.frame_number = frame_number
+
+        started = time.perf_counter()
+        detector_input = pipeline.preprocess(values) if pipeline.detector.uses_image else values
+        preprocessed = time.perf_counter()
+        keypoints = pipeline.detector.detect(detector_input)
+        detected = time.perf_counter()
+        blob_positions = pipeline.track(keypoints)
+        tracked = time.perf_counter()
+        pipeline.play(blob_positions)
+        played = time.perf_counter()
+
+        timings['preprocess'] += preprocessed - started
+        timings['detect'] += detected - preprocessed
+        timings['track'] += tracked - detected
+        timings['midi'] += played - tracked
+
+        # Keypoints are rounded so tiny floating point differences between OpenCV builds do not count
+        events.append({
+            'keypoints': [[round(keypoint.pt[0], 2), round(keypoint.pt[1], 2), round(keypoint.size, 2)] for keypoint in keypoints],
+            'tracks': [[blob_id, x, y, size] for blob_id, ((x, y), size) in sorted(blob_positions.items())],
+            'midi': [],
+        })
+
+    port.frame_number = len(frames) - 1
+    pipeline.stop_all_notes()
+    for frame_number, message in port.messages:
+        events[frame_number]['midi'].append(message)
+    return events, timings
+
+
+def compare(expected, actual):
+    """Return one line per stage that differs: how many frames and the first frame that does."""
+    differences = []
+    if len(expected) != len(actual):
+        differences.append(f"frame count: expected {len(expected)}, got {len(actual)}")
+    for stage in ['keypoints', 'tracks', 'midi']:
+        mismatched = [frame_number for frame_number, (want, got) in enumerate(zip(expected, actual)) if want[stage] != got[stage]]
+        if mismatched:
+            first = mismatched[0]
+            differences.append(f"{stage}: {len(mismatched)} frames differ, first at frame {first}: "
+                               f"expected {expected[first][stage]}, got {actual[first][stage]}")
+    return differences
+
+
+def load_cases(extra_paths = ()):
+    """(name, frames, geometry) for every archived recording, the synthetic take and any extra recordings."""
+    cases = []
+    for path in [os.path.join(ARCHIVE_DIR, name) for name in ARCHIVED_RECORDINGS] + list(extra_paths):
+        recording = open_recording(path)
+        frames = [recording[frame_number].values for frame_number in range(len(recording))]
+        cases.append((os.path.splitext(os.path.basename(path))[0], frames, recording.geometry))
+    cases.append(('synthetic_multitouch', synthetic_frames(), DEFAULT_GEOMETRY))
+    return cases
+
+
+def check_detector_sizes():
+    """
+    Compare the touch sizes of every other detector backend with the default one's on the archived recordings,
+    so switching backend does not change the velocities played.
+    :return: True if every backend's median size error is within SIZE_TOLERANCE.
+    """
+    all_within = True
+    for name in ARCHIVED_RECORDINGS:
+        recording = open_recording(os.path.join(ARCHIVE_DIR, name))
+        frames = [recording[frame_number].values for frame_number in range(len(recording))]
+        pipeline = TouchPipeline(None, None, geometry = recording.geometry)
+        images = [pipeline.preprocess(values).copy() for values in frames]
+
+        results = {}
+        for backend in DETECTOR_BACKENDS:
+            detector = create_detector(backend, geometry = recording.geometry)
+            results[backend] = [detector.detect(frame) for frame in (images if detector.uses_image else frames)]
+        for backend in DETECTOR_BACKENDS:
+            if backend == DEFAULT_DETECTOR:
+                continue
+            _, size_errors = match_keypoints(results[backend], results[DEFAULT_DETECTOR])
+            median = np.median(size_errors) if size_errors else 0.0
+            within = abs(median) <= SIZE_TOLERANCE
+            all_within &= within
+            print(f"{os.path.splitext(name)[0]}: {backend} median size error {median:+.1f} px ... "
+                  f"{'OK' if within else f'more than {SIZE_TOLERANCE} px'}")
+    return all_within
+
+
+def main(update = False, extra_paths = (), detector = DEFAULT_DETECTOR):
+    """
+    Check every case against its golden output (or rewrite the goldens) and the backends' touch sizes against
+    the default detector's; return True if all match.
+    Goldens are only written under update; a case without one fails.
+    Goldens record what the default detector does, so other detectors are only compared against them, never written.
+    """
+    if update and detector != DEFAULT_DETECTOR:
+        print(f"Not updating the goldens with {detector!r}; they record the default detector, {DEFAULT_DETECTOR!r}")
+        return False
+    os.makedirs(GOLDEN_DIR, exist_ok = True)
+    all_match = True
+    total_timings = dict.fromkeys(STAGES, 0.0)
+    total_frames = 0
+
+    for name, frames, geometry in load_cases(extra_paths):
+        # The converter prints every note; only the results matter here
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            events, timings = run_case(frames, geometry, detector)
+
+        golden_path = os.path.join(GOLDEN_DIR, name + '.json')
+        if update:
+            # One frame per line keeps the diff of a deliberate behaviour change readable
+            with open(golden_path, 'w') as golden_file:
+                golden_file.write(f'{{"recording": {json.dumps(name)}, "frames": {len(events)}, "events": [\n')
+                golden_file.write(',\n'.join(json.dumps(event) for event in events))
+                golden_file.write('\n]}\n')
+            status = "golden written"
+        elif not os.path.exists(golden_path):
+            # Nothing was checked, so this is not a pass
+            status = "no golden; run with --update to record one"
+            all_match = False
+        else:
+            with open(golden_path) as golden_file:
+                differences = compare(json.load(golden_file)['events'], events)
+            status = "OK" if not differences else "CHANGED\n    " + "\n    ".join(differences)
+            all_match &= not differences
+
+        midi_count = sum(len(event['midi']) for event in events)
+        print(f"{name}: {len(events)} frames, {midi_count} MIDI messages ... {status}")
+        for stage in STAGES:
+            total_timings[stage] += timings[stage]
+        total_frames += len(events)
+
+    print()
+    all_match &= check_detector_sizes()
+
+    print(f"\nPer-stage time over {total_frames} frames:")
+    for stage in STAGES:
+        print(f"  {stage:<11}{total_timings[stage] * 1e3:9.1f} ms total  {total_timings[stage] / max(total_frames, 1) * 1e3:7.3f} ms/frame")
+    return all_match
+
+
+if __name__ == '__main__':
+    # python regression_check.py [--update] [--detector=NAME] [more recordings...]
+    # Exits with 1 when any stage's output differs from the stored golden output,
+    # or a detector backend's touch sizes drift from the default detector's
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+    update = 'update' in options
+    extra_paths = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    sys.exit(0 if main(update, extra_paths, options.get('detector', DEFAULT_DETECTOR)) else 1)
@@ -0,0 +1,202 @@
+import time
+
+import numpy as np
+
+from chunked_recording import CHUNKED_EXTENSION, ChunkedRecording
+from frame_recorder import RECORDING_EXTENSION, load_recording
+from frame_source import Frame, FrameSource, FrameStats
+from sensor_geometry import SensorGeometry
+
+
+class ArrayRecording:
+    def __init__(self, values, timestamps, sequences, geometry):
+        """
+        Frame-by-frame access to arrays that may be memory-mapped; nothing is read until it is indexed.
+        :param values: (n_frames, cells) array.
+        :param timestamps: Per-frame timestamps in ns (array-like with __getitem__).
+        :param sequences: Per-frame sequence numbers (array-like with __getitem__).
+        """
+        self.values = values
+        self.timestamps = timestamps
+        self.sequences = sequences
+        self.geometry = geometry
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, frame_number):
+        return Frame(self.values[frame_number], int(self.timestamps[frame_number]), int(self.sequences[frame_number]))
+
+    def iter_chunks(self, start = 0, chunk_frames = 4096):
+        """Yield (values, timestamps, sequences) batches from frame `start` to the end, like ChunkedRecording."""
+        for chunk_start in range(start, len(self), chunk_frames):
+            chunk = slice(chunk_start, min(chunk_start + chunk_frames, len(self)))
+            yield (np.asarray(self.values[chunk]), np.asarray(self.timestamps[chunk], dtype = np.int64),
+                   np.asarray(self.sequences[chunk], dtype = np.int64))
+
+
+class SynthesizedTimestamps:
+    def __init__(self, rate_hz):
+        """Timestamps of a capture that has none, evenly spaced at the given rate."""
+        self.period_ns = 1e9 / rate_hz
+
+    def __getitem__(self, frame_number):
+        if isinstance(frame_number, slice):
+            return (np.arange(frame_number.start, frame_number.stop) * self.period_ns).astype(np.int64)
+        return int(frame_number * self.period_ns)
+
+
+class FrameNumbers:
+    """Sequence numbers of a capture that has none: the frame number itself."""
+
+    def __getitem__(self, frame_number):
+        if isinstance(frame_number, slice):
+            return np.arange(frame_number.start, frame_number.stop)
+        return frame_number
+
+
+def iter_batches(recording, batch_frames = 4096):
+    """
+    Join a recording's iter_chunks into (values, timestamps, sequences) batches of at least batch_frames
+    frames (the last one may be shorter), so the work done per batch bounds the memory used.
+    """
+    pending, pending_frames = [], 0
+    for chunk in recording.iter_chunks():
+        pending.append(chunk)
+        pending_frames += len(chunk[0])
+        if pending_frames >= batch_frames:
+            yield tuple(np.concatenate(parts) for parts in zip(*pending))
+            pending, pending_frames = [], 0
+    if pending:
+        yield tuple(np.concatenate(parts) for parts in zip(*pending))
+
+
+def open_recording(path, rate_hz = None):
+    """
+    Open any recording for replay without loading it into memory.
+    :param path: Legacy .npy capture, .ttrec streaming recording or .ttz chunked recording.
+    :param rate_hz: Frame rate of a legacy .npy capture, which has no timestamps (default 100 Hz).
+    :return: Object with __len__, __getitem__ returning a Frame, iter_chunks and a geometry attribute.
+    """
+    if path.endswith(CHUNKED_EXTENSION):
+        return ChunkedRecording(path)
+    if path.endswith(RECORDING_EXTENSION):
+        records, geometry = load_recording(path)
+        return ArrayRecording(records['values'], records['timestamp_ns'], records['sequence'], geometry)
+    values = np.load(path, mmap_mode = 'r')
+    if values.ndim != 2:
+        raise ValueError(f"{path} holds {values.shape} data, not one frame per row")
+    return ArrayRecording(values, SynthesizedTimestamps(rate_hz or 100.0), FrameNumbers(), SensorGeometry.from_frame_length(values.shape[1]))
+
+
+class ReplayFrameSource(FrameSource):
+    def __init__(self, path, speed = 1.0, loop = True, rate_hz = None):
+        """
+        Play a recording back as if the board were sending it.
+        :param path: Recording to play (.npy, .ttrec or .ttz).
+        :param speed: 1.0 keeps the recorded timing, 2.0 plays twice as fast; None or 0 plays as fast as frames are asked for.
+        :param loop: Start over at the end instead of going quiet.
+        :param rate_hz: Frame rate of a legacy .npy capture, which has no timestamps.
+        """
+        self.path = path
+        self.recording = open_recording(path, rate_hz)
+        self.geometry = self.recording.geometry
+        self.speed = speed or None
+        self.loop = loop
+        self.frame_stats = FrameStats()
+        self.ever_connected = False
+        self.reconnects = 0
+        self.position = 0  # Next frame to hand out
+        self.start_wall_ns = None  # Wall-clock time the frame at start_position was due
+        self.start_position = 0
+        self.playing = False
+
+    def start(self):
+        if len(self.recording) == 0:
+            print(f"{self.path} has no frames")
+            return self
+        self.playing = True
+        self.ever_connected = True
+        self.seek(self.position)
+        print(f"Replaying {self.path}: {len(self.recording)} frames, {self.geometry}")
+        return self
+
+    def stop(self):
+        self.playing = False
+
+    @property
+    def connected(self):
+        """True until the recording has finished playing."""
+        return self.playing
+
+    @property
+    def stats(self):
+        return self.frame_stats
+
+    def seek(self, frame_number):
+        """Continue playback from the given frame."""
+        self.position = min(max(0, frame_number), len(self.recording) - 1)
+        self.start_position = self.position
+        self.start_wall_ns = time.monotonic_ns()
+
+    def seek_seconds(self, offset):
+        """Jump forward (or back, if negative) by the given number of recorded seconds."""
+        current_ns = self.recording[min(self.position, len(self.recording) - 1)].timestamp_ns
+        self.seek(self._frame_at_time(current_ns + int(offset * 1e9)))
+
+    def _frame_at_time(self, timestamp_ns):
+        """Last frame at or before the timestamp, by binary search so only a few frames are read."""
+        low, high = 0, len(self.recording)
+        while low < high:
+            middle = (low + high) // 2
+            if self.recording[middle].timestamp_ns <= timestamp_ns:
+                low = middle + 1
+            else:
+                high = middle
+        return max(0, low - 1)
+
+    def _due_position(self):
+        """One past the last frame whose recorded time has come."""
+        if self.speed is None:
+            return self.position + 1
+        elapsed_ns = (time.monotonic_ns() - self.start_wall_ns) * self.speed
+        due_ns = self.recording[self.start_position].timestamp_ns + elapsed_ns
+        position = self.position
+        # Playback only moves forward, so step from the current frame instead of searching
+        while position < len(self.recording) and self.recording[position].timestamp_ns <= due_ns:
+            position += 1
+        return position
+
+    def get_next_frame(self, timeout = 0):
+        """Return the newest frame that is due, or None; frames that came due together are skipped like live ones."""
+        if not self.playing:
+            return None
+        deadline = time.monotonic() + timeout
+        while True:
+            due = self._due_position()
+            if due > self.position:
+                break
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.0005)
+
+        due = min(due, len(self.recording))
+        if self.frame_listeners:
+            for frame_number in range(self.position, due):
+                recorded = self.recording[frame_number]
+                self._notify_listeners(np.asarray(recorded.values)[np.newaxis], recorded.timestamp_ns, [recorded.sequence])
+        self.frame_stats.received_frames += due - self.position
+        self.frame_stats.skipped_frames += due - self.position - 1
+
+        recorded = self.recording[due - 1]
+        # Stamp the frame with the time it was handed out, like a frame arriving from the board
+        frame = Frame(recorded.values, time.monotonic_ns(), recorded.sequence)
+        self.frame_stats.record_processed(frame)
+
+        self.position = due
+        if self.position >= len(self.recording):
+            if self.loop:
+                self.seek(0)
+            else:
+                self.playing = False
+        return frame
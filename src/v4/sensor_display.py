@@ -1,21 +1,32 @@
 import numpy as np
 import cv2
-import serial.tools.list_ports
 import random
+import sys
+from calibration import DEFAULT_CALIBRATION_PATH, CalibrationCapture, load_calibration
+from blob_detectors import DEFAULT_DETECTOR, create_detector, next_detector
 from midi_note_grid_complex import MIDINoteGrid
 from midi_note_class import MIDINote
+from device_manager import DeviceManager
+from frame_preprocessor import FramePreprocessor
+from frame_recorder import BackgroundRecorder, PreRollBuffer, new_recording_path
+from replay_source import ReplayFrameSource
+from session_log import SESSION_LOG_EXTENSION, LoggingMIDIPort, SessionLogWriter
+from shared_frame_ring import SharedMemoryFrameSource
+from sensor_geometry import DEFAULT_GEOMETRY, SensorGeometry
+from tiled_source import BoardLayout, TiledFrameSource
+from upsampler import DEFAULT_KERNEL
 import time
 import mido
 
 
 class DummyDataGenerator:
-    def __init__(self, length = 200, delay = 0.1):
-        self.length = length
+    def __init__(self, length = None, delay = 0.1):
+        self.length = length or geometry.cells
         self.current_index = 0
         self.delay = delay  # Delay in seconds between frame updates
         self.last_update_time = time.time()
         # Initialize the first frame
-        self.current_frame = [1023] * self.length
+        self.current_frame = [geometry.idle_value] * self.length
         self.current_frame[self.current_index] = 0
 
     def get_next_frame(self):
@@ -25,8 +36,8 @@ class DummyDataGenerator:
             # Update the last update time
             self.last_update_time = current_time
 
-            # Generate a new frame with all values set to 1023
-            self.current_frame = [1023] * self.length
+            # Generate a new frame with all values set to the idle level
+            self.current_frame = [geometry.idle_value] * self.length
             # Set only the current index value to 0
             self.current_frame[self.current_index] = 0
             # Move to the next index, wrapping around
@@ -37,11 +48,11 @@ class DummyDataGenerator:
 
 
 class AdvancedDummyDataGenerator:
-    def __init__(self, length = 200, delay = 0.1):
-        self.length = length
+    def __init__(self, length = None, delay = 0.1):
+        self.length = length or geometry.cells
         self.delay = delay  # Delay in seconds between frame updates
         self.last_update_time = time.time()
-        self.current_frame = [1023] * self.length
+        self.current_frame = [geometry.idle_value] * self.length
         self.constant_index = int(self.length * (2 / 3))  # Top-left 1/3rd index
         self.flashing_index = int(self.length * (1 / 3))  # Bottom-right 1/3rd index
         self.flash_count = 0
@@ -53,8 +64,8 @@ class AdvancedDummyDataGenerator:
         if current_time - self.last_update_time >= self.delay:
             self.last_update_time = current_time
 
-            # Reset all values to 1023
-            self.current_frame = [1023] * self.length
+            # Reset all values to the idle level
+            self.current_frame = [geometry.idle_value] * self.length
             # Set the constant zero value
             self.current_frame[self.constant_index] = 0
 
@@ -135,11 +146,12 @@ class BlobToMIDIConverter:
         """
         Initialize the BlobToMIDIConverter with a note grid and MIDI output port.
         :param note_grid: Instance of MIDINoteGrid that represents the note grid.
-        :param midi_port: MIDI output port for sending MIDI messages.
+        :param midi_port: MIDI output port name, or an open port object (e.g. a LoggingMIDIPort) shared by all notes.
         """
         self.note_grid = note_grid
         self.midi_port = midi_port
         self.active_notes = {}  # Dictionary to keep track of active notes by blob ID
+        self.pitch_curve = 7  # Exponent of the vibrato curve, set from the "Pitch Curve" trackbar
 
     def process_blobs(self, blob_positions):
         """
@@ -212,7 +224,7 @@ class BlobToMIDIConverter:
             distance = rel_x - initial_rel_x
 
             # Apply a quadratic curve: subtle near 0, steeper near edges
-            curved_distance = distance ** cv2.getTrackbarPos("Pitch Curve", "Sensor Matrix")
+            curved_distance = distance ** self.pitch_curve
 
             # curved_distance = distance ** 7  # Cubic curve for more subtle start
             pitch_bend = int(curved_distance * 2 * pitch_bend_per_semitone)
@@ -297,7 +309,8 @@ class BlobToMIDIConverter:
 
     def stop_all_notes(self):
         """Stops all active notes by sending note_off messages."""
-        for blob_id, note in list(self.active_notes.items()):
+        for blob_id, note_data in list(self.active_notes.items()):
+            note = note_data["note"]
             if note.output_port:
                 note.output_port.send(mido.Message('note_off', channel = note.midi_channel, note = note.midi_note))
             # Remove the note from active notes after stopping it
@@ -305,82 +318,15 @@ class BlobToMIDIConverter:
         print("\n\nAll active notes stopped.")
 
 
-def map_value(value, in_min = 0, in_max = 1023, out_min = 0, out_max = 255):
-    # Function to map the 0-1023 values to a grayscale range
-    # could also bit shift it from 10 to 8 (computationally faster)
-    return int(value / 4)
-
-
-def generate_image(data):
-    # Function to convert the sensor data into a 20x10 image
-    # Reshape the flat list into a 20x10 numpy array
-    matrix = np.array(data).reshape((10, 20))
-
-    # Map the 0-1023 range to 0-255 for grayscale
-    mapped_matrix = np.vectorize(map_value)(matrix)
-
-    # Resize the 20x10 image to make it larger for visualization
-    resized_image = cv2.resize(mapped_matrix.astype(np.uint8), (780, 390), interpolation = cv2.INTER_LANCZOS4)
-
-    # Define yellow color for border in BGR format
-    padding_color = (255)
-
-    # Add padding to the resized image
-    padded_image = cv2.copyMakeBorder(
-        # Padded border
-        resized_image, padding_offset, padding_offset, padding_offset, padding_offset, cv2.BORDER_CONSTANT, value = padding_color)
-
-    # # Print for debugging
-    # print(f"Padding: {padding_offset}, Border Color: {padding_color}")
-
-    return resized_image, padded_image
-
-
-def initialize_blob_detector():
-
-    # Initialize blob detector with parameters
-    params = cv2.SimpleBlobDetector_Params()
-
-    '''Thresholding'''
-
-    params.minThreshold = cv2.getTrackbarPos("Thresh Min", "Sensor Matrix")
-    params.maxThreshold = cv2.getTrackbarPos("Thresh Max", "Sensor Matrix")
-
-    '''------------------------------------------------------------------------'''
-
-    '''Filter by Area'''
-
-    params.filterByArea = True
-
-    params.minArea = cv2.getTrackbarPos("Area Min", "Sensor Matrix")
-    params.maxArea = cv2.getTrackbarPos("Area Max", "Sensor Matrix")
-
-    '''------------------------------------------------------------------------'''
-
-    '''Filter by Circularity'''
-
-    params.filterByCircularity = False
-
-    params.minCircularity = 0.4  # Adjust this value as needed
-
-    # params.minCircularity = cv2.getTrackbarPos("Circ Min", "Sensor Matrix")
-    # params.maxCircularity = cv2.getTrackbarPos("Circ Max", "Sensor Matrix")
-
-    '''------------------------------------------------------------------------'''
-
-    '''Other Control Toggles'''
-
-    params.filterByConvexity = False
-    params.filterByInertia = False
-
-    return cv2.SimpleBlobDetector_create(params)
-
-
-def apply_threshold_and_invert(img, min_val = 250, max_val = 255):
-    # Apply a threshold and ensure background is white where there are no blobs
-    # Invert binary threshold to keep darker blobs
-    _, thresholded_img = cv2.threshold(img, min_val, max_val, cv2.THRESH_BINARY)
-    return thresholded_img
+def initialize_blob_detector(name = DEFAULT_DETECTOR):
+    # Build the named detector backend from the current trackbar positions
+    return create_detector(
+        name,
+        threshold_min = cv2.getTrackbarPos("Thresh Min", "Sensor Matrix"),
+        threshold_max = cv2.getTrackbarPos("Thresh Max", "Sensor Matrix"),
+        min_area = cv2.getTrackbarPos("Area Min", "Sensor Matrix"),
+        max_area = cv2.getTrackbarPos("Area Max", "Sensor Matrix"),
+        geometry = geometry)
 
 
 def nothing(x):
@@ -399,7 +345,7 @@ def create_trackbars():
     cv2.createTrackbar("Pitch Curve", "Sensor Matrix", 7, 10, nothing)
 
 
-def overlay_note_grid(display_img, note_grid, padding_offet, active_notes, alpha = 0.5):
+def overlay_note_grid(display_img, note_grid, padding_offet, active_notes, alpha = 0.5, overlay = None):
     # Calculate effective dimensions of the note grid
     effective_width = display_img.shape[1] - (2 * padding_offset)
     effective_height = display_img.shape[0] - (2 * padding_offset)
@@ -407,8 +353,11 @@ def overlay_note_grid(display_img, note_grid, padding_offet, active_notes, alpha
     # Determine the number of rows and columns in the note grid
     rows, cols = len(note_grid.grid), len(note_grid.grid[0])
 
-    # Create a temporary overlay for the grid
-    overlay = display_img.copy()
+    # Create a temporary overlay for the grid, in the given buffer if there is one
+    if overlay is None:
+        overlay = display_img.copy()
+    else:
+        np.copyto(overlay, display_img)
 
     # Calculate cell width and height based on the effective grid size
     cell_width = effective_width // cols
@@ -466,32 +415,104 @@ colors = [
 ]
 
 
+def set_geometry(new_geometry):
+    """Switch to another sensor geometry; every size the pipeline uses is derived from it here, once."""
+    global geometry, padding_offset, original_width, original_height, effective_width, effective_height, window_width, window_height
+    geometry = new_geometry
+
+    # Padding offset for edge blobs
+    padding_offset = geometry.padding_offset
+
+    # Original display dimensions
+    original_width, original_height = geometry.original_width, geometry.original_height
+
+    # Effective dimensions after padding
+    effective_width = geometry.effective_width
+    effective_height = geometry.effective_height
+
+    # Size of the resized sensor image the blobs are detected in
+    window_width, window_height = geometry.image_size
+
+
+set_geometry(DEFAULT_GEOMETRY)
+
+
 if __name__ == '__main__':
     # Serial port setup
-    comport = '/dev/cu.usbmodem126032001'
+    # Pass a port on the command line to use another board or tactile_emulator.py,
+    # or a board layout .json file to combine several boards into one surface
+    # --ingest-process reads the port in a separate process so a slow window never delays it
+    # --geometry=ROWSxCOLS (or a .json config) sets the matrix size instead of detecting it
+    # --replay=RECORDING plays a .npy, .ttrec or .ttz recording instead of reading a board,
+    #   at --speed=N times the recorded pace (--speed=0 as fast as possible); --no-loop stops at the end
+    # --session-log[=PATH] logs every frame, blob, track and MIDI message for offline analysis (session_log.py)
+    # --detector=NAME picks the touch detector backend (blob_detectors.py); 'g' cycles through them
+    # --upsample=KERNEL picks lanczos4 (default), bicubic or bilinear to resize the sensor image (upsampler.py)
+    # --calibration=PATH is the per-cell calibration loaded at startup and saved by 'k' (calibration.py);
+    #   --no-calibration uses the raw readings
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+    comport = arguments[0] if arguments else '/dev/cu.usbmodem126032001'
     baudrate = 115200
-    ports = serial.tools.list_ports.comports()
-    available_ports = [port.device for port in ports]
-
-    # Check if the desired port is available
-    if comport in available_ports:
-        # ser = serial.Serial(comport, baudrate, timeout=0.1)
-        use_dummy_data = False
-        print(f"Connected to {comport}")
+    teensy_serial_number = None  # Set to pick one board when several are plugged in
+    use_ingest_process = 'ingest-process' in options
+
+    configured_geometry = None
+    if options.get('geometry', '').endswith('.json'):
+        configured_geometry = SensorGeometry.from_json(options['geometry'])
+    elif options.get('geometry'):
+        configured_geometry = SensorGeometry.parse(options['geometry'])
+    frame_length = configured_geometry.cells if configured_geometry else None
+
+    # Find the Teensy by USB ID (or the port above) and reconnect whenever the cable is bumped
+    if options.get('replay'):
+        frame_source = ReplayFrameSource(options['replay'], speed = float(options.get('speed', 1.0)), loop = 'no-loop' not in options).start()
+        configured_geometry = frame_source.geometry
+    elif comport.endswith('.json'):
+        board_layout = BoardLayout.from_json(comport)
+        configured_geometry = board_layout.geometry
+        frame_source = TiledFrameSource(board_layout, baudrate, max_age_ms = 50).start()
+    elif use_ingest_process:
+        # The shared ring is sized up front, so this mode uses the configured or default geometry
+        frame_length = frame_length or DEFAULT_GEOMETRY.cells
+        frame_source = SharedMemoryFrameSource(serial_number = teensy_serial_number, comport = comport, baudrate = baudrate, frame_length = frame_length, max_age_ms = 50).start()
     else:
-        use_dummy_data = True
-        dummy_generator = DummyDataGenerator()
-        advanced_dummy_generator = AdvancedDummyDataGenerator()
-        use_advanced_dummy = False
-        print(f"\n\nDevice not connected. Using dummy data.")
+        frame_source = DeviceManager(serial_number = teensy_serial_number, comport = comport, baudrate = baudrate, frame_length = frame_length, max_age_ms = 50).start()
+
+    # Work out the sensor geometry once; every size, buffer and lookup is derived from it
+    if configured_geometry is None and frame_source.connected:
+        first_frame = frame_source.get_next_frame(timeout = 2.0)
+        if first_frame is not None:
+            configured_geometry = SensorGeometry.from_frame_length(len(first_frame.values))
+    set_geometry(configured_geometry or DEFAULT_GEOMETRY)
+    print(f"Sensor geometry: {geometry}")
+
+    dummy_generator = DummyDataGenerator()
+    advanced_dummy_generator = AdvancedDummyDataGenerator()
+    use_advanced_dummy = False
+    if not frame_source.connected:
+        print(f"\n\nDevice not connected. Using dummy data until it is plugged in.")
+
+    # Untouched surface, fed to the pipeline while a lost board reconnects so notes are released
+    idle_frame = geometry.idle_frame
+
+    # A connected board that sends nothing for this long is treated like an unplugged one
+    STALL_SECONDS = 0.5
+    last_frame_time = time.monotonic()
+    stall_reported = False
+    geometry_mismatch_reported = False
 
     # Initialize blob tracker
     blob_tracker = PersistentBlobTracker()
 
-    # Initialize OpenCV window and blob detector
+    # Image buffers for this geometry, reused for every frame
+    preprocessor = FramePreprocessor(geometry, options.get('upsample', DEFAULT_KERNEL))
+
+    # Initialize OpenCV window; the blob detector is built in the loop from the trackbars
     cv2.namedWindow("Sensor Matrix", cv2.WINDOW_NORMAL)
     create_trackbars()  # Create trackbars for on-screen controls
-    detector = initialize_blob_detector()
+    detector_name = options.get('detector', DEFAULT_DETECTOR)
+    detector_settings = None  # Backend and trackbar positions the current detector was built with
 
     # Toggle view states
 
@@ -505,23 +526,32 @@ if __name__ == '__main__':
     # Toggle for displaying the note grid
     show_note_grid = True
 
-    # Padding offset for edge blobs
-    padding_offset = 30  # This hack works for now, but make it 30 or higher for border padding; but incorporate scaling into the program
-
-    # Original display dimensions
-    original_width, original_height = 600, 300
-    
-    # Effective dimensions after padding
-    effective_width = original_width - (2 * padding_offset)
-    effective_height = original_height - (2 * padding_offset)
-
     # Create the note grid
     note_grid = MIDINoteGrid()
     print(note_grid)
 
     # Define MIDI port name and initialize BlobToMIDIConverter
     midi_port_name = "IAC Driver TacTile"  # Adjust this as needed
-    midi_converter = BlobToMIDIConverter(note_grid, midi_port_name)
+    session_log = None
+    if 'session-log' in options:
+        session_log = SessionLogWriter(options['session-log'] or new_recording_path(prefix = "session", extension = SESSION_LOG_EXTENSION), geometry)
+        print(f"Logging the session to {session_log.path}")
+        # Every note shares one port that logs each message before sending it
+        midi_converter = BlobToMIDIConverter(note_grid, LoggingMIDIPort(session_log, mido.open_output(midi_port_name)))
+    else:
+        midi_converter = BlobToMIDIConverter(note_grid, midi_port_name)
+
+    # Recording to disk, toggled with 'r'; None while not recording
+    recorder = None
+
+    # Per-cell baseline and gain from the last 'k' calibration; recorders and logs still get the raw frames
+    calibration_path = options.get('calibration') or DEFAULT_CALIBRATION_PATH
+    calibration = None if 'no-calibration' in options else load_calibration(calibration_path, geometry)
+    calibration_capture = None  # Board frames of the idle surface being collected after 'k'
+
+    # Last 10 seconds of frames, always kept so 'w' can save what just happened
+    pre_roll = PreRollBuffer(geometry, seconds = 10)
+    frame_source.add_frame_listener(pre_roll.record_frames)
 
     while True:
 
@@ -535,67 +565,99 @@ if __name__ == '__main__':
         circularity_min = cv2.getTrackbarPos("Circ Min", "Sensor Matrix")
         circularity_max = cv2.getTrackbarPos("Circ Max", "Sensor Matrix")
 
-        # Update blob detector parameters
-        detector = initialize_blob_detector()
+        # Rebuild the blob detector only when its backend or a trackbar it uses has moved
+        settings = (detector_name, threshold_min, threshold_max, area_min, area_max)
+        if settings != detector_settings:
+            detector = initialize_blob_detector(detector_name)
+            detector_settings = settings
+        midi_converter.pitch_curve = cv2.getTrackbarPos("Pitch Curve", "Sensor Matrix")
 
         # If the port isn't connected, generate sensor data
         # Check which generator to use
-        if use_dummy_data:
-            if use_advanced_dummy:
-                sensor_data = advanced_dummy_generator.get_next_frame()
+        if frame_source.connected:
+            # Newest complete frame from the reader thread; stale frames are discarded
+            frame = frame_source.get_next_frame(timeout = 0.01)
+            if frame is not None and len(frame.values) != geometry.cells:
+                # A board with a different matrix was plugged in; keep the window responsive so it can be closed and restarted
+                if not geometry_mismatch_reported:
+                    print(f"\nThe board sends {len(frame.values)} values per frame, not {geometry.cells}; restart to pick up its geometry.")
+                    geometry_mismatch_reported = True
+                frame = None
+                sensor_data = idle_frame
+            elif frame is not None:
+                last_frame_time = time.monotonic()
+                stall_reported = False
+                sensor_data = frame.values
+            elif time.monotonic() - last_frame_time < STALL_SECONDS:
+                # Between two frames; skip drawing until the next one is in
+                continue
             else:
-                sensor_data = dummy_generator.get_next_frame()
+                # Connected but silent: release the notes and keep the window and keys alive until frames come back
+                if not stall_reported:
+                    print(f"\nNo frames from the board for {STALL_SECONDS} s.")
+                    stall_reported = True
+                sensor_data = idle_frame
+        elif frame_source.ever_connected:
+            # Board was unplugged; keep the UI and tuning alive until it comes back
+            frame = None
+            sensor_data = idle_frame
+        elif use_advanced_dummy:
+            frame = None
+            sensor_data = advanced_dummy_generator.get_next_frame()
         else:
-            data = serial.Serial(comport, baudrate, timeout=0.1).readline().decode()
-            if data:
-                values = list(map(int, data.split()))
-                if len(values) == 200:
-                    sensor_data = values
-                else:
-                    continue
+            frame = None
+            sensor_data = dummy_generator.get_next_frame()
+
+        if session_log is not None:
+            if frame is not None:
+                session_log.log_frame(sensor_data, frame.timestamp_ns, frame.sequence)
             else:
-                continue
+                session_log.log_frame(sensor_data)
 
-        # Generate the image from the sensor data
-        original_img, padded_img = generate_image(sensor_data)
+        # Board frames reach the recorders through their frame listeners; record what is shown otherwise
+        if frame is None:
+            pre_roll.record(sensor_data)
+            if recorder is not None:
+                recorder.record(sensor_data)
 
-        # Apply inverted thresholding to keep darker areas as blobs
-        thresholded_img = apply_threshold_and_invert(padded_img, min_val = threshold_min, max_val = threshold_max)
+        # Only frames from the board calibrate; dummy and idle frames would pull every cell towards themselves
+        if calibration_capture is not None and frame is not None and calibration_capture.add(sensor_data):
+            calibration = calibration_capture.result()
+            calibration.save(calibration_path)
+            calibration_capture = None
+            print(f"Calibration saved to {calibration_path}: gain {calibration.gain.min():.2f}-{calibration.gain.max():.2f}")
 
-        # Initialize the display base as a white background
-        display_img = np.full_like(thresholded_img, 255)
-        display_img = cv2.cvtColor(original_img, cv2.COLOR_GRAY2BGR)
+        # Even out the cells of board frames before anything is detected; dummy and idle frames are already even
+        detection_data = sensor_data if calibration is None or frame is None else calibration.apply(sensor_data)
+
+        # Generate the image from the sensor data and apply inverted thresholding to keep darker areas as blobs,
+        # all in the preprocessor's reused buffers
+        original_img, padded_img, thresholded_img = preprocessor.process(detection_data, threshold_min, threshold_max)
 
         # Get window dimensions
-        window_height, window_width = display_img.shape[:2]
+        window_height, window_width = original_img.shape[:2]
 
-        # Perform blob detection on the image
-        keypoints = detector.detect(thresholded_img)
+        # Perform blob detection on the image, or on the raw grid for the native backends
+        keypoints = detector.detect(thresholded_img if detector.uses_image else detection_data)
 
         blob_positions = blob_tracker.update_blobs(keypoints)
 
+        if session_log is not None:
+            session_log.log_keypoints(keypoints)
+            session_log.log_tracks(blob_positions)
+
         # Process blob positions for MIDI notes
         midi_converter.process_blobs(blob_positions)
 
-        # Show thresholded image if enabled
-        if show_threshold == 0:
-            display_img = np.full_like(padded_img, 255)
-            display_img = cv2.cvtColor(display_img, cv2.COLOR_GRAY2BGR)
-        if show_threshold == 1:
-            display_img = cv2.cvtColor(thresholded_img.copy(), cv2.COLOR_GRAY2BGR)
-        if show_threshold == 2:
-            # Use the original padded image directly
-            display_img = cv2.cvtColor(padded_img, cv2.COLOR_GRAY2BGR)
+        # Show thresholded image if enabled: white canvas, thresholded or original padded image
+        display_img = preprocessor.render_view(show_threshold)
 
         # Show note grid if enabled
         if show_note_grid:
-            display_img = overlay_note_grid(display_img, note_grid, padding_offset, midi_converter.active_notes, alpha=0.5)
+            display_img = overlay_note_grid(display_img, note_grid, padding_offset, midi_converter.active_notes, alpha=0.5, overlay = preprocessor.overlay_img)
 
         # Show blobs if enabled
         if show_blobs:
-            # Convert to color to draw in color
-            blob_image = cv2.cvtColor(thresholded_img, cv2.COLOR_GRAY2BGR)
-
             for blob_id, (position, size) in blob_positions.items():
                 x, y = position
 
@@ -643,6 +705,41 @@ if __name__ == '__main__':
             # Toggle between regular and advanced dummy data generators
             use_advanced_dummy = not use_advanced_dummy
             print("Switched to", "Advanced Dummy Data" if use_advanced_dummy else "Basic Dummy Data")
+        elif key == ord('g'):
+            detector_name = next_detector(detector_name)
+            print(f"Touch detector: {detector_name}")
+        elif key == ord('i'):
+            # Print frame latency and drop counters
+            if frame_source.connected:
+                print(f"\n{frame_source.stats}\tReconnects: {frame_source.reconnects}")
+        elif key in (ord('['), ord(']')) and isinstance(frame_source, ReplayFrameSource):
+            # Skip 5 seconds back/forward in the recording
+            frame_source.seek_seconds(-5 if key == ord('[') else 5)
+        elif key == ord('k'):
+            # Calibrate every cell from the next 200 frames; keep hands off the surface meanwhile
+            if not frame_source.connected:
+                print("Not calibrating: connect the board first")
+            else:
+                calibration_capture = CalibrationCapture(geometry)
+                print("Calibrating: don't touch the surface")
+        elif key == ord('w'):
+            # Save the last 10 seconds in the background
+            pre_roll.dump()
+        elif key == ord('r'):
+            # Start/stop streaming every incoming frame to disk
+            if recorder is None:
+                recorder = BackgroundRecorder(new_recording_path(), geometry)
+                frame_source.add_frame_listener(recorder.record_frames)
+                print(f"Recording to {recorder.path}")
+            else:
+                frame_source.remove_frame_listener(recorder.record_frames)
+                try:
+                    recorder.close()
+                    print(f"Recorded {recorder.frame_count} frames to {recorder.path} ({recorder.dropped_frames} dropped)")
+                except OSError as error:
+                    # Disk full or gone: keep playing, the frames written so far are still in the file
+                    print(f"Recording to {recorder.path} stopped after {recorder.frame_count} frames: {error}")
+                recorder = None
 
         # Key press handling for MIDI note grid controls
         elif key == ord('z'):       # Lower by one octave
@@ -678,4 +775,12 @@ if __name__ == '__main__':
             break  # Quit the program
 
     # Release resources
+    if recorder is not None:
+        frame_source.remove_frame_listener(recorder.record_frames)
+        recorder.close()
+        print(f"Recorded {recorder.frame_count} frames to {recorder.path}")
+    if session_log is not None:
+        session_log.close()
+        print(f"Logged {session_log.frame_count} frames to {session_log.path}")
+    frame_source.stop()
     cv2.destroyAllWindows()
@@ -0,0 +1,79 @@
+import json
+import math
+
+import numpy as np
+
+
+# Matrices we have built, by number of values per frame
+KNOWN_GEOMETRIES = {
+    200: (10, 20),
+}
+
+
+class SensorGeometry:
+    def __init__(self, rows = 10, cols = 20, cell_pixels = 39, grid_cell_pixels = 30, padding_offset = 30, idle_value = 1023):
+        """
+        Size of the sensor matrix and every size derived from it, computed once.
+        :param rows: Rows of cells on the surface.
+        :param cols: Columns of cells on the surface.
+        :param cell_pixels: Pixels per cell in the resized image blobs are detected in.
+        :param grid_cell_pixels: Pixels per cell of the note grid layout used to map blobs to notes.
+        :param padding_offset: Border added around the resized image so edge blobs are detected.
+        :param idle_value: Reading of an untouched cell.
+        """
+        self.rows = rows
+        self.cols = cols
+        self.cells = rows * cols
+        self.shape = (rows, cols)
+        self.cell_pixels = cell_pixels
+        self.grid_cell_pixels = grid_cell_pixels
+        self.padding_offset = padding_offset
+        self.idle_value = idle_value
+
+        # Resized sensor image (cv2 sizes are (width, height)); also the display window
+        self.image_width = cols * cell_pixels
+        self.image_height = rows * cell_pixels
+        self.image_size = (self.image_width, self.image_height)
+
+        # Resized image plus the padding on every side
+        self.padded_width = self.image_width + 2 * padding_offset
+        self.padded_height = self.image_height + 2 * padding_offset
+
+        # Note grid layout the blob positions are mapped onto
+        self.original_width = cols * grid_cell_pixels
+        self.original_height = rows * grid_cell_pixels
+        self.effective_width = self.original_width - (2 * padding_offset)
+        self.effective_height = self.original_height - (2 * padding_offset)
+
+        self.idle_frame = np.full(self.cells, idle_value, dtype = np.uint16)
+
+    @classmethod
+    def from_frame_length(cls, frame_length, **kwargs):
+        """Work out the matrix from the number of values in one frame."""
+        if frame_length in KNOWN_GEOMETRIES:
+            return cls(*KNOWN_GEOMETRIES[frame_length], **kwargs)
+
+        # Unknown board: prefer our usual 1:2 layout, otherwise the most square factorisation
+        rows = math.isqrt(frame_length // 2)
+        if rows > 0 and 2 * rows * rows == frame_length:
+            return cls(rows, 2 * rows, **kwargs)
+        rows = max(row for row in range(1, math.isqrt(frame_length) + 1) if frame_length % row == 0)
+        return cls(rows, frame_length // rows, **kwargs)
+
+    @classmethod
+    def parse(cls, text, **kwargs):
+        """Geometry from a 'ROWSxCOLS' string, e.g. '10x20'."""
+        rows, cols = (int(part) for part in text.lower().split('x'))
+        return cls(rows, cols, **kwargs)
+
+    @classmethod
+    def from_json(cls, path):
+        """Geometry from a config file, e.g. {"rows": 16, "cols": 32, "cell_pixels": 24}."""
+        with open(path) as config_file:
+            return cls(**json.load(config_file))
+
+    def __str__(self):
+        return f"{self.rows}x{self.cols} ({self.cells} cells, image {self.image_width}x{self.image_height})"
+
+
+DEFAULT_GEOMETRY = SensorGeometry()
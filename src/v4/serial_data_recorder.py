@@ -1,57 +1,68 @@
+import sys
+
 import numpy as np
 import cv2
-import serial_reader
-# import keyboard
+from device_manager import DeviceManager
+from frame_recorder import BackgroundRecorder, new_recording_path
+from sensor_geometry import SensorGeometry
 
 # Configuration
-comport = '/dev/cu.usbmodem126032001'
+comport = sys.argv[1] if len(sys.argv) > 1 else '/dev/cu.usbmodem126032001'
 baudrate = 115200
-frames = []
-recording = False
-max_frames = 900  # Define how many frames to save
 
-# Start/Stop recording on 'p' key, quit on 'q' key
+# Start/Stop recording on 'r' key, quit on 'q' key
+# Frames are streamed to a memory-mapped file as they arrive, so there is no frame limit and a crash
+# keeps everything up to the last flush; load a take with frame_recorder.load_recording
 
 
 def main():
-    global recording, frames
+    recorder = None
 
     print("Press 'r' to start/stop recording, 'q' to quit.")
 
     # Create an OpenCV window with a placeholder image to capture key events
     cv2.imshow("Sensor Matrix", np.zeros((100, 100), dtype=np.uint8))
 
-    # Read from serial in a loop
-    for sensor_data in serial_reader.read_serial(comport, baudrate):
+    frame_source = DeviceManager(comport=comport, baudrate=baudrate).start()
+    geometry = None
+
+    while True:
         # Check if the 'q' key has been pressed to quit
-        key = cv2.waitKey(1) & 0xFF
+        key = cv2.waitKey(10) & 0xFF
+
+        # The recorder gets every frame through its listener; this only keeps track of the geometry
+        frame = frame_source.get_next_frame()
+        if frame is not None and geometry is None:
+            geometry = SensorGeometry.from_frame_length(len(frame.values))
+            print(f"Sensor geometry: {geometry}")
+
         if key == ord('q'):
             print("Exiting...")
             break
         elif key == ord('r'):
-            recording = not recording
-            if recording:
-                print("Recording started.")
+            if recorder is None:
+                if geometry is None:
+                    print("No frames received yet, cannot start recording.")
+                    continue
+                recorder = BackgroundRecorder(new_recording_path(), geometry)
+                frame_source.add_frame_listener(recorder.record_frames)
+                print(f"Recording started: {recorder.path}")
             else:
-                print("Recording stopped.")
-
-        # Record frame if recording is active
-        if recording:
-            frames.append(sensor_data)
-            print(f"Frame recorded: {len(frames)}")
+                stop_recording(frame_source, recorder)
+                recorder = None
 
-            # Stop recording once max_frames is reached
-            if len(frames) >= max_frames:
-                print("Max frames reached. Recording stopped.")
-                recording = False
+        if recorder is not None:
+            print(f"\rFrames recorded: {recorder.frame_count}", end="")
 
-    # Save frames to a file for looping later
-    save_frames(frames)
+    if recorder is not None:
+        stop_recording(frame_source, recorder)
+    frame_source.stop()
 
 
-def save_frames(frames, filename="recorded_frames.npy"):
-    np.save(filename, frames)
-    print(f"{len(frames)} frames saved to {filename}")
+def stop_recording(frame_source, recorder):
+    frame_source.remove_frame_listener(recorder.record_frames)
+    recorder.close()
+    print(f"\nRecording stopped. {recorder.frame_count} frames saved to {recorder.path}")
 
 
 if __name__ == '__main__':
@@ -1,22 +1,46 @@
+import queue
+
 import serial.tools.list_ports
 import serial
 
+from frame_source import Frame, SerialFrameSource
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+def read_serial(comport, baudrate, geometry=DEFAULT_GEOMETRY):
+    # Read lines until one holds a complete frame of the given SensorGeometry
+    # The with block closes the port however the read ends, including on a decode error or Ctrl-C
+    with serial.Serial(comport, baudrate, timeout=0.1) as ser:
+        while True:
+            data = ser.readline().decode()
+            if data:
+                values = list(map(int, data.split()))
+                if len(values) == geometry.cells:
+                    return values
 
-def read_serial(comport, baudrate):
-    ser = serial.Serial(comport, baudrate, timeout=0.1)
-    while True:
-        data = serial.Serial(
-            comport, baudrate, timeout=0.1).readline().decode()
-        if data:
-            values = list(map(int, data.split()))
-            if len(values) == 200:
-                sensor_data = values
 
-                return sensor_data
-            else:
+def iter_serial_frames(comport, baudrate, frame_length=None, frame_format='auto'):
+    """
+    Yield every Frame as it arrives, keeping the port open between frames.
+    Frames are taken from a frame listener rather than get_next_frame, which only keeps the newest one,
+    so none are skipped however slowly the caller consumes them.
+    :param comport: Serial port the Teensy is connected to.
+    :param baudrate: Serial baud rate.
+    :param frame_length: Number of values in one complete frame, or None to detect it from the stream.
+    :param frame_format: 'text', 'binary', or 'auto' to detect what the firmware sends.
+    """
+    batches = queue.Queue()
+    frame_source = SerialFrameSource(comport, baudrate, frame_length, frame_format=frame_format)
+    # Listen before the reader thread starts so the first frames are not missed
+    frame_source.add_frame_listener(lambda values, timestamp_ns, sequences: batches.put((values, timestamp_ns, sequences)))
+    with frame_source:
+        while frame_source.running or not batches.empty():
+            try:
+                values, timestamp_ns, sequences = batches.get(timeout=0.1)
+            except queue.Empty:
                 continue
-        else:
-            continue
+            for frame_values, sequence in zip(values, sequences):
+                yield Frame(frame_values, timestamp_ns, int(sequence))
 
 
 if __name__ == '__main__':
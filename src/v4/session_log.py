@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import mido
+import numpy as np
+
+from sensor_geometry import SensorGeometry
+
+
+# Session log layout:
+#
+#   magic       8 bytes
+#   metadata    uint32 length + JSON (geometry, start time)
+#   records     RECORD header (type, timestamp_ns, payload length) + payload, in the order they happened
+#
+# Every timestamp is time.monotonic_ns(), the clock the frame sources stamp arrivals with, so frames,
+# detections, tracks and MIDI messages line up exactly. Records between one FRAME record and the next
+# belong to that frame.
+MAGIC = b'TTSLOG01'
+RECORD = struct.Struct('<BqI')
+FRAME, KEYPOINTS, TRACKS, MIDI = 1, 2, 3, 4
+SESSION_LOG_EXTENSION = '.ttlog'
+
+# Payloads
+FRAME_HEADER = struct.Struct('<q')  # sequence, followed by the uint16 values
+KEYPOINT_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('size', '<f4')])
+TRACK_DTYPE = np.dtype([('blob_id', '<i4'), ('x', '<i4'), ('y', '<i4'), ('size', '<i4')])
+
+# Everything logged while one frame was processed
+# keypoints: KEYPOINT_DTYPE array of what the detector found
+# tracks: {blob_id: ((x, y), size)}, the same shape PersistentBlobTracker.update_blobs returns
+# midi: list of (timestamp_ns, mido.Message) sent for this frame
+SessionFrame = namedtuple('SessionFrame', ['index', 'timestamp_ns', 'sequence', 'values', 'keypoints', 'tracks', 'midi'])
+
+
+class SessionLogWriter:
+    def __init__(self, path, geometry, flush_bytes = 1 << 20, flush_seconds = 1.0):
+        """
+        Log raw frames, blob keypoints, tracked blobs and MIDI messages of one session.
+        Records are packed into memory and written by a background thread.
+        :param path: File to write; it is overwritten.
+        :param geometry: SensorGeometry of the frames.
+        :param flush_bytes: Buffered bytes that trigger a hand-off to the writer thread.
+        :param flush_seconds: Longest time records stay buffered, so a crash loses at most this much of the session.
+        """
+        self.path = path
+        self.geometry = geometry
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.buffer = bytearray()
+        self.last_hand_off = time.monotonic()
+        self.lock = threading.Lock()  # MIDI can be logged from another thread than the frames
+        self.frame_count = 0
+
+        metadata = json.dumps({'rows': geometry.rows, 'cols': geometry.cols, 'started': time.strftime('%Y-%m-%dT%H:%M:%S')}).encode()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('<I', len(metadata)) + metadata)
+
+        self.blocks = queue.Queue()
+        self.writer_thread = threading.Thread(target = self._write_loop, name = "SessionLogWriter", daemon = True)
+        self.writer_thread.start()
+
+    def _append(self, record_type, timestamp_ns, payload):
+        with self.lock:
+            self.buffer += RECORD.pack(record_type, timestamp_ns, len(payload))
+            self.buffer += payload
+            if len(self.buffer) >= self.flush_bytes or time.monotonic() - self.last_hand_off >= self.flush_seconds:
+                self._hand_off()
+
+    def _hand_off(self):
+        block, self.buffer = self.buffer, bytearray()
+        self.last_hand_off = time.monotonic()
+        self.blocks.put(block)
+
+    def _write_loop(self):
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                break
+            self.file.write(block)
+            # Out of Python's buffer, so the block survives the process crashing
+            self.file.flush()
+
+    def log_frame(self, values, timestamp_ns = None, sequence = -1):
+        """Start a new frame; everything logged until the next frame belongs to it."""
+        values = np.asarray(values, dtype = '<u2')
+        self._append(FRAME, timestamp_ns or time.monotonic_ns(), FRAME_HEADER.pack(sequence) + values.tobytes())
+        self.frame_count += 1
+
+    def log_keypoints(self, keypoints):
+        """Log the detector output (cv2.KeyPoint or anything with pt and size)."""
+        packed = np.array([(keypoint.pt[0], keypoint.pt[1], keypoint.size) for keypoint in keypoints], dtype = KEYPOINT_DTYPE)
+        self._append(KEYPOINTS, time.monotonic_ns(), packed.tobytes())
+
+    def log_tracks(self, blob_positions):
+        """Log the tracked blobs, {blob_id: ((x, y), size)}."""
+        packed = np.array([(blob_id, x, y, size) for blob_id, ((x, y), size) in blob_positions.items()], dtype = TRACK_DTYPE)
+        self._append(TRACKS, time.monotonic_ns(), packed.tobytes())
+
+    def log_midi(self, message):
+        """Log one outgoing mido.Message."""
+        self._append(MIDI, time.monotonic_ns(), bytes(message.bytes()))
+
+    def close(self):
+        """Write everything still buffered and close the file."""
+        with self.lock:
+            self._hand_off()
+        self.blocks.put(None)
+        self.writer_thread.join()
+        self.file.close()
+
+
+class LoggingMIDIPort:
+    def __init__(self, session_log, port = None):
+        """
+        MIDI output port that logs every message before passing it on.
+        Give it to BlobToMIDIConverter in place of a port name.
+        :param session_log: SessionLogWriter to log to.
+        :param port: Open mido output port to forward to, or None to only log.
+        """
+        self.session_log = session_log
+        self.port = port
+        self.name = port.name if port is not None else "Session log"
+
+    def send(self, message):
+        self.session_log.log_midi(message)
+        if self.port is not None:
+            self.port.send(message)
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+
+
+class SessionLogReader:
+    def __init__(self, path):
+        """
+        Read a session log back frame by frame.
+        Only the record headers are scanned on open; frames are decoded when they are asked for.
+        A log cut short by a crash ends at its last complete record.
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a TacTile session log")
+        metadata_length, = struct.unpack('<I', self.file.read(4))
+        self.metadata = json.loads(self.file.read(metadata_length))
+        self.geometry = SensorGeometry(self.metadata['rows'], self.metadata['cols'])
+
+        # File offset of every FRAME record, plus the end of the records
+        self.frame_offsets = []
+        offset = self.file.tell()
+        file_size = os.fstat(self.file.fileno()).st_size
+        while True:
+            header = self.file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            record_type, _, length = RECORD.unpack(header)
+            if offset + RECORD.size + length > file_size:
+                # The last record was only partly written
+                break
+            if record_type == FRAME:
+                self.frame_offsets.append(offset)
+            offset += RECORD.size + length
+            self.file.seek(offset)
+        self.end_offset = offset
+
+    def __len__(self):
+        return len(self.frame_offsets)
+
+    def __getitem__(self, index):
+        """Reconstruct the state of one frame as a SessionFrame."""
+        if index < 0:
+            index += len(self)
+        start = self.frame_offsets[index]
+        stop = self.frame_offsets[index + 1] if index + 1 < len(self) else self.end_offset
+        self.file.seek(start)
+        return self._decode(index, self.file.read(stop - start))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _decode(self, index, data):
+        keypoints = np.zeros(0, dtype = KEYPOINT_DTYPE)
+        tracks = {}
+        midi = []
+        offset = 0
+        while offset < len(data):
+            record_type, timestamp_ns, length = RECORD.unpack_from(data, offset)
+            payload = data[offset + RECORD.size:offset + RECORD.size + length]
+            offset += RECORD.size + length
+
+            if record_type == FRAME:
+                frame_timestamp_ns = timestamp_ns
+                sequence, = FRAME_HEADER.unpack_from(payload)
+                values = np.frombuffer(payload, dtype = '<u2', offset = FRAME_HEADER.size)
+            elif record_type == KEYPOINTS:
+                keypoints = np.frombuffer(payload, dtype = KEYPOINT_DTYPE)
+            elif record_type == TRACKS:
+                tracks = {int(track['blob_id']): ((int(track['x']), int(track['y'])), int(track['size']))
+                          for track in np.frombuffer(payload, dtype = TRACK_DTYPE)}
+            elif record_type == MIDI:
+                midi.append((timestamp_ns, mido.Message.from_bytes(payload)))
+
+        return SessionFrame(index, frame_timestamp_ns, sequence, values, keypoints, tracks, midi)
+
+    def find_midi(self, **attributes):
+        """Frame numbers whose MIDI output contains a message with the given attributes, e.g. type = 'note_on', note = 60."""
+        return [session_frame.index for session_frame in self
+                if any(all(getattr(message, name, None) == value for name, value in attributes.items())
+                       for _, message in session_frame.midi)]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Print a per-frame summary of a session log
+    with SessionLogReader(sys.argv[1]) as reader:
+        print(f"{reader.path}: {len(reader)} frames, {reader.geometry}")
+        for session_frame in reader:
+            if len(session_frame.keypoints) or session_frame.midi:
+                messages = ", ".join(str(message) for _, message in session_frame.midi)
+                print(f"#{session_frame.index} seq {session_frame.sequence}: {len(session_frame.keypoints)} keypoints, "
+                      f"tracks {sorted(session_frame.tracks)}  {messages}")
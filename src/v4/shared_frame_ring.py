@@ -0,0 +1,237 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import serial
+
+from device_manager import TEENSY_PID, TEENSY_VID, find_tactile_port
+from frame_protocol import FrameDecoder
+from frame_source import Frame, FrameSource, FrameStats
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+# Header fields at the start of the shared block (int64 each)
+WRITE_COUNT = 0  # Frames written so far; the newest is in slot (WRITE_COUNT - 1) % capacity
+DROPPED_FRAMES = 1  # Gaps in the firmware sequence numbers seen by the ingest process
+MALFORMED_FRAMES = 2  # Malformed text lines or corrupt binary frames
+CONNECTED = 3  # 1 while the ingest process has the board open
+RECONNECTS = 4
+HEADER_FIELDS = 8
+
+
+class SharedFrameRing:
+    def __init__(self, capacity = 256, frame_length = DEFAULT_GEOMETRY.cells, name = None):
+        """
+        Ring buffer of frames, timestamps and sequence numbers in shared memory.
+        Create it in one process (name=None) and attach to it by name in another.
+        :param capacity: Number of frames the ring holds before it wraps.
+        :param frame_length: Number of values in one frame.
+        :param name: Name of an existing ring to attach to.
+        """
+        self.capacity = capacity
+        self.frame_length = frame_length
+        header_size = HEADER_FIELDS * 8
+        values_size = capacity * frame_length * 2
+        size = header_size + values_size + capacity * 8 * 2
+
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create = True, size = size)
+            self.owner = True
+        else:
+            # Processes started by multiprocessing share the parent's resource tracker, so attaching is enough
+            self.memory = shared_memory.SharedMemory(name = name)
+            self.owner = False
+
+        # NumPy views straight onto the shared block; nothing is copied or pickled
+        buffer = self.memory.buf
+        self.header = np.ndarray(HEADER_FIELDS, dtype = np.int64, buffer = buffer)
+        self.values = np.ndarray((capacity, frame_length), dtype = np.uint16, buffer = buffer, offset = header_size)
+        self.timestamps = np.ndarray(capacity, dtype = np.int64, buffer = buffer, offset = header_size + values_size)
+        self.sequences = np.ndarray(capacity, dtype = np.int64, buffer = buffer, offset = header_size + values_size + capacity * 8)
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def write(self, frames, timestamp_ns, sequences):
+        """Append a batch of frames; the write count is published after the data so readers never see half a frame."""
+        count = int(self.header[WRITE_COUNT])
+        for frame_values, sequence in zip(frames, sequences):
+            slot = count % self.capacity
+            self.values[slot] = frame_values
+            self.timestamps[slot] = timestamp_ns
+            self.sequences[slot] = sequence
+            count += 1
+        self.header[WRITE_COUNT] = count
+
+    def close(self):
+        # Drop the views before closing the mapping
+        self.header = self.values = self.timestamps = self.sequences = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # A caller still holds a frame view; the mapping goes away with the process
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+def ingest_process(ring_name, capacity, frame_length, port_options, frame_format, stop_event):
+    """
+    Body of the ingest process: read the board and write decoded frames into the ring.
+    :param port_options: Keyword arguments for find_tactile_port and the baud rate.
+    """
+    ring = SharedFrameRing(capacity, frame_length, name = ring_name)
+    stats = FrameStats(sequence_modulus = 2 ** 32)
+    backoff = 0.05
+    baudrate = port_options.pop('baudrate')
+    ever_connected = False
+
+    while not stop_event.is_set():
+        port = find_tactile_port(**port_options)
+        try:
+            if port is None:
+                raise serial.SerialException("board not found")
+            serial_port = serial.Serial(port, baudrate, timeout = 0.1)
+        except (serial.SerialException, OSError):
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, 2.0)
+            continue
+
+        if ever_connected:
+            ring.header[RECONNECTS] += 1
+        ever_connected = True
+        ring.header[CONNECTED] = 1
+        backoff = 0.05
+        decoder = FrameDecoder(frame_length, frame_format)
+        host_sequence = 0
+
+        try:
+            while not stop_event.is_set():
+                frames = decoder.read_from(serial_port)
+                if not len(frames):
+                    continue
+                timestamp_ns = time.monotonic_ns()
+                sequences = decoder.last_sequences
+                if sequences is None:
+                    sequences = range(host_sequence, host_sequence + len(frames))
+                    host_sequence += len(frames)
+                for sequence in sequences:
+                    stats.record_arrival(int(sequence))
+                ring.write(frames, timestamp_ns, sequences)
+                ring.header[DROPPED_FRAMES] = stats.dropped_frames
+                ring.header[MALFORMED_FRAMES] = decoder.malformed_frames
+        except (serial.SerialException, OSError) as error:
+            print(f"\nIngest process lost {port}: {error}")
+        finally:
+            ring.header[CONNECTED] = 0
+            serial_port.close()
+
+    ring.close()
+
+
+class SharedMemoryFrameSource(FrameSource):
+    def __init__(self, vid = TEENSY_VID, pid = TEENSY_PID, serial_number = None, comport = None, baudrate = 115200,
+                 frame_length = DEFAULT_GEOMETRY.cells, frame_format = 'auto', capacity = 256, max_age_ms = None):
+        """
+        Read the board in a separate process so rendering and MIDI never hold up the serial port.
+        Frames come back as NumPy views into the shared ring; copy one if it must outlive `capacity` newer frames.
+        Frame listeners (the recorders) are handed the frames written since the last get_next_frame, so the
+        loop must poll at least once every `capacity` frames: older ones are overwritten before any listener
+        sees them. They are counted in stats.overwritten_frames and reported once.
+        :param frame_length: Number of values in one frame; the ring is sized for it up front.
+        :param capacity: Number of frames the shared ring holds.
+        :param max_age_ms: Discard frames older than this instead of processing them late.
+        The other parameters are the same as DeviceManager's.
+        """
+        self.port_options = {'vid': vid, 'pid': pid, 'serial_number': serial_number, 'comport': comport, 'baudrate': baudrate}
+        self.frame_format = frame_format
+        self.ring = SharedFrameRing(capacity, frame_length)
+        self.max_age_ns = None if max_age_ms is None else int(max_age_ms * 1e6)
+        self.frame_stats = FrameStats()
+        self.read_count = 0
+        self.overwrite_reported = False
+        self.ever_connected = False
+        self.stop_event = multiprocessing.Event()
+        self.process = None
+
+    def start(self):
+        if self.process is not None:
+            return self
+        self.process = multiprocessing.Process(
+            target = ingest_process, name = "TacTileIngest", daemon = True,
+            args = (self.ring.name, self.ring.capacity, self.ring.frame_length, dict(self.port_options), self.frame_format, self.stop_event))
+        self.process.start()
+        # Give the ingest process a moment to find the board so the first frames are live
+        deadline = time.monotonic() + 1.0
+        while not self.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout = 2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self.ring.close()
+
+    @property
+    def connected(self):
+        connected = bool(self.ring.header[CONNECTED])
+        self.ever_connected |= connected
+        return connected
+
+    @property
+    def reconnects(self):
+        return int(self.ring.header[RECONNECTS])
+
+    @property
+    def malformed_frames(self):
+        return int(self.ring.header[MALFORMED_FRAMES])
+
+    @property
+    def stats(self):
+        """Frame counters; receiving and sequence gaps are counted by the ingest process."""
+        self.frame_stats.received_frames = int(self.ring.header[WRITE_COUNT])
+        self.frame_stats.dropped_frames = int(self.ring.header[DROPPED_FRAMES])
+        return self.frame_stats
+
+    def get_next_frame(self, timeout = 0):
+        """Return the newest frame written by the ingest process, or None."""
+        deadline = time.monotonic() + timeout
+        write_count = int(self.ring.header[WRITE_COUNT])
+        while write_count == self.read_count:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.0005)
+            write_count = int(self.ring.header[WRITE_COUNT])
+
+        if self.frame_listeners:
+            # Hand listeners every frame since the last read that the ring still holds
+            first = max(self.read_count, write_count - self.ring.capacity)
+            if first > self.read_count:
+                self.frame_stats.overwritten_frames += first - self.read_count
+                if not self.overwrite_reported:
+                    print(f"\nThe display fell more than {self.ring.capacity} frames behind; "
+                          f"{first - self.read_count} frames were overwritten before reaching the recorders.")
+                    self.overwrite_reported = True
+            slots = np.arange(first, write_count) % self.ring.capacity
+            for slot in slots:
+                self._notify_listeners(self.ring.values[slot:slot + 1], int(self.ring.timestamps[slot]), [int(self.ring.sequences[slot])])
+
+        # Latest frame wins
+        self.frame_stats.skipped_frames += write_count - self.read_count - 1
+        self.read_count = write_count
+        slot = (write_count - 1) % self.ring.capacity
+        frame = Frame(self.ring.values[slot], int(self.ring.timestamps[slot]), int(self.ring.sequences[slot]))
+
+        if self.max_age_ns is not None and time.monotonic_ns() - frame.timestamp_ns > self.max_age_ns:
+            self.frame_stats.stale_frames += 1
+            return None
+        self.frame_stats.record_processed(frame)
+        return frame
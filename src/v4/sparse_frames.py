@@ -0,0 +1,153 @@
+import struct
+
+import numpy as np
+
+
+# Sparse packet layout:
+#
+#   header    kind (KEYFRAME or SPARSE), sequence uint32, timestamp_ns int64, keyframe_sequence uint32, count uint16
+#   keyframe  count uint16 values (every cell)
+#   sparse    count uint16 cell indices, then count uint16 values
+#
+# A sparse packet lists only the cells that differ from its keyframe by more than the
+# tolerance; the others are taken from the keyframe. keyframe_sequence names that keyframe by the
+# number the encoder gave its packet (a keyframe names itself), so a decoder that lost or reordered
+# a keyframe drops the sparse packets built on it instead of applying them to the wrong frame.
+# sequence is the frame's own sequence number, or the packet number when the caller has none. An idle surface costs a
+# header per frame, a touch a few bytes per pressed cell. Packets carry their own length, so
+# they can be written back to back on a pipe or socket.
+PACKET_HEADER = struct.Struct('<BIqIH')
+KEYFRAME, SPARSE = 0, 1
+
+
+def sparse_mask(values, baseline, tolerance):
+    """True for the cells that differ from the baseline by more than the tolerance."""
+    return np.abs(values.astype(np.int32) - baseline.astype(np.int32)) > tolerance
+
+
+class SparseFrameEncoder:
+    def __init__(self, cells, tolerance = 0, keyframe_interval = 100):
+        """
+        Encode frames as sparse deviations from the last keyframe.
+        :param cells: Number of values per frame.
+        :param tolerance: Deviations up to this are dropped (0 is lossless).
+        :param keyframe_interval: Send a dense keyframe at least this often, so a receiver that
+            joins late or drops a packet recovers.
+        """
+        self.cells = cells
+        self.tolerance = tolerance
+        self.keyframe_interval = keyframe_interval
+        self.baseline = None
+        self.keyframe_sequence = 0
+        self.frames_since_keyframe = 0
+        # Every packet gets the next number, so keyframes are told apart whatever sequence the caller passes
+        self.packet_number = 0
+
+    def force_keyframe(self):
+        """Make the next packet a keyframe, e.g. when a receiver reports needs_keyframe."""
+        self.baseline = None
+
+    def encode(self, values, timestamp_ns = 0, sequence = None):
+        """
+        Encode one frame into a packet.
+        :param sequence: Sequence number of the frame, or None to send the packet number.
+        """
+        values = np.asarray(values, dtype = np.uint16)
+        packet_number = self.packet_number % 2 ** 32
+        self.packet_number += 1
+        sequence = packet_number if sequence is None else sequence % 2 ** 32
+        if self.baseline is not None and self.frames_since_keyframe < self.keyframe_interval:
+            indices = np.flatnonzero(sparse_mask(values, self.baseline, self.tolerance))
+            # Once half the surface has changed a keyframe is no bigger, and resets the baseline
+            if len(indices) * 2 < self.cells:
+                self.frames_since_keyframe += 1
+                header = PACKET_HEADER.pack(SPARSE, sequence, timestamp_ns, self.keyframe_sequence, len(indices))
+                return header + indices.astype('<u2').tobytes() + values[indices].astype('<u2').tobytes()
+
+        self.baseline = values.copy()
+        self.keyframe_sequence = packet_number
+        self.frames_since_keyframe = 1
+        return PACKET_HEADER.pack(KEYFRAME, sequence, timestamp_ns, self.keyframe_sequence, self.cells) + values.astype('<u2').tobytes()
+
+
+class SparseFrameDecoder:
+    def __init__(self, cells):
+        """
+        Rebuild frames from sparse packets.
+        :param cells: Number of values per frame.
+        """
+        self.cells = cells
+        self.baseline = None
+        self.keyframe_sequence = None  # Sequence of the keyframe in baseline
+        self.needs_keyframe = True  # No keyframe yet, or sparse packets refer to one that never arrived
+        self.buffer = bytearray()
+        self.skipped_packets = 0  # Sparse packets dropped because their keyframe was missing
+
+    def decode(self, packet):
+        """
+        Decode one packet.
+        :return: (values, timestamp_ns, sequence), or None for a sparse packet whose keyframe was not received.
+        """
+        kind, sequence, timestamp_ns, keyframe_sequence, count = PACKET_HEADER.unpack_from(packet)
+        body = np.frombuffer(packet, dtype = '<u2', offset = PACKET_HEADER.size)
+        if kind == KEYFRAME:
+            self.baseline = body[:count].astype(np.uint16)
+            self.keyframe_sequence = keyframe_sequence
+            self.needs_keyframe = False
+            return self.baseline.copy(), timestamp_ns, sequence
+
+        if self.baseline is None or keyframe_sequence != self.keyframe_sequence:
+            # Applying it to another keyframe would give a corrupt frame; wait for the next keyframe
+            self.skipped_packets += 1
+            self.needs_keyframe = True
+            return None
+        values = self.baseline.copy()
+        values[body[:count]] = body[count:2 * count]
+        return values, timestamp_ns, sequence
+
+    def feed(self, data):
+        """
+        Add bytes from a stream of back-to-back packets.
+        :return: List of (values, timestamp_ns, sequence) for every complete packet.
+        """
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= PACKET_HEADER.size:
+            kind, _, _, _, count = PACKET_HEADER.unpack_from(self.buffer)
+            size = PACKET_HEADER.size + (2 if kind == KEYFRAME else 4) * count
+            if len(self.buffer) < size:
+                break
+            frame = self.decode(bytes(self.buffer[:size]))
+            del self.buffer[:size]
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+
+def encode_sparse_chunk(values, tolerance = 0):
+    """
+    Sparse-encode a chunk of frames for a recording: the first frame is the keyframe, the rest
+    are the cells that differ from it. Returns the encoded bytes.
+    """
+    keyframe = values[0]
+    mask = sparse_mask(values[1:], keyframe, tolerance)
+    counts = mask.sum(axis = 1).astype('<u4')
+    frame_numbers, indices = np.nonzero(mask)
+    changed = values[1:][frame_numbers, indices]
+    return (keyframe.astype('<u2').tobytes() + counts.tobytes()
+            + indices.astype('<u2').tobytes() + changed.astype('<u2').tobytes())
+
+
+def decode_sparse_chunk(data, frame_count, cells):
+    """Inverse of encode_sparse_chunk: return the (frame_count, cells) uint16 values."""
+    keyframe = np.frombuffer(data, dtype = '<u2', count = cells)
+    counts = np.frombuffer(data, dtype = '<u4', count = frame_count - 1, offset = 2 * cells)
+    total = int(counts.sum())
+    offset = 2 * cells + 4 * (frame_count - 1)
+    indices = np.frombuffer(data, dtype = '<u2', count = total, offset = offset)
+    changed = np.frombuffer(data, dtype = '<u2', count = total, offset = offset + 2 * total)
+
+    values = np.empty((frame_count, cells), dtype = np.uint16)
+    values[:] = keyframe
+    values[1 + np.repeat(np.arange(frame_count - 1), counts), indices] = changed
+    return values
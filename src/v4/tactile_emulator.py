@@ -0,0 +1,226 @@
+import argparse
+import os
+import pty
+import signal
+import sys
+import time
+import tty
+
+import numpy as np
+
+from frame_protocol import encode_binary_frame, encode_text_frame
+from sensor_geometry import DEFAULT_GEOMETRY, SensorGeometry
+
+
+# Reading of a firmly pressed cell; an untouched one reads the geometry's idle_value
+PRESSED_LEVEL = 20
+
+
+def touch_frame(touches, rows = DEFAULT_GEOMETRY.rows, cols = DEFAULT_GEOMETRY.cols, noise = 4, rng = None, idle_value = DEFAULT_GEOMETRY.idle_value):
+    """
+    Render a frame of sensor values for a set of touches.
+    :param touches: List of (y, x, pressure); y and x run 0-1 across the surface, pressure 0-1.
+    :param idle_value: Reading of an untouched cell, as in SensorGeometry.
+    :return: Flat uint16 array of rows * cols values.
+    """
+    rng = rng or np.random.default_rng()
+    row_grid, col_grid = np.mgrid[0:rows, 0:cols]
+    depth = np.zeros((rows, cols))
+    for y, x, pressure in touches:
+        row, col = y * (rows - 1), x * (cols - 1)
+        # A fingertip covers roughly one to two cells
+        spread = np.exp(-((row_grid - row) ** 2 + (col_grid - col) ** 2) / (2 * 0.7 ** 2))
+        depth = np.maximum(depth, pressure * spread)
+    values = idle_value - depth * (idle_value - PRESSED_LEVEL) + rng.normal(0, noise, (rows, cols))
+    return np.clip(values, 0, idle_value).astype(np.uint16).ravel()
+
+
+def idle_scenario(t):
+    """Nobody touching the surface."""
+    return []
+
+
+def tap_scenario(t):
+    """One finger tapping the centre of the surface twice a second."""
+    return [(0.5, 0.5, 1.0)] if (t % 0.5) < 0.25 else []
+
+
+def swipe_scenario(t):
+    """One finger sliding left to right along the middle row every two seconds."""
+    return [(0.5, (t % 2.0) / 2.0, 1.0)]
+
+
+def multitouch_scenario(t):
+    """Three fingers on different strings, pressed and released out of phase."""
+    touches = []
+    for index, (y, x) in enumerate([(0.15, 0.15), (0.5, 0.5), (0.9, 0.85)]):
+        if ((t + index * 0.3) % 1.2) < 0.8:
+            touches.append((y, x + 0.025 * np.sin(2 * np.pi * t), 0.9))
+    return touches
+
+
+SCENARIOS = {
+    'idle': idle_scenario,
+    'tap': tap_scenario,
+    'swipe': swipe_scenario,
+    'multitouch': multitouch_scenario,
+}
+
+
+class TacTileEmulator:
+    def __init__(self, rate = 100.0, frame_format = 'text', scenario = 'tap', recording = None, loop = True, geometry = DEFAULT_GEOMETRY):
+        """
+        Pretend to be a TacTile board on a pseudo-terminal.
+        :param rate: Frames per second to send.
+        :param frame_format: 'text' for the legacy firmware format, 'binary' for the framed protocol.
+        :param scenario: Name of a scripted touch scenario in SCENARIOS, or 'random'.
+        :param recording: (n_frames, rows * cols) array of recorded frames to play instead of a scenario.
+        :param loop: Start the recording again when it ends.
+        :param geometry: SensorGeometry of the emulated matrix.
+        """
+        self.rate = rate
+        self.frame_format = frame_format
+        self.scenario = scenario
+        self.recording = recording
+        self.loop = loop
+        self.rows = geometry.rows
+        self.cols = geometry.cols
+        self.idle_value = geometry.idle_value
+        self.rng = np.random.default_rng()
+        self.sequence = 0
+        self.dropped = 0
+        self.master_fd = None
+        self.slave_fd = None
+        self.port_name = None
+
+    def open(self):
+        """Create the pseudo-terminal and return the port name a reader should open."""
+        self.master_fd, self.slave_fd = pty.openpty()
+        # Raw mode so the line discipline does not touch the bytes (binary frames, \r\n)
+        tty.setraw(self.slave_fd)
+        self.port_name = os.ttyname(self.slave_fd)
+        # A board keeps streaming whether or not anyone reads the port, so writes must never wait for a reader
+        os.set_blocking(self.master_fd, False)
+        return self.port_name
+
+    def close(self):
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = self.slave_fd = None
+
+    def next_frame(self, t):
+        """Sensor values for the frame sent at t seconds after the start; None when a recording ends."""
+        if self.recording is not None:
+            index = self.sequence
+            if index >= len(self.recording):
+                if not self.loop:
+                    return None
+                index %= len(self.recording)
+            return self.recording[index]
+        if self.scenario == 'random':
+            return self.rng.integers(0, 1024, self.rows * self.cols, dtype = np.uint16)
+        return touch_frame(SCENARIOS[self.scenario](t), self.rows, self.cols, rng = self.rng, idle_value = self.idle_value)
+
+    def encode(self, values):
+        if self.frame_format == 'binary':
+            return encode_binary_frame(values, self.sequence)
+        return encode_text_frame(values)
+
+    def send(self, frames):
+        """
+        Write encoded frames to the port in one go. When nobody reads the port its buffer fills up,
+        and the frames that do not fit are dropped, as a USB serial device drops them.
+        """
+        chunk = b''.join(frames)
+        try:
+            written = os.write(self.master_fd, chunk)
+        except BlockingIOError:
+            written = 0
+        # A frame cut off part way is lost too; the reader resynchronises on the next one
+        sent = 0
+        for frame in frames:
+            if written < len(frame):
+                break
+            written -= len(frame)
+            sent += 1
+        self.dropped += len(frames) - sent
+
+    def run(self, duration = None):
+        """
+        Stream frames at the configured rate until interrupted, the duration passes or the recording ends.
+        Frames that fall due while the previous write is still going out are sent together, which is
+        how kHz rates stay on schedule.
+        """
+        period = 1.0 / self.rate
+        start = time.monotonic()
+        next_time = start
+        reported = start
+
+        while duration is None or next_time - start < duration:
+            now = time.monotonic()
+            if now < next_time:
+                time.sleep(next_time - now)
+                now = next_time
+
+            # Every frame that is due by now goes out in one write
+            frames = []
+            while next_time <= now:
+                values = self.next_frame(next_time - start)
+                if values is None:
+                    break
+                frames.append(self.encode(values))
+                self.sequence += 1
+                next_time += period
+            else:
+                self.send(frames)
+                if now - reported >= 1.0:
+                    print(f"Sent {self.sequence} frames ({self.sequence / (now - start):.0f} Hz), dropped {self.dropped} with nobody reading")
+                    reported = now
+                continue
+
+            self.send(frames)
+            print("Recording finished.")
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Emulate a TacTile board on a pseudo-terminal.")
+    parser.add_argument('--rate', type = float, default = 100.0, help = "frames per second (default 100)")
+    parser.add_argument('--format', choices = ['text', 'binary'], default = 'text', help = "frame format to send")
+    parser.add_argument('--scenario', choices = sorted(SCENARIOS) + ['random'], default = 'tap', help = "scripted touches to play")
+    parser.add_argument('--replay', help = "recorded .npy session to play instead of a scenario")
+    parser.add_argument('--no-loop', action = 'store_true', help = "stop when the recording ends")
+    parser.add_argument('--duration', type = float, help = "seconds to run for (default: until interrupted)")
+    parser.add_argument('--geometry', default = f"{DEFAULT_GEOMETRY.rows}x{DEFAULT_GEOMETRY.cols}", help = "matrix size as ROWSxCOLS")
+    parser.add_argument('--link', help = "also create a symlink to the port at this path, e.g. /tmp/tactile")
+    args = parser.parse_args()
+
+    recording = None
+    if args.replay:
+        recording = np.clip(np.load(args.replay, mmap_mode = 'r'), 0, 65535).astype(np.uint16)
+        recording = recording.reshape(len(recording), -1)
+
+    emulator = TacTileEmulator(args.rate, args.format, args.scenario, recording, loop = not args.no_loop, geometry = SensorGeometry.parse(args.geometry))
+    port_name = emulator.open()
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(port_name, args.link)
+    print(f"Emulating TacTile on {args.link or port_name} at {args.rate:g} Hz ({args.format})")
+    print(f"Run: python sensor_display.py {args.link or port_name}")
+
+    # Clean up the port and link when killed as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        emulator.run(args.duration)
+    except KeyboardInterrupt:
+        print("Stopping emulator.")
+    finally:
+        emulator.close()
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == '__main__':
+    main()
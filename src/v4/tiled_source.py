@@ -0,0 +1,196 @@
+import json
+import time
+
+import numpy as np
+
+from device_manager import DeviceManager
+from frame_source import Frame, FrameSource
+from sensor_geometry import DEFAULT_GEOMETRY, SensorGeometry
+
+
+class BoardLayout:
+    def __init__(self, boards, board_rows = DEFAULT_GEOMETRY.rows, board_cols = DEFAULT_GEOMETRY.cols):
+        """
+        Where each TacTile board sits in a larger surface.
+        :param boards: List of dicts, one per board, with:
+            'port' and/or 'serial_number' to find the board,
+            'row' and 'col' of its top-left cell in the combined matrix,
+            optional 'rotate': 180 for a board mounted upside down.
+        :param board_rows: Rows of cells on one board.
+        :param board_cols: Columns of cells on one board.
+        """
+        self.boards = boards
+        self.board_rows = board_rows
+        self.board_cols = board_cols
+        self.rows = max(board['row'] for board in boards) + board_rows
+        self.cols = max(board['col'] for board in boards) + board_cols
+
+    @property
+    def shape(self):
+        """(rows, cols) of the combined matrix."""
+        return self.rows, self.cols
+
+    @property
+    def geometry(self):
+        """SensorGeometry of the combined surface."""
+        return SensorGeometry(self.rows, self.cols)
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        Load a layout file, e.g.
+        {"board_rows": 10, "board_cols": 20,
+         "boards": [{"serial_number": "12603200", "row": 0, "col": 0},
+                    {"serial_number": "12603201", "row": 0, "col": 20}]}
+        """
+        with open(path) as layout_file:
+            layout = json.load(layout_file)
+        return cls(layout['boards'], layout.get('board_rows', DEFAULT_GEOMETRY.rows), layout.get('board_cols', DEFAULT_GEOMETRY.cols))
+
+
+class BoardStats:
+    def __init__(self, name):
+        """Per-board counters of the tiled source."""
+        self.name = name
+        self.frames_used = 0  # Combined frames this board contributed a fresh frame to
+        self.lagging_frames = 0  # Combined frames that went out with this board's previous frame
+        self.missing_frames = 0  # Combined frames that went out before this board sent anything
+        self.last_lag_ms = 0.0  # How far behind the newest board this board's last frame was
+
+    def __str__(self):
+        return (f"{self.name}: used {self.frames_used}, lagging {self.lagging_frames}, "
+                f"missing {self.missing_frames}, lag {self.last_lag_ms:.1f} ms")
+
+
+class TiledFrameSource(FrameSource):
+    def __init__(self, layout, baudrate = 115200, tolerance_ms = 5.0, idle_value = DEFAULT_GEOMETRY.idle_value, max_age_ms = None):
+        """
+        Read several boards concurrently and stitch their frames into one matrix.
+        :param layout: BoardLayout describing where each board sits.
+        :param baudrate: Serial baud rate of every board.
+        :param tolerance_ms: Frames whose arrival times are this close belong to the same scan.
+        :param idle_value: Value used for cells of a board that has not sent anything yet.
+        :param max_age_ms: Discard frames older than this instead of processing them late.
+        """
+        self.layout = layout
+        self.tolerance_ns = int(tolerance_ms * 1e6)
+        cells = layout.board_rows * layout.board_cols
+        # One reader thread per board, each reconnecting on its own. A tile only ever opens its own configured
+        # port or serial number, and never one another tile is reading, so two tiles cannot read the same board
+        self.claimed_ports = set()
+        self.managers = [
+            DeviceManager(serial_number = board.get('serial_number'), comport = board.get('port'), baudrate = baudrate,
+                          frame_length = cells, max_age_ms = max_age_ms, strict = True, claimed_ports = self.claimed_ports)
+            for board in layout.boards]
+        self.board_stats = [BoardStats(board.get('serial_number') or board.get('port')) for board in layout.boards]
+
+        self.matrix = np.full(layout.shape, idle_value, dtype = np.uint16)
+        self.latest = [None] * len(layout.boards)  # Newest Frame seen from each board
+        self.fresh = [False] * len(layout.boards)  # Board sent a frame since the last combined frame
+        self.first_fresh_ns = None
+        self.sequence = 0
+
+    def start(self):
+        for manager in self.managers:
+            manager.start()
+        return self
+
+    def stop(self):
+        for manager in self.managers:
+            manager.stop()
+
+    @property
+    def connected(self):
+        """True while at least one board is connected."""
+        return any(manager.connected for manager in self.managers)
+
+    @property
+    def ever_connected(self):
+        return any(manager.ever_connected for manager in self.managers)
+
+    @property
+    def reconnects(self):
+        return sum(manager.reconnects for manager in self.managers)
+
+    def get_next_frame(self, timeout = 0):
+        """
+        Return the newest combined Frame, or None.
+        A combined frame goes out once every board has a fresh frame, or once the first fresh frame
+        has waited longer than the tolerance, so a slow or unplugged board cannot stall the rest.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self._collect()
+            if any(self.fresh):
+                everyone_fresh = all(self.fresh)
+                waited_long_enough = time.monotonic_ns() - self.first_fresh_ns > self.tolerance_ns
+                if everyone_fresh or waited_long_enough:
+                    return self._combine()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.0005)
+
+    def _collect(self):
+        for index, manager in enumerate(self.managers):
+            frame = manager.get_next_frame()
+            if frame is None:
+                continue
+            self.latest[index] = frame
+            if not any(self.fresh):
+                self.first_fresh_ns = frame.timestamp_ns
+            self.fresh[index] = True
+
+    def _combine(self):
+        """Stitch the newest frame of every board into the combined matrix."""
+        newest_ns = max(frame.timestamp_ns for frame in self.latest if frame is not None)
+        rows, cols = self.layout.board_rows, self.layout.board_cols
+
+        for index, (board, frame) in enumerate(zip(self.layout.boards, self.latest)):
+            stats = self.board_stats[index]
+            if frame is None:
+                stats.missing_frames += 1
+                continue
+
+            stats.last_lag_ms = (newest_ns - frame.timestamp_ns) / 1e6
+            if self.fresh[index] and newest_ns - frame.timestamp_ns <= self.tolerance_ns:
+                stats.frames_used += 1
+            else:
+                stats.lagging_frames += 1
+
+            tile = np.asarray(frame.values).reshape(rows, cols)
+            if board.get('rotate') == 180:
+                tile = tile[::-1, ::-1]
+            self.matrix[board['row']:board['row'] + rows, board['col']:board['col'] + cols] = tile
+
+        self.fresh = [False] * len(self.managers)
+        self.sequence += 1
+        frame = Frame(self.matrix.ravel().copy(), newest_ns, self.sequence)
+        self._notify_listeners(frame.values[np.newaxis], frame.timestamp_ns, [frame.sequence])
+        return frame
+
+    @property
+    def stats(self):
+        """Per-board lag and drop counters, one line per board."""
+        lines = []
+        for manager, stats in zip(self.managers, self.board_stats):
+            lines.append(f"{stats}\t{manager.stats or 'disconnected'}")
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Print the per-board statistics of a tiled surface once a second
+    tiled_source = TiledFrameSource(BoardLayout.from_json(sys.argv[1])).start()
+    print(f"Combined matrix: {tiled_source.layout.rows} x {tiled_source.layout.cols}")
+    try:
+        last_report = time.monotonic()
+        while True:
+            tiled_source.get_next_frame(timeout = 0.1)
+            if time.monotonic() - last_report >= 1.0:
+                print(f"\n{tiled_source.stats}")
+                last_report = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tiled_source.stop()
@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+# Per-touch statistics returned by touch_components
+# frame: index of the frame along the first axis
+# label: label of the touch, unique across the whole batch
+# area: number of cells
+# row, col: centroid in cells, weighted by pressure
+# pressure: summed pressure of the cells
+COMPONENT_DTYPE = np.dtype([('frame', '<i4'), ('label', '<i8'), ('area', '<i4'), ('row', '<f4'), ('col', '<f4'), ('pressure', '<f4')])
+
+
+def touch_mask(values, threshold_min = 10):
+    """
+    Cells that count as touched, the same test FramePreprocessor.process makes on the image:
+    a cell is touched when its 8-bit grey level (value / 4, see FramePreprocessor.normalize) is not above threshold_min.
+    :param values: Sensor values of any shape.
+    """
+    return (np.asarray(values) >> 2) <= threshold_min
+
+
+def touch_pressure(values, mask, idle_value = DEFAULT_GEOMETRY.idle_value):
+    """
+    How far every touched cell reads below an untouched one; 0 for the cells outside the mask.
+    :param values: Sensor values of any shape.
+    :param mask: touch_mask of the same values.
+    """
+    return np.where(mask, np.clip(idle_value - np.asarray(values).astype(np.int32), 0, None), 0)
+
+
+def dark_spot(upsampler, grey, cells, threshold_min = 10):
+    """
+    Measure the black spot some touched cells leave in the thresholded image, so detectors that work on the
+    grid can size and place touches the way SimpleBlobDetector sees them. Only the cells around the touch are
+    upsampled (see SeparableUpsampler.upsample_cells), and black pixels count when they lie in one of the
+    cells or next to one, which keeps touches further away out of the spot.
+    :param upsampler: SeparableUpsampler of the frames.
+    :param grey: (rows, cols) 8-bit grey levels of the frame, as FramePreprocessor.normalize gives them.
+    :param cells: (rows, cols) bool array of the cells of the touch.
+    :return: (area, y, x): the number of black pixels and their centroid, in pixels of the upsampled image;
+        y and x are NaN when there are none.
+    """
+    rows, cols = cells.shape
+    cell_rows, cell_cols = np.nonzero(cells)
+    row_start, row_stop = max(cell_rows.min() - 1, 0), min(cell_rows.max() + 2, rows)
+    col_start, col_stop = max(cell_cols.min() - 1, 0), min(cell_cols.max() + 2, cols)
+
+    # The touch's cells and their 8 neighbours
+    window = np.pad(cells[row_start:row_stop, col_start:col_stop], 1)
+    height, width = row_stop - row_start, col_stop - col_start
+    near = np.zeros((height, width), dtype = bool)
+    for row_shift in range(3):
+        for col_shift in range(3):
+            near |= window[row_shift:row_shift + height, col_shift:col_shift + width]
+
+    # cv2.threshold turns a pixel black when it is not above threshold_min
+    cell_pixels = upsampler.cell_pixels
+    black = upsampler.upsample_cells(grey, row_start, row_stop, col_start, col_stop) <= threshold_min
+    black &= np.repeat(np.repeat(near, cell_pixels, axis = 0), cell_pixels, axis = 1)
+    black_rows, black_cols = np.nonzero(black)
+    if not len(black_rows):
+        return 0, math.nan, math.nan
+    return len(black_rows), black_rows.mean() + row_start * cell_pixels, black_cols.mean() + col_start * cell_pixels
+
+
+def label_touches(mask):
+    """
+    Label the 8-connected touched regions of every frame at once.
+    :param mask: (frames, rows, cols) or (rows, cols) bool array.
+    :return: int64 array of the same shape; -1 for untouched cells, otherwise the flat index of the
+        first cell of the region, so labels are unique across the whole batch.
+    """
+    mask = np.asarray(mask, dtype = bool)
+    squeeze = mask.ndim == 2
+    if squeeze:
+        mask = mask[np.newaxis]
+    frames, rows, cols = mask.shape
+    background = np.iinfo(np.int64).max
+
+    labels = np.where(mask, np.arange(mask.size, dtype = np.int64).reshape(mask.shape), background)
+    padded = np.full((frames, rows + 2, cols + 2), background, dtype = np.int64)
+    touched = np.flatnonzero(mask)
+    while True:
+        # Take the smallest label among each cell and its 8 neighbours
+        padded[:, 1:-1, 1:-1] = labels
+        smallest = labels.copy()
+        for row_shift in range(3):
+            for col_shift in range(3):
+                np.minimum(smallest, padded[:, row_shift:row_shift + rows, col_shift:col_shift + cols], out = smallest)
+        smallest[~mask] = background
+
+        # Pointer jumping: a label is a cell index, so follow it to that cell's label
+        flat = smallest.ravel()
+        flat[touched] = flat[flat[touched]]
+        if np.array_equal(smallest, labels):
+            break
+        labels = smallest
+
+    labels[~mask] = -1
+    return labels[0] if squeeze else labels
+
+
+def touch_components(labels, pressure = None):
+    """
+    Area, centroid and pressure of every labelled touch.
+    :param labels: (frames, rows, cols) output of label_touches.
+    :param pressure: Per-cell pressure of the same shape used to weight the centroid; None weights every cell equally.
+    :return: COMPONENT_DTYPE array ordered by frame, then by label.
+    """
+    labels = np.asarray(labels)
+    if labels.ndim == 2:
+        labels = labels[np.newaxis]
+    frames, rows, cols = labels.shape
+    touched = np.flatnonzero(labels >= 0)
+    component_labels, component_of_cell = np.unique(labels.ravel()[touched], return_inverse = True)
+    count = len(component_labels)
+
+    _, cell_row, cell_col = np.unravel_index(touched, labels.shape)
+    area = np.bincount(component_of_cell, minlength = count)
+    if pressure is None:
+        total_pressure = np.zeros(count)
+        weights = np.ones(len(touched))
+    else:
+        weights = np.asarray(pressure, dtype = np.float64).ravel()[touched]
+        total_pressure = np.bincount(component_of_cell, weights, minlength = count)
+        # A touch whose cells all have zero pressure gets the plain centroid
+        weights = np.where(total_pressure[component_of_cell] > 0, weights, 1)
+    total_weight = np.bincount(component_of_cell, weights, minlength = count)
+
+    components = np.zeros(count, dtype = COMPONENT_DTYPE)
+    components['label'] = component_labels
+    components['frame'] = component_labels // (rows * cols)
+    components['area'] = area
+    components['row'] = np.bincount(component_of_cell, weights * cell_row, minlength = count) / total_weight
+    components['col'] = np.bincount(component_of_cell, weights * cell_col, minlength = count) / total_weight
+    components['pressure'] = total_pressure
+    return components
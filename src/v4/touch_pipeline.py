@@ -0,0 +1,71 @@
+import sensor_display
+from blob_detectors import DEFAULT_DETECTOR, create_detector
+from frame_preprocessor import FramePreprocessor
+from upsampler import DEFAULT_KERNEL
+from sensor_display import BlobToMIDIConverter, PersistentBlobTracker, set_geometry
+
+
+class TouchPipeline:
+    def __init__(self, note_grid, midi_port, threshold_min = 10, threshold_max = 255, area_min = 120, area_max = 12000, geometry = None, session_log = None, detector = DEFAULT_DETECTOR, upsample_kernel = DEFAULT_KERNEL, calibration = None):
+        """
+        The detect -> track -> MIDI path of sensor_display.py without any windows or trackbars.
+        :param note_grid: Instance of MIDINoteGrid that represents the note grid.
+        :param midi_port: MIDI output port name passed on to BlobToMIDIConverter.
+        :param threshold_min: Same as the "Thresh Min" trackbar.
+        :param threshold_max: Same as the "Thresh Max" trackbar.
+        :param area_min: Same as the "Area Min" trackbar.
+        :param area_max: Same as the "Area Max" trackbar.
+        :param geometry: SensorGeometry of the frames; None keeps the one sensor_display is set to.
+        :param session_log: SessionLogWriter that gets every frame, detection and track; wrap midi_port
+            in a LoggingMIDIPort to log the MIDI messages too.
+        :param detector: Name of the detector backend in blob_detectors.DETECTOR_BACKENDS.
+        :param upsample_kernel: Name of the upsampling kernel in upsampler.UPSAMPLE_KERNELS.
+        :param calibration: CellCalibration applied to every frame before detection; session logs keep the raw frames.
+        """
+        if geometry is not None:
+            set_geometry(geometry)
+        self.threshold_min = threshold_min
+        self.threshold_max = threshold_max
+        self.preprocessor = FramePreprocessor(sensor_display.geometry, upsample_kernel)
+        self.detector = create_detector(detector, threshold_min, threshold_max, area_min, area_max, sensor_display.geometry)
+        self.blob_tracker = PersistentBlobTracker()
+        self.midi_converter = BlobToMIDIConverter(note_grid, midi_port)
+        self.session_log = session_log
+        self.calibration = calibration
+
+    def preprocess(self, sensor_data):
+        """Turn one frame of sensor values into the thresholded image the detector works on; the image is reused for the next frame."""
+        return self.preprocessor.process(sensor_data, self.threshold_min, self.threshold_max)[2]
+
+    def detect(self, sensor_data):
+        """Turn one frame of sensor values into blob keypoints."""
+        if self.calibration is not None:
+            sensor_data = self.calibration.apply(sensor_data)
+        if self.detector.uses_image:
+            return self.detector.detect(self.preprocess(sensor_data))
+        return self.detector.detect(sensor_data)
+
+    def track(self, keypoints):
+        """Assign persistent IDs to the detected blobs."""
+        return self.blob_tracker.update_blobs(keypoints)
+
+    def play(self, blob_positions):
+        """Send the MIDI messages for the tracked blobs."""
+        self.midi_converter.process_blobs(blob_positions)
+
+    def process(self, sensor_data, timestamp_ns = None, sequence = -1):
+        """Run one frame through the whole pipeline and return the tracked blob positions."""
+        if self.session_log is None:
+            blob_positions = self.track(self.detect(sensor_data))
+        else:
+            self.session_log.log_frame(sensor_data, timestamp_ns, sequence)
+            keypoints = self.detect(sensor_data)
+            blob_positions = self.track(keypoints)
+            self.session_log.log_keypoints(keypoints)
+            self.session_log.log_tracks(blob_positions)
+        self.play(blob_positions)
+        return blob_positions
+
+    def stop_all_notes(self):
+        """Panic: send note_off for every sounding note."""
+        self.midi_converter.stop_all_notes()
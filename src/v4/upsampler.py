@@ -0,0 +1,159 @@
+import functools
+import math
+
+import numpy as np
+
+from sensor_geometry import DEFAULT_GEOMETRY
+
+
+# cv2.resize works on 8-bit images in fixed point: every weight is scaled by 2048 and rounded,
+# and the two passes are scaled back with one rounding shift at the end
+COEFFICIENT_SCALE = 2048
+RESULT_SCALE = 1.0 / (COEFFICIENT_SCALE * COEFFICIENT_SCALE)
+
+SQRT_HALF = 0.70710678118654752440084436210485
+LANCZOS4_PHASES = np.array([(1, 0), (-SQRT_HALF, -SQRT_HALF), (0, 1), (SQRT_HALF, -SQRT_HALF),
+                            (-1, 0), (SQRT_HALF, SQRT_HALF), (0, -1), (-SQRT_HALF, SQRT_HALF)])
+
+
+def lanczos4_weights(fractions):
+    """OpenCV's interpolateLanczos4 for every fraction at once, in the same float32 steps."""
+    taps = np.arange(8, dtype = np.float32)
+    shifted = fractions + np.float32(3)
+    angle = -shifted.astype(np.float64) * math.pi * 0.25
+    distances = shifted[:, np.newaxis] - taps
+    scaled = -distances.astype(np.float64) * math.pi * 0.25
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        weights = ((LANCZOS4_PHASES[:, 0] * np.sin(angle)[:, np.newaxis] + LANCZOS4_PHASES[:, 1] * np.cos(angle)[:, np.newaxis])
+                   / (scaled * scaled)).astype(np.float32)
+    weights[np.abs(distances) < 1e-6] = 1e6
+
+    # Summed one tap after another like the C loop, so the normalisation rounds the same way
+    total = np.zeros(len(fractions), dtype = np.float32)
+    for tap in range(8):
+        total += weights[:, tap]
+    return weights * (np.float32(1) / total)[:, np.newaxis]
+
+
+def bicubic_weights(fractions):
+    """OpenCV's interpolateCubic (A = -0.75) for every fraction at once."""
+    a = np.float32(-0.75)
+    x = fractions
+    weights = np.empty((len(x), 4), dtype = np.float32)
+    weights[:, 0] = ((a * (x + 1) - 5 * a) * (x + 1) + 8 * a) * (x + 1) - 4 * a
+    weights[:, 1] = ((a + 2) * x - (a + 3)) * x * x + 1
+    weights[:, 2] = ((a + 2) * (1 - x) - (a + 3)) * (1 - x) * (1 - x) + 1
+    weights[:, 3] = np.float32(1) - weights[:, 0] - weights[:, 1] - weights[:, 2]
+    return weights
+
+
+def bilinear_weights(fractions):
+    return np.stack([np.float32(1) - fractions, fractions], axis = 1)
+
+
+# Kernels by name: (taps, weight function, dtype the operator runs in)
+# lanczos4 runs in float64, where the fixed-point sums are exact, so it matches cv2.INTER_LANCZOS4 bit for bit;
+# the cheaper kernels run in float32 and stay within one grey level of cv2.INTER_CUBIC and cv2.INTER_LINEAR
+UPSAMPLE_KERNELS = {
+    'lanczos4': (8, lanczos4_weights, np.float64),
+    'bicubic': (4, bicubic_weights, np.float32),
+    'bilinear': (2, bilinear_weights, np.float32),
+}
+DEFAULT_KERNEL = 'lanczos4'
+
+
+@functools.lru_cache(maxsize = None)
+def interpolation_matrix(source_length, target_length, kernel = DEFAULT_KERNEL):
+    """
+    (target_length, source_length) matrix of the fixed-point weights cv2.resize uses along one axis.
+    Sample positions follow OpenCV's pixel-centre mapping, and taps past the edge repeat the edge cell.
+    """
+    taps, weight_function, _ = UPSAMPLE_KERNELS[kernel]
+    scale = 1.0 / (target_length / source_length)
+    positions = ((np.arange(target_length) + 0.5) * scale - 0.5).astype(np.float32)
+    starts = np.floor(positions).astype(np.int64)
+    fractions = (positions - starts).astype(np.float32)
+    if kernel == 'bilinear':
+        # INTER_LINEAR clamps the sample position itself instead of repeating edge taps
+        fractions[starts < 0] = 0
+        starts[starts < 0] = 0
+        fractions[starts >= source_length - 1] = 0
+        starts[starts >= source_length - 1] = source_length - 1
+
+    weights = np.rint(weight_function(fractions) * np.float32(COEFFICIENT_SCALE))
+    columns = np.clip(starts[:, np.newaxis] - taps // 2 + 1 + np.arange(taps), 0, source_length - 1)
+    matrix = np.zeros((target_length, source_length))
+    np.add.at(matrix, (np.repeat(np.arange(target_length), taps), columns.ravel()), weights.ravel())
+    matrix.flags.writeable = False
+    return matrix
+
+
+@functools.lru_cache(maxsize = None)
+def upsampling_operator(shape, image_size, kernel = DEFAULT_KERNEL):
+    """
+    The two matrices of the separable resize from a (rows, cols) grid to a (width, height) image.
+    :return: (row_matrix, column_matrix); upsampled = row_matrix @ [grid @ column_matrix; 1].
+        row_matrix carries the final scaling and, in its extra last column, the 0.5 that turns truncation into rounding.
+    """
+    rows, cols = shape
+    width, height = image_size
+    dtype = UPSAMPLE_KERNELS[kernel][2]
+    row_matrix = np.hstack([interpolation_matrix(rows, height, kernel) * RESULT_SCALE, np.full((height, 1), 0.5)]).astype(dtype)
+    column_matrix = np.ascontiguousarray(interpolation_matrix(cols, width, kernel).T, dtype = dtype)
+    row_matrix.flags.writeable = False
+    column_matrix.flags.writeable = False
+    return row_matrix, column_matrix
+
+
+class SeparableUpsampler:
+    def __init__(self, geometry = DEFAULT_GEOMETRY, kernel = DEFAULT_KERNEL):
+        """
+        cv2.resize from the sensor grid to geometry.image_size as two small matrix multiplies.
+        The grid and image sizes never change, so the interpolation weights are worked out once
+        (and shared by every upsampler with the same sizes and kernel) instead of on every frame.
+        :param geometry: SensorGeometry of the frames.
+        :param kernel: Name in UPSAMPLE_KERNELS; bilinear and bicubic are softer and cheaper than lanczos4.
+        """
+        if kernel not in UPSAMPLE_KERNELS:
+            raise ValueError(f"Unknown upsampling kernel {kernel!r}, choose from {', '.join(UPSAMPLE_KERNELS)}")
+        self.kernel = kernel
+        self.cell_pixels = geometry.cell_pixels
+        self.row_matrix, self.column_matrix = upsampling_operator(geometry.shape, geometry.image_size, kernel)
+        width, height = geometry.image_size
+        dtype = self.row_matrix.dtype
+
+        self.grid = np.empty(geometry.shape, dtype = dtype)
+        # Rows resampled across, plus a row of ones for the rounding column of row_matrix
+        self.across = np.ones((geometry.rows + 1, width), dtype = dtype)
+        self.result = np.empty((height, width), dtype = dtype)
+        self.image = np.empty((height, width), dtype = np.uint8)
+
+    def upsample(self, grey, dst = None):
+        """
+        Resize an 8-bit grid of grey levels.
+        :param dst: uint8 (height, width) array to write into, may be a view; None uses the upsampler's own buffer.
+        """
+        np.copyto(self.grid, grey)
+        np.matmul(self.grid, self.column_matrix, out = self.across[:-1])
+        np.matmul(self.row_matrix, self.across, out = self.result)
+        # Everything is >= 0 after clipping, so the truncating cast rounds the 0.5-shifted values
+        np.clip(self.result, 0, 255, out = self.result)
+        if dst is None:
+            dst = self.image
+        np.copyto(dst, self.result, casting = 'unsafe')
+        return dst
+
+    def upsample_cells(self, grey, row_start, row_stop, col_start, col_stop):
+        """
+        The pixels upsample would give the cells rows row_start:row_stop, columns col_start:col_stop, and no others.
+        Only the matching slices of the two matrices are multiplied, so a few cells cost a fraction of the whole image.
+        :param grey: The whole 8-bit grid of grey levels; cells outside the range still weigh on the pixels near it.
+        :return: New uint8 array of (row_stop - row_start) * cell_pixels by (col_stop - col_start) * cell_pixels pixels.
+        """
+        cell_pixels = self.cell_pixels
+        np.copyto(self.grid, grey)
+        across = np.ones((self.grid.shape[0] + 1, (col_stop - col_start) * cell_pixels), dtype = self.grid.dtype)
+        np.matmul(self.grid, self.column_matrix[:, col_start * cell_pixels:col_stop * cell_pixels], out = across[:-1])
+        result = self.row_matrix[row_start * cell_pixels:row_stop * cell_pixels] @ across
+        np.clip(result, 0, 255, out = result)
+        return result.astype(np.uint8)